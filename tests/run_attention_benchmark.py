@@ -0,0 +1,195 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+Tool to measure the onnxruntime latency of a synthetic bert like encoder converted with and without
+the ms domain, so the Attention, SkipLayerNormalization, EmbedLayerNormalization, LayerNormalization
+and Gelu fusions are compared against the unfused graph. No models are downloaded.
+
+    python tests/run_attention_benchmark.py --layers 12 --batch-size 1 --seq-len 128
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+import tf2onnx
+from tf2onnx import constants, logging, optimizer, utils
+from tf2onnx.graph import GraphUtil
+from tf2onnx.tfonnx import process_tf_graph
+from run_pretrained_models import benchmark
+
+# pylint: disable=missing-docstring,import-outside-toplevel
+
+logger = logging.getLogger("run_attention_benchmark")
+
+TEMP_DIR = os.path.join(utils.get_temp_directory(), "run_attention_benchmark")
+
+INPUT_NAMES = ["input_ids:0", "segment_ids:0", "input_mask:0"]
+OUTPUT_NAMES = ["output:0"]
+
+
+def _layer_norm(x, hidden_size):
+    gamma = tf.constant(np.random.uniform(0.5, 1.5, [hidden_size]).astype(np.float32))
+    beta = tf.constant(np.random.uniform(-0.1, 0.1, [hidden_size]).astype(np.float32))
+    mean, variance = tf.nn.moments(x, [-1], keep_dims=True)
+    return tf.nn.batch_normalization(x, mean, variance, beta, gamma, 1e-12)
+
+
+def _dense(x, in_size, out_size):
+    w = tf.constant(np.random.normal(0, 0.02, [in_size, out_size]).astype(np.float32))
+    b = tf.constant(np.random.normal(0, 0.02, [out_size]).astype(np.float32))
+    return tf.matmul(x, w) + b
+
+
+def _gelu(x):
+    return x * 0.5 * (1.0 + tf.erf(x / np.sqrt(2.0).astype(np.float32)))
+
+
+def _attention(x, adder, seq_len, num_heads, head_size):
+    """Self attention as in bert modeling.py, x is [batch * seq, hidden]."""
+    hidden_size = num_heads * head_size
+
+    def heads(t):
+        t = tf.reshape(t, [-1, seq_len, num_heads, head_size])
+        return tf.transpose(t, [0, 2, 1, 3])
+
+    q = heads(_dense(x, hidden_size, hidden_size))
+    k = heads(_dense(x, hidden_size, hidden_size))
+    v = heads(_dense(x, hidden_size, hidden_size))
+    scores = tf.matmul(q, k, transpose_b=True) * (1.0 / np.sqrt(head_size))
+    probs = tf.nn.softmax(scores + adder)
+    context = tf.transpose(tf.matmul(probs, v), [0, 2, 1, 3])
+    return tf.reshape(context, [-1, hidden_size])
+
+
+def build_encoder(layers, seq_len, hidden_size, num_heads, vocab_size):
+    """Bert like encoder of the given number of layers, with the embeddings and the attention mask."""
+    intermediate_size = 4 * hidden_size
+    input_ids = tf.placeholder(tf.int32, [None, seq_len], name="input_ids")
+    segment_ids = tf.placeholder(tf.int32, [None, seq_len], name="segment_ids")
+    input_mask = tf.placeholder(tf.float32, [None, seq_len], name="input_mask")
+
+    word_table = tf.constant(np.random.normal(0, 0.02, [vocab_size, hidden_size]).astype(np.float32))
+    segment_table = tf.constant(np.random.normal(0, 0.02, [2, hidden_size]).astype(np.float32))
+    position = tf.constant(np.random.normal(0, 0.02, [seq_len, hidden_size]).astype(np.float32))
+    x = tf.gather(word_table, input_ids) + tf.gather(segment_table, segment_ids) + position
+    x = tf.reshape(_layer_norm(x, hidden_size), [-1, hidden_size])
+
+    adder = (1.0 - tf.reshape(input_mask, [-1, 1, 1, seq_len])) * -10000.0
+    for _ in range(layers):
+        attention = _dense(_attention(x, adder, seq_len, num_heads, hidden_size // num_heads), hidden_size,
+                           hidden_size)
+        x = _layer_norm(attention + x, hidden_size)
+        intermediate = _gelu(_dense(x, hidden_size, intermediate_size))
+        x = _layer_norm(_dense(intermediate, intermediate_size, hidden_size) + x, hidden_size)
+    return tf.identity(tf.reshape(x, [-1, seq_len, hidden_size]), name="output")
+
+
+def make_inputs(batch_size, seq_len, vocab_size):
+    mask = np.ones([batch_size, seq_len], dtype=np.float32)
+    # pad the second half of every other sequence
+    mask[1::2, seq_len // 2:] = 0
+    return {
+        "input_ids:0": np.random.randint(0, vocab_size, [batch_size, seq_len]).astype(np.int32),
+        "segment_ids:0": np.concatenate([np.zeros([batch_size, seq_len // 2], dtype=np.int32),
+                                         np.ones([batch_size, seq_len - seq_len // 2], dtype=np.int32)], axis=1),
+        "input_mask:0": mask,
+    }
+
+
+def convert(graph_def, opset, extra_opset):
+    g = process_tf_graph(graph_def, opset=opset, extra_opset=extra_opset, input_names=INPUT_NAMES,
+                         output_names=OUTPUT_NAMES)
+    g = optimizer.optimize_graph(g)
+    return g.make_model("attention benchmark")
+
+
+def run_onnxruntime(name, model_proto, inputs, warmup, iterations, threads):
+    import onnxruntime as rt
+    model_path = utils.save_onnx_model(TEMP_DIR, name, inputs, model_proto)
+    opts = rt.SessionOptions()
+    if threads:
+        opts.intra_op_num_threads = threads
+    m = rt.InferenceSession(model_path, opts)
+    result = m.run(OUTPUT_NAMES, inputs)[0]
+    stats = benchmark(lambda: m.run(OUTPUT_NAMES, inputs), warmup, iterations)
+    return result, stats
+
+
+def get_args():
+    """Parse commandline."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=12, help="number of encoder layers")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch size")
+    parser.add_argument("--seq-len", type=int, default=128, help="sequence length")
+    parser.add_argument("--hidden-size", type=int, default=768, help="hidden size")
+    parser.add_argument("--num-heads", type=int, default=12, help="number of attention heads")
+    parser.add_argument("--vocab-size", type=int, default=30522, help="vocabulary size")
+    parser.add_argument("--opset", type=int, default=None, help="opset to use")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed runs before measuring")
+    parser.add_argument("--iterations", type=int, default=100, help="timed runs")
+    parser.add_argument("--threads", type=int, default=None, help="onnxruntime intra op threads")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--verbose", "-v", help="verbose output, option is additive", action="count")
+    args = parser.parse_args()
+    if args.hidden_size % args.num_heads:
+        parser.error("hidden size must be a multiple of the number of heads")
+    return args
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.get_verbosity_level(args.verbose))
+    logging.set_level(logging.get_verbosity_level(args.verbose, logging.WARNING))
+    np.random.seed(0)
+
+    opset = utils.find_opset(args.opset)
+    with tf.Graph().as_default() as tf_graph:
+        build_encoder(args.layers, args.seq_len, args.hidden_size, args.num_heads, args.vocab_size)
+    graph_def = tf_graph.as_graph_def(add_shapes=True)
+    inputs = make_inputs(args.batch_size, args.seq_len, args.vocab_size)
+    with tf.Session(graph=tf_graph) as sess:
+        expected = sess.run(OUTPUT_NAMES[0], feed_dict=inputs)
+
+    results = OrderedDict()
+    for name, extra_opset in [("unfused", None),
+                              ("fused", [utils.make_opsetid(constants.MICROSOFT_DOMAIN, 1)])]:
+        model_proto = convert(graph_def, opset, extra_opset)
+        actual, stats = run_onnxruntime(name, model_proto, inputs, args.warmup, args.iterations, args.threads)
+        np.testing.assert_allclose(expected, actual, rtol=1e-3, atol=1e-3)
+        ops = GraphUtil.get_node_count_from_onnx_graph(model_proto.graph)
+        results[name] = OrderedDict([("nodes", sum(ops.values())), ("ops", ops), ("latency", stats)])
+        logger.info("%s: %d nodes, p50=%.3fms p90=%.3fms p99=%.3fms", name, results[name]["nodes"],
+                    stats["p50_ms"], stats["p90_ms"], stats["p99_ms"])
+        logger.info("%s ops: %s", name, ", ".join("{} {}".format(k, v) for k, v in sorted(ops.items())))
+
+    speedup = results["unfused"]["latency"]["p50_ms"] / results["fused"]["latency"]["p50_ms"]
+    logger.info("fused p50 speedup over unfused: %.2fx", speedup)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "versions": {"tensorflow": tf.__version__, "onnx": utils.get_onnx_version(),
+                             "tf2onnx": tf2onnx.__version__},
+                "opset": opset,
+                "settings": {k: v for k, v in vars(args).items() if k not in ["output", "verbose"]},
+                "speedup": speedup,
+                "results": results,
+            }, f, indent=2)
+        logger.info("Results are saved at %s", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
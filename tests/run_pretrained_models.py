@@ -9,13 +9,24 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import csv
+import itertools
+import json
+import multiprocessing
 import os
+import queue
 import re
 import sys
 import tarfile
 import time
 import zipfile
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
 
 import PIL.Image
 import numpy as np
@@ -27,7 +38,8 @@ import tensorflow.contrib.rnn  # pylint: disable=unused-import
 import yaml
 
 import tf2onnx
-from tf2onnx import loader, logging, optimizer, utils
+from tf2onnx import float16, loader, logging, optimizer, ort_profile, profiler, utils
+from tf2onnx.graph import GraphUtil
 from tf2onnx.tfonnx import process_tf_graph
 
 # pylint: disable=broad-except,logging-not-lazy,unused-argument,unnecessary-lambda,import-outside-toplevel
@@ -36,6 +48,18 @@ logger = logging.getLogger("run_pretrained")
 
 TEMP_DIR = os.path.join(utils.get_temp_directory(), "run_pretrained")
 PERFITER = 1000
+PERFWARMUP = 10
+# tolerances of models running in float16 are at least these
+FP16_RTOL = 0.02
+FP16_ATOL = 1e-3
+
+# conversion stages recorded by --conversion-stats, in order
+CONVERSION_STAGES = ["load", "tf_optimize", "process_tf_graph", "optimize_graph", "make_model"]
+# changes of conversion stats that are flagged as regressions against --baseline
+REGRESSION_KEYS = CONVERSION_STAGES + ["total", "peak_rss_mb", "tracemalloc_peak_mb", "model_size",
+                                       "nodes_after_optimize", "transposes_after_optimize", "casts_after_optimize"]
+# timings that changed less than this many seconds are noise
+REGRESSION_MIN_SECONDS = 0.05
 
 
 def get_beach(shape):
@@ -74,12 +98,74 @@ _INPUT_FUNC_MAPPING = {
 
 OpsetConstraint = namedtuple("OpsetConstraint", "domain, min_version, max_version, excluded_version")
 
+# batch_size None keeps the inputs as configured in the yaml
+BenchmarkConfig = namedtuple("BenchmarkConfig", "warmup, iterations, batch_size, intra_op_threads, "
+                                                "inter_op_threads, opt_levels")
+
+_ORT_OPT_LEVELS = ["disable", "basic", "extended", "all"]
+
+
+def benchmark(func, warmup, iterations):
+    """Time iterations runs of func after warmup runs, return latency stats in milliseconds."""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return OrderedDict([
+        ("warmup", warmup),
+        ("iterations", iterations),
+        ("mean_ms", float(np.mean(times))),
+        ("p50_ms", float(np.percentile(times, 50))),
+        ("p90_ms", float(np.percentile(times, 90))),
+        ("p99_ms", float(np.percentile(times, 99))),
+        ("min_ms", float(np.min(times))),
+        ("max_ms", float(np.max(times))),
+        ("total_s", float(np.sum(times)) / 1000),
+    ])
+
+
+@contextmanager
+def cache_lock(path):
+    """Lock path across processes, so parallel workers don't download or extract the same model at once."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def perf_section():
+    """Serialize timing between parallel workers if --serial-perf is given."""
+    if Test.perf_lock is None:
+        yield
+        return
+    with Test.perf_lock:
+        yield
+
+
+def resize_batch(value, batch_size):
+    """Repeat or cut value along the first axis to batch_size."""
+    if value.ndim == 0:
+        return value
+    return np.take(value, np.arange(batch_size) % value.shape[0], axis=0)
+
 
 class Test(object):
     """Main Test class."""
 
     cache_dir = None
     target = []
+    # shared by worker processes with --serial-perf
+    perf_lock = None
 
     def __init__(self, url, local, make_input, input_names, output_names,
                  disabled=False, rtol=0.01, atol=1e-6,
@@ -97,6 +183,13 @@ class Test(object):
         self.perf = None
         self.tf_runtime = 0
         self.onnx_runtime = 0
+        self.model_size = None
+        self.op_counts = None
+        self.conversion_stats = None
+        self.benchmark = None
+        self.benchmark_results = []
+        self.ort_profile_dir = None
+        self.onnx_graph = None
         self.model_type = model_type
         self.force_input_shape = force_input_shape
         self.skip_tensorflow = skip_tensorflow
@@ -121,18 +214,22 @@ class Test(object):
         dir_name = os.path.join(cache_dir, dir_name)
         os.makedirs(dir_name, exist_ok=True)
         fpath = os.path.join(dir_name, fname)
-        if not os.path.exists(fpath):
-            utils.get_url(url, fpath)
         model_path = os.path.join(dir_name, self.local)
-        if not os.path.exists(model_path):
-            if ftype == 'tgz':
-                tar = tarfile.open(fpath)
-                tar.extractall(dir_name)
-                tar.close()
-            elif ftype == 'zip':
-                zip_ref = zipfile.ZipFile(fpath, 'r')
-                zip_ref.extractall(dir_name)
-                zip_ref.close()
+        with cache_lock(dir_name):
+            if not os.path.exists(fpath):
+                # download to a temporary name so an interrupted download is not taken for the model
+                tmp_path = "{}.{}.tmp".format(fpath, os.getpid())
+                utils.get_url(url, tmp_path)
+                os.replace(tmp_path, fpath)
+            if not os.path.exists(model_path):
+                if ftype == 'tgz':
+                    tar = tarfile.open(fpath)
+                    tar.extractall(dir_name)
+                    tar.close()
+                elif ftype == 'zip':
+                    zip_ref = zipfile.ZipFile(fpath, 'r')
+                    zip_ref.extractall(dir_name)
+                    zip_ref.close()
         return fpath, dir_name
 
     def run_tensorflow(self, sess, inputs):
@@ -142,11 +239,13 @@ class Test(object):
             k = sess.graph.get_tensor_by_name(k)
             feed_dict[k] = v
         result = sess.run(self.output_names, feed_dict=feed_dict)
-        if self.perf:
-            start = time.time()
-            for _ in range(PERFITER):
-                _ = sess.run(self.output_names, feed_dict=feed_dict)
-            self.tf_runtime = time.time() - start
+        run = lambda: sess.run(self.output_names, feed_dict=feed_dict)
+        with perf_section():
+            if self.perf:
+                self.tf_runtime = benchmark(run, PERFWARMUP, PERFITER)["total_s"]
+            if self.benchmark:
+                stats = benchmark(run, self.benchmark.warmup, self.benchmark.iterations)
+                self.add_benchmark_result("tensorflow", inputs, stats)
         return result
 
     def to_onnx(self, tf_graph, opset=None, extra_opset=None, shape_override=None, input_names=None):
@@ -160,11 +259,13 @@ class Test(object):
         import caffe2.python.onnx.backend
         prepared_backend = caffe2.python.onnx.backend.prepare(model_proto)
         results = prepared_backend.run(inputs)
-        if self.perf:
-            start = time.time()
-            for _ in range(PERFITER):
-                _ = prepared_backend.run(inputs)
-            self.onnx_runtime = time.time() - start
+        run = lambda: prepared_backend.run(inputs)
+        with perf_section():
+            if self.perf:
+                self.onnx_runtime = benchmark(run, PERFWARMUP, PERFITER)["total_s"]
+            if self.benchmark:
+                stats = benchmark(run, self.benchmark.warmup, self.benchmark.iterations)
+                self.add_benchmark_result("caffe2", inputs, stats)
         return results
 
     def run_onnxruntime(self, name, model_proto, inputs):
@@ -175,13 +276,63 @@ class Test(object):
         logger.info("Model saved to %s", model_path)
         m = rt.InferenceSession(model_path)
         results = m.run(self.output_names, inputs)
-        if self.perf:
-            start = time.time()
-            for _ in range(PERFITER):
-                _ = m.run(self.output_names, inputs)
-            self.onnx_runtime = time.time() - start
+        with perf_section():
+            if self.perf:
+                self.onnx_runtime = benchmark(lambda: m.run(self.output_names, inputs), PERFWARMUP,
+                                              PERFITER)["total_s"]
+            if self.benchmark:
+                self.benchmark_onnxruntime(model_path, inputs)
+            if self.ort_profile_dir:
+                self.profile_onnxruntime(name, model_path, inputs)
         return results
 
+    def profile_onnxruntime(self, name, model_path, inputs):
+        """Profile onnxruntime per node and write which tf nodes the inference time went to."""
+        os.makedirs(self.ort_profile_dir, exist_ok=True)
+        profile_path = ort_profile.run_profiled(model_path, inputs, self.output_names,
+                                                profile_prefix=os.path.join(self.ort_profile_dir, name))
+        report = ort_profile.attribute_node_times(ort_profile.load_node_times(profile_path), self.onnx_graph)
+        with open(os.path.join(self.ort_profile_dir, name + "_tf_nodes.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info("Inference time by tf node:\n%s", ort_profile.format_report(report))
+
+    def benchmark_onnxruntime(self, model_path, inputs):
+        """Benchmark onnxruntime over the configured thread counts and graph optimization levels."""
+        import onnxruntime as rt
+        config = self.benchmark
+        for intra, inter, level in itertools.product(config.intra_op_threads, config.inter_op_threads,
+                                                     config.opt_levels):
+            opts = rt.SessionOptions()
+            opts.intra_op_num_threads = intra
+            opts.inter_op_num_threads = inter
+            if hasattr(rt, "GraphOptimizationLevel"):
+                opts.graph_optimization_level = {
+                    "disable": rt.GraphOptimizationLevel.ORT_DISABLE_ALL,
+                    "basic": rt.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+                    "extended": rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+                    "all": rt.GraphOptimizationLevel.ORT_ENABLE_ALL,
+                }[level]
+            else:
+                # older onnxruntime takes the level as int
+                opts.graph_optimization_level = _ORT_OPT_LEVELS.index(level)
+            m = rt.InferenceSession(model_path, opts)
+            stats = benchmark(lambda m=m: m.run(self.output_names, inputs), config.warmup, config.iterations)
+            self.add_benchmark_result("onnxruntime", inputs, stats, intra_op_num_threads=intra,
+                                      inter_op_num_threads=inter, graph_optimization_level=level)
+
+    def add_benchmark_result(self, backend, inputs, stats, **settings):
+        """Record benchmark stats together with batch size and throughput."""
+        shapes = [v.shape for v in inputs.values() if v.ndim > 0]
+        batch_size = shapes[0][0] if shapes else 1
+        result = OrderedDict([("backend", backend), ("batch_size", int(batch_size))])
+        result.update(settings)
+        result.update(stats)
+        result["throughput"] = batch_size * 1000 / stats["mean_ms"] if stats["mean_ms"] else None
+        self.benchmark_results.append(result)
+        logger.info("Benchmark %s batch=%s %s: p50=%.3fms p90=%.3fms p99=%.3fms, %.1f/s", backend, batch_size,
+                    " ".join("{}={}".format(k, v) for k, v in settings.items()), stats["p50_ms"],
+                    stats["p90_ms"], stats["p99_ms"], result["throughput"] or 0)
+
     @staticmethod
     def create_onnx_file(name, model_proto, inputs, outdir):
         os.makedirs(outdir, exist_ok=True)
@@ -190,9 +341,11 @@ class Test(object):
         logger.info("Created %s", model_path)
 
     def run_test(self, name, backend="caffe2", onnx_file=None, opset=None, extra_opset=None,
-                 perf=None, fold_const=None):
+                 perf=None, fold_const=None, benchmark_config=None, ort_profile_dir=None, precision="fp32"):
         """Run complete test against backend."""
         self.perf = perf
+        self.benchmark = benchmark_config
+        self.ort_profile_dir = ort_profile_dir
 
         # get the model
         if self.url:
@@ -205,16 +358,19 @@ class Test(object):
         logger.info("Load model from %s", model_path)
         input_names = list(self.input_names.keys())
         outputs = self.output_names
-        if self.model_type in ["checkpoint"]:
-            graph_def, input_names, outputs = loader.from_checkpoint(model_path, input_names, outputs)
-        elif self.model_type in ["saved_model"]:
-            graph_def, input_names, outputs = loader.from_saved_model(model_path, input_names, outputs)
-        else:
-            graph_def, input_names, outputs = loader.from_graphdef(model_path, input_names, outputs)
+        with profiler.phase("load"):
+            if self.model_type in ["checkpoint"]:
+                graph_def, input_names, outputs = loader.from_checkpoint(model_path, input_names, outputs)
+            elif self.model_type in ["saved_model"]:
+                graph_def, input_names, outputs = loader.from_saved_model(model_path, input_names, outputs)
+            else:
+                graph_def, input_names, outputs = loader.from_graphdef(model_path, input_names, outputs)
 
         # remove unused input names
         input_names = list(set(input_names).intersection(self.input_names.keys()))
-        graph_def = tf2onnx.tfonnx.tf_optimize(input_names, self.output_names, graph_def, fold_const)
+        with profiler.phase("tf_optimize", graph_def) as span:
+            graph_def = tf2onnx.tfonnx.tf_optimize(input_names, self.output_names, graph_def, fold_const)
+            span.graph = graph_def
         if utils.is_debug_mode():
             utils.save_protobuf(os.path.join(TEMP_DIR, name + "_after_tf_optimize.pb"), graph_def)
 
@@ -236,7 +392,11 @@ class Test(object):
                 else:
                     inputs[k] = self.make_input(v).astype(expected_dtype)
 
-            if self.force_input_shape:
+            batch_size = self.benchmark.batch_size if self.benchmark else None
+            if batch_size:
+                inputs = {k: resize_batch(v, batch_size) for k, v in inputs.items()}
+
+            if self.force_input_shape or batch_size:
                 for k, v in inputs.items():
                     shape_override[k] = list(v.shape)
 
@@ -250,10 +410,22 @@ class Test(object):
             model_proto = None
             try:
                 # convert model to onnx
-                onnx_graph = self.to_onnx(sess.graph, opset=opset, extra_opset=extra_opset,
-                                          shape_override=shape_override, input_names=inputs.keys())
-                onnx_graph = optimizer.optimize_graph(onnx_graph)
-                model_proto = onnx_graph.make_model("converted from tf2onnx")
+                with profiler.phase("process_tf_graph", sess.graph) as span:
+                    onnx_graph = self.to_onnx(sess.graph, opset=opset, extra_opset=extra_opset,
+                                              shape_override=shape_override, input_names=inputs.keys())
+                    span.graph = onnx_graph
+                if precision == "fp16":
+                    with profiler.phase("float16", onnx_graph):
+                        float16.convert_float_to_float16(onnx_graph)
+                with profiler.phase("optimize_graph", onnx_graph) as span:
+                    onnx_graph = optimizer.optimize_graph(onnx_graph)
+                    span.graph = onnx_graph
+                with profiler.phase("make_model", onnx_graph):
+                    model_proto = onnx_graph.make_model("converted from tf2onnx")
+                # kept to map onnxruntime node profiling back to the tf nodes
+                self.onnx_graph = onnx_graph
+                self.model_size = model_proto.ByteSize()
+                self.op_counts = GraphUtil.get_node_count_from_onnx_graph(model_proto.graph)
                 logger.info("To_ONNX, OK")
                 if onnx_file:
                     self.create_onnx_file(name, model_proto, inputs, onnx_file)
@@ -279,8 +451,11 @@ class Test(object):
                         for tf_res, onnx_res in zip(tf_results, onnx_results):
                             np.testing.assert_array_equal(tf_res.shape, onnx_res.shape)
                     else:
+                        rtol, atol = self.rtol, self.atol
+                        if precision == "fp16":
+                            rtol, atol = max(rtol, FP16_RTOL), max(atol, FP16_ATOL)
                         for tf_res, onnx_res in zip(tf_results, onnx_results):
-                            np.testing.assert_allclose(tf_res, onnx_res, rtol=self.rtol, atol=self.atol)
+                            np.testing.assert_allclose(tf_res, onnx_res, rtol=rtol, atol=atol)
                     logger.info("Results: OK")
                 return True
             except Exception:
@@ -344,12 +519,48 @@ def get_args():
     parser.add_argument("--list", help="list tests", action="store_true")
     parser.add_argument("--onnx-file", help="create onnx file in directory")
     parser.add_argument("--perf", help="capture performance numbers")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "fp16"],
+                        help="precision of the converted models, fp16 results are compared with wider tolerances")
     parser.add_argument("--fold_const", help="enable tf constant_folding transformation before conversion",
                         action="store_true")
     parser.add_argument("--include-disabled", help="include disabled tests", action="store_true")
+    parser.add_argument("--conversion-stats",
+                        help="write time of each conversion stage, peak memory, node counts and model size "
+                             "to this csv or json file")
+    parser.add_argument("--trace-memory", help="record python allocation peak of the conversion, slower",
+                        action="store_true")
+    parser.add_argument("--baseline", help="conversion stats of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="flag conversion stats larger than the baseline by this fraction")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="run tests in this many worker processes")
+    parser.add_argument("--timeout", type=int, default=None,
+                        help="seconds after which a test is killed, tests run in worker processes if given")
+    parser.add_argument("--serial-perf", action="store_true",
+                        help="with --jobs, take --perf and --benchmark measurements one test at a time")
+    parser.add_argument("--benchmark", help="benchmark inference latency and throughput, write json to this file")
+    parser.add_argument("--benchmark-warmup", type=int, default=PERFWARMUP, help="runs before timing starts")
+    parser.add_argument("--benchmark-iters", type=int, default=100, help="timed runs per benchmark")
+    parser.add_argument("--batch-sizes", help="comma separated batch sizes to benchmark, the model is converted "
+                                              "for each of them with the batch dimension overridden")
+    parser.add_argument("--ort-intra-op-threads", default="0",
+                        help="comma separated onnxruntime intra op thread counts to benchmark, 0 is default")
+    parser.add_argument("--ort-inter-op-threads", default="0",
+                        help="comma separated onnxruntime inter op thread counts to benchmark, 0 is default")
+    parser.add_argument("--ort-profile", help="profile onnxruntime per node and write the time spent on every "
+                        "tf node to this directory")
+    parser.add_argument("--ort-opt-levels", default="all",
+                        help="comma separated onnxruntime graph optimization levels to benchmark, out of " +
+                        ",".join(_ORT_OPT_LEVELS))
     args = parser.parse_args()
 
     args.target = args.target.split(",")
+    args.batch_sizes = [int(b) for b in args.batch_sizes.split(",")] if args.batch_sizes else [None]
+    args.ort_intra_op_threads = [int(n) for n in args.ort_intra_op_threads.split(",")]
+    args.ort_inter_op_threads = [int(n) for n in args.ort_inter_op_threads.split(",")]
+    args.ort_opt_levels = args.ort_opt_levels.split(",")
+    for level in args.ort_opt_levels:
+        if level not in _ORT_OPT_LEVELS:
+            parser.error("invalid onnxruntime optimization level " + level)
     if args.extra_opset:
         tokens = args.extra_opset.split(':')
         if len(tokens) != 2:
@@ -358,6 +569,192 @@ def get_args():
     return args
 
 
+def get_conversion_stats(prof, model_size, op_counts=None):
+    """Conversion stats of a test from the profiler it was run with."""
+    events = {}
+    for e in prof.events:
+        events.setdefault(e["name"], e)
+    stats = OrderedDict()
+    for stage in CONVERSION_STAGES:
+        e = events.get(stage)
+        stats[stage] = e["dur"] / 1e6 if e else None
+    stats["total"] = sum(v for v in stats.values() if v)
+    stats["tf_nodes"] = events["process_tf_graph"]["args"].get("nodes_before") if "process_tf_graph" in events \
+        else None
+    opt = events.get("optimize_graph")
+    stats["nodes_before_optimize"] = opt["args"].get("nodes_before") if opt else None
+    stats["nodes_after_optimize"] = opt["args"].get("nodes_after") if opt else None
+    # transposes and casts left in the main graph, the ones the optimizers could not remove
+    stats["transposes_after_optimize"] = op_counts.get("Transpose", 0) if op_counts is not None else None
+    stats["casts_after_optimize"] = op_counts.get("Cast", 0) if op_counts is not None else None
+    # peak RSS is the high-water mark of the process, so it grows over the tests
+    for key in ["peak_rss_mb", "tracemalloc_peak_mb"]:
+        values = [e["args"][key] for e in prof.events if key in e["args"]]
+        stats[key] = max(values) if values else None
+    stats["model_size"] = model_size
+    return stats
+
+
+def save_conversion_stats(path, conversion_stats):
+    """Save {test: stats} as json if path ends with .json, as csv otherwise."""
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(conversion_stats, f, indent=2)
+        return
+    columns = ["test"] + CONVERSION_STAGES + ["total", "tf_nodes", "nodes_before_optimize",
+                                              "nodes_after_optimize", "transposes_after_optimize",
+                                              "casts_after_optimize", "peak_rss_mb", "tracemalloc_peak_mb",
+                                              "model_size"]
+    with open(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for test, stats in conversion_stats.items():
+            writer.writerow([test] + ["" if stats.get(c) is None else stats[c] for c in columns[1:]])
+
+
+def load_conversion_stats(path):
+    """Load conversion stats saved by save_conversion_stats."""
+    with open(path, "r") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        conversion_stats = {}
+        for row in csv.DictReader(f):
+            test = row.pop("test")
+            conversion_stats[test] = {k: float(v) if v else None for k, v in row.items()}
+        return conversion_stats
+
+
+def find_conversion_regressions(conversion_stats, baseline, threshold):
+    """Return readable list of stats that grew over the baseline by more than threshold."""
+    regressions = []
+    for test, stats in conversion_stats.items():
+        base = baseline.get(test)
+        if not base:
+            continue
+        for key in REGRESSION_KEYS:
+            new, old = stats.get(key), base.get(key)
+            if new is None or not old or new <= old * (1 + threshold):
+                continue
+            if (key in CONVERSION_STAGES or key == "total") and new - old < REGRESSION_MIN_SECONDS:
+                continue
+            regressions.append("{} {}: {:.6g} -> {:.6g} (+{:.0%})".format(test, key, old, new, new / old - 1))
+    return regressions
+
+
+def run_test_with_args(t, test, args, benchmark_config=None):
+    """Run a test with the options of the commandline, record conversion stats if asked for."""
+    kwargs = dict(backend=args.backend, onnx_file=args.onnx_file, opset=args.opset, extra_opset=args.extra_opset,
+                  perf=args.perf, fold_const=args.fold_const, benchmark_config=benchmark_config,
+                  ort_profile_dir=args.ort_profile, precision=args.precision)
+    if not (args.conversion_stats or args.baseline):
+        return t.run_test(test, **kwargs)
+    with profiler.Profiler(trace_memory=args.trace_memory) as prof:
+        ret = t.run_test(test, **kwargs)
+    t.conversion_stats = get_conversion_stats(prof, t.model_size, t.op_counts)
+    return ret
+
+
+def run_single_test(t, test, args):
+    """Run a test, in benchmark mode once per batch size, return True if it passed."""
+    try:
+        logger.info("Running %s", test)
+        if args.benchmark:
+            # every batch size needs its own conversion with the batch dimension overridden
+            ret = True
+            for batch_size in args.batch_sizes:
+                config = BenchmarkConfig(args.benchmark_warmup, args.benchmark_iters, batch_size,
+                                         args.ort_intra_op_threads, args.ort_inter_op_threads,
+                                         args.ort_opt_levels)
+                ret = run_test_with_args(t, test, args, config) and ret
+        else:
+            ret = run_test_with_args(t, test, args)
+    except Exception:
+        logger.error("Failed to run %s", test, exc_info=1)
+        ret = None
+    finally:
+        if not utils.is_debug_mode():
+            utils.delete_directory(TEMP_DIR)
+    return bool(ret)
+
+
+def _worker_main(test, args, perf_lock, result_queue):
+    """Entry of a worker process, runs one test and puts its results into result_queue."""
+    global TEMP_DIR
+    logging.basicConfig(level=logging.get_verbosity_level(args.verbose),
+                        format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+    if args.debug:
+        utils.set_debug_mode(True)
+    # every worker deletes its temp dir after the test
+    TEMP_DIR = os.path.join(utils.get_temp_directory(), "run_pretrained_{}".format(os.getpid()))
+    Test.cache_dir = args.cache
+    Test.target = args.target
+    Test.perf_lock = perf_lock
+    t = load_tests_from_yaml(args.config)[test]
+    ret = run_single_test(t, test, args)
+    result_queue.put((test, ret, t.tf_runtime, t.onnx_runtime, t.model_size, t.conversion_stats,
+                      t.benchmark_results))
+
+
+def run_tests_in_workers(tests, test_keys, args):
+    """
+    Run tests in up to args.jobs worker processes, tensorflow state is global to a process.
+    Copy the results into the Test objects, return {test: passed}.
+    """
+    # fork would copy the tensorflow runtime of this process
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    perf_lock = ctx.Lock() if args.serial_perf else None
+    pending = list(test_keys)
+    running = OrderedDict()
+    passed = OrderedDict()
+
+    def collect(timeout):
+        """Take all results from the queue, wait up to timeout for the first one."""
+        while True:
+            try:
+                test, ret, tf_runtime, onnx_runtime, model_size, conversion_stats, benchmark_results = \
+                    result_queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            timeout = 0.01
+            t = tests[test]
+            t.perf = args.perf
+            t.tf_runtime = tf_runtime
+            t.onnx_runtime = onnx_runtime
+            t.model_size = model_size
+            t.conversion_stats = conversion_stats
+            t.benchmark_results = benchmark_results
+            passed[test] = ret
+
+    while pending or running:
+        while pending and len(running) < args.jobs:
+            test = pending.pop(0)
+            p = ctx.Process(target=_worker_main, args=(test, args, perf_lock, result_queue), name=test)
+            p.start()
+            running[test] = (p, time.time())
+        collect(timeout=1)
+        for test, (p, start) in list(running.items()):
+            if test in passed:
+                p.join()
+            elif not p.is_alive():
+                # results are in the queue before the process ends
+                collect(timeout=0.1)
+                if test not in passed:
+                    logger.error("Worker of %s exited with code %s", test, p.exitcode)
+                    passed[test] = False
+            elif args.timeout and time.time() - start > args.timeout:
+                logger.error("Timeout: %s did not finish in %s seconds, killed", test, args.timeout)
+                p.terminate()
+                p.join()
+                passed[test] = False
+            else:
+                continue
+            del running[test]
+            logger.info("%s: %s (%s running, %s pending)", test, "OK" if passed[test] else "FAIL",
+                        len(running), len(pending))
+    return passed
+
+
 def load_tests_from_yaml(path):
     """Create test class from yaml file."""
     path = os.path.abspath(path)
@@ -429,11 +826,8 @@ def main():
     else:
         test_keys = list(tests.keys())
 
-    failed = 0
-    count = 0
+    to_run = []
     for test in test_keys:
-        logger.info("===================================")
-
         t = tests[test]
         if args.tests is None:
             if t.disabled and not args.include_disabled:
@@ -444,32 +838,50 @@ def main():
             if not condition:
                 logger.info("Skip %s: %s", test, reason)
                 continue
+        to_run.append(test)
 
-        count += 1
-        try:
-            logger.info("Running %s", test)
-            ret = t.run_test(test, backend=args.backend, onnx_file=args.onnx_file,
-                             opset=args.opset, extra_opset=args.extra_opset, perf=args.perf,
-                             fold_const=args.fold_const)
-        except Exception:
-            logger.error("Failed to run %s", test, exc_info=1)
-            ret = None
-        finally:
-            if not utils.is_debug_mode():
-                utils.delete_directory(TEMP_DIR)
-        if not ret:
-            failed += 1
+    if args.jobs > 1 or args.timeout:
+        passed = run_tests_in_workers(tests, to_run, args)
+    else:
+        passed = OrderedDict()
+        for test in to_run:
+            logger.info("===================================")
+            passed[test] = run_single_test(tests[test], test, args)
+
+    count = len(to_run)
+    failed = sum(1 for test in to_run if not passed.get(test))
+    conversion_stats = OrderedDict(
+        (test, tests[test].conversion_stats) for test in to_run if tests[test].conversion_stats)
 
     logger.info("===================================")
     logger.info("RESULT: %s failed of %s, backend=%s", failed, count, args.backend)
 
     if args.perf:
         with open(args.perf, "w") as f:
-            f.write("test,tensorflow,onnx\n")
+            f.write("test,tensorflow,onnx,model_size\n")
             for test in test_keys:
                 t = tests[test]
                 if t.perf:
-                    f.write("{},{},{}\n".format(test, t.tf_runtime, t.onnx_runtime))
+                    f.write("{},{},{},{}\n".format(test, t.tf_runtime, t.onnx_runtime, t.model_size))
+
+    if args.benchmark:
+        with open(args.benchmark, "w") as f:
+            json.dump({test: tests[test].benchmark_results for test in test_keys if tests[test].benchmark_results},
+                      f, indent=2)
+        logger.info("Benchmark results are saved at %s", args.benchmark)
+
+    if args.conversion_stats:
+        save_conversion_stats(args.conversion_stats, conversion_stats)
+        logger.info("Conversion stats are saved at %s", args.conversion_stats)
+
+    if args.baseline:
+        regressions = find_conversion_regressions(conversion_stats, load_conversion_stats(args.baseline),
+                                                  args.threshold)
+        for r in regressions:
+            logger.error("CONVERSION REGRESSION: %s", r)
+        logger.info("%s conversion regressions compared to %s", len(regressions), args.baseline)
+        if regressions and not failed:
+            return 1
     return failed
 
 
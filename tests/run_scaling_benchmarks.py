@@ -0,0 +1,342 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+Tool to measure how the converter core scales with graph size on synthetic graphs.
+
+Every benchmark is timed at each size and the growth exponent k of time ~ nodes^k is
+fitted, so a change that turns a linear pass into a quadratic one shows up as k going
+from ~1 to ~2. No models are downloaded.
+
+    python tests/run_scaling_benchmarks.py --sizes 1000,10000 --output scaling.json
+    python tests/run_scaling_benchmarks.py --sizes 1000,10000 --baseline scaling.json
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import copy
+import json
+import math
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+from onnx import helper, TensorProto
+
+import tf2onnx
+from tf2onnx import logging, optimizer, utils
+from tf2onnx.graph import GraphUtil
+from tf2onnx.tfonnx import process_tf_graph
+
+# pylint: disable=broad-except,missing-docstring
+
+logger = logging.getLogger("run_scaling_benchmarks")
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# graph operations are timed on this many calls so per call costs are comparable between sizes
+GRAPH_OP_SAMPLES = 200
+
+
+def _chain(size):
+    """A single long chain of unary ops."""
+    x = tf.placeholder(tf.float32, [1, 16], name="input")
+    for _ in range(size):
+        x = tf.abs(x)
+    return tf.identity(x, name="output")
+
+
+def _fan_out(size):
+    """One tensor consumed by many branches which are summed up again."""
+    x = tf.placeholder(tf.float32, [1, 16], name="input")
+    branches = [tf.abs(x) for _ in range(size)]
+    sums = [tf.add_n(branches[i:i + 100]) for i in range(0, len(branches), 100)]
+    return tf.identity(tf.add_n(sums), name="output")
+
+
+def _constants(size):
+    """Many small constants, each added to a chain."""
+    x = tf.placeholder(tf.float32, [1, 16], name="input")
+    for i in range(size // 2):
+        x = x + tf.constant(np.full([1, 16], i, dtype=np.float32))
+    return tf.identity(x, name="output")
+
+
+def _control_flow(size):
+    """Sequence of while loops with a cond in their body, and nested conds with a while loop inside."""
+    x = tf.placeholder(tf.float32, [1, 16], name="input")
+
+    def body(i, v):
+        v = tf.cond(tf.reduce_sum(v) > 0, lambda: tf.abs(v) - 1., lambda: v * 2.)
+        return i + 1, v
+
+    def loop(v):
+        return tf.while_loop(lambda i, _: i < 3, body, [tf.constant(0), v])[1]
+
+    def nested_cond(v):
+        inner = lambda: tf.cond(tf.reduce_max(v) > 1, lambda: loop(v), lambda: tf.square(v))
+        return tf.cond(tf.reduce_min(v) < 0, inner, lambda: v + 1.)
+
+    # one block creates about 100 nodes
+    for _ in range(max(1, size // 100)):
+        x = nested_cond(loop(x))
+    return tf.identity(x, name="output")
+
+
+def _conv_stack(size):
+    """NHWC conv + bias + relu layers, the converter wraps every conv into transposes."""
+    x = tf.placeholder(tf.float32, [1, 8, 8, 4], name="input")
+    for _ in range(max(1, size // 5)):
+        w = tf.constant(np.random.sample([3, 3, 4, 4]).astype(np.float32))
+        b = tf.constant(np.random.sample([4]).astype(np.float32))
+        x = tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(x, w, strides=[1, 1, 1, 1], padding="SAME"), b))
+    return tf.identity(x, name="output")
+
+
+GRAPHS = OrderedDict([
+    ("chain", _chain),
+    ("fan_out", _fan_out),
+    ("constants", _constants),
+    ("control_flow", _control_flow),
+    ("conv_stack", _conv_stack),
+])
+
+
+def make_tf_graph(kind, size):
+    """Build the synthetic graph, return GraphDef with _output_shapes."""
+    with tf.Graph().as_default() as g:
+        GRAPHS[kind](size)
+    return g.as_graph_def(add_shapes=True)
+
+
+def _best(func, repeat):
+    """Run func repeat times, func returns the seconds of its measured part, return the best."""
+    return min(func() for _ in range(repeat))
+
+
+def bench_conversion(kind, size, opset, repeat):
+    """Time process_tf_graph and every optimizer on a synthetic tf graph."""
+    graph_def = make_tf_graph(kind, size)
+    results = OrderedDict()
+    converted = []
+
+    def convert():
+        start = time.perf_counter()
+        g = process_tf_graph(graph_def, opset=opset, output_names=["output:0"])
+        elapsed = time.perf_counter() - start
+        converted[:] = [g]
+        return elapsed
+
+    results["process_tf_graph"] = _best(convert, repeat)
+    g = converted[0]
+
+    for name, factory in optimizer._optimizers.items():  # pylint: disable=protected-access
+        def run_optimizer(factory=factory):
+            current = copy.deepcopy(g)
+            start = time.perf_counter()
+            factory().optimize(current)
+            return time.perf_counter() - start
+
+        results["optimizer/" + name] = _best(run_optimizer, repeat)
+    return len(graph_def.node), results
+
+
+def make_onnx_chain(size, opset):
+    """Chain of Abs nodes as tf2onnx Graph."""
+    nodes = [helper.make_node("Abs", ["X" if i == 0 else "n{}:0".format(i - 1)], ["n{}:0".format(i)],
+                              name="n{}".format(i)) for i in range(size)]
+    graph_proto = helper.make_graph(
+        nodes, "chain",
+        [helper.make_tensor_value_info("X", TensorProto.FLOAT, [1, 16])],
+        [helper.make_tensor_value_info("n{}:0".format(size - 1), TensorProto.FLOAT, [1, 16])],
+    )
+    return GraphUtil.create_graph_from_onnx_graph(graph_proto, opset_version=opset)
+
+
+def bench_graph_ops(size, opset, repeat):
+    """
+    Time core Graph operations on a chain of the given size. Single node operations are
+    timed per call so a linear cost per call gives exponent 1, topological_sort per graph.
+    """
+    rng = np.random.RandomState(0)
+    samples = min(GRAPH_OP_SAMPLES, size - 1)
+    picks = ["n{}".format(i) for i in rng.choice(np.arange(1, size), samples, replace=False)]
+
+    def timed(op, calls):
+        def run():
+            g = make_onnx_chain(size, opset)
+            start = time.perf_counter()
+            op(g)
+            return (time.perf_counter() - start) / calls
+        return _best(run, repeat)
+
+    def make_node(g):
+        for name in picks:
+            g.make_node("Abs", [name + ":0"])
+
+    def remove_node(g):
+        for name in picks:
+            g.remove_node(name)
+
+    def find_output_consumers(g):
+        for name in picks:
+            g.find_output_consumers(name + ":0")
+
+    def replace_all_inputs(g):
+        for name in picks:
+            g.replace_all_inputs(g.get_nodes(), name + ":0", "X")
+
+    def topological_sort(g):
+        ops = g.get_nodes()
+        rng.shuffle(ops)
+        g.topological_sort(ops)
+
+    results = OrderedDict()
+    results["make_node"] = timed(make_node, samples)
+    results["remove_node"] = timed(remove_node, samples)
+    results["find_output_consumers"] = timed(find_output_consumers, samples)
+    results["replace_all_inputs"] = timed(replace_all_inputs, samples)
+    results["topological_sort"] = timed(topological_sort, 1)
+    return size, results
+
+
+def fit_exponent(nodes, seconds):
+    """Least squares fit of k in seconds = c * nodes^k, None if there are less than 2 usable points."""
+    points = [(math.log(n), math.log(t)) for n, t in zip(nodes, seconds) if n and t and t > 0]
+    if len(points) < 2:
+        return None
+    xs, ys = zip(*points)
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+
+def run_benchmarks(graphs, sizes, opset, repeat):
+    """
+    Return {graph: {benchmark: {"nodes": [..], "seconds": [..], "exponent": k}}},
+    graph "graph_ops" holds the core Graph operations.
+    """
+    results = OrderedDict()
+    for kind in graphs + ["graph_ops"]:
+        series = OrderedDict()
+        for size in sizes:
+            logger.info("Running %s with %s nodes", kind, size)
+            try:
+                if kind == "graph_ops":
+                    nodes, timings = bench_graph_ops(size, opset, repeat)
+                else:
+                    nodes, timings = bench_conversion(kind, size, opset, repeat)
+            except Exception:
+                logger.error("Failed to run %s with %s nodes", kind, size, exc_info=1)
+                continue
+            for name, seconds in timings.items():
+                entry = series.setdefault(name, {"nodes": [], "seconds": []})
+                entry["nodes"].append(nodes)
+                entry["seconds"].append(seconds)
+        for entry in series.values():
+            entry["exponent"] = fit_exponent(entry["nodes"], entry["seconds"])
+        results[kind] = series
+    return results
+
+
+def compare(results, baseline, threshold, exponent_threshold):
+    """Return list of regressions of results over baseline as readable strings."""
+    regressions = []
+    for kind, series in results.items():
+        for name, entry in series.items():
+            base = baseline.get(kind, {}).get(name)
+            if not base:
+                continue
+            base_times = dict(zip(base["nodes"], base["seconds"]))
+            for nodes, seconds in zip(entry["nodes"], entry["seconds"]):
+                base_seconds = base_times.get(nodes)
+                if base_seconds and seconds > base_seconds * (1 + threshold):
+                    regressions.append("{} {} at {} nodes: {:.4g}s -> {:.4g}s (+{:.0%})".format(
+                        kind, name, nodes, base_seconds, seconds, seconds / base_seconds - 1))
+            if entry["exponent"] is not None and base.get("exponent") is not None \
+                    and entry["exponent"] > base["exponent"] + exponent_threshold:
+                regressions.append("{} {} growth exponent: {:.2f} -> {:.2f}".format(
+                    kind, name, base["exponent"], entry["exponent"]))
+    return regressions
+
+
+def format_results(results):
+    lines = []
+    for kind, series in results.items():
+        for name, entry in series.items():
+            timings = ", ".join("{}: {:.4g}s".format(n, t) for n, t in zip(entry["nodes"], entry["seconds"]))
+            exponent = "-" if entry["exponent"] is None else "{:.2f}".format(entry["exponent"])
+            lines.append("{:<14} {:<36} k={:<6} {}".format(kind, name, exponent, timings))
+    return "\n".join(lines)
+
+
+def get_args():
+    """Parse commandline."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated approximate node counts")
+    parser.add_argument("--graphs", default=",".join(GRAPHS.keys()),
+                        help="synthetic graphs to convert, out of " + ",".join(GRAPHS.keys()))
+    parser.add_argument("--opset", type=int, default=None, help="opset to use")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--baseline", help="json written by a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="flag timings slower than the baseline by this fraction")
+    parser.add_argument("--exponent-threshold", type=float, default=0.3,
+                        help="flag growth exponents larger than the baseline by this value")
+    parser.add_argument("--verbose", "-v", help="verbose output, option is additive", action="count")
+    args = parser.parse_args()
+
+    args.sizes = [int(s) for s in args.sizes.split(",")]
+    args.graphs = [g for g in args.graphs.split(",") if g]
+    for g in args.graphs:
+        if g not in GRAPHS:
+            parser.error("unknown graph " + g)
+    return args
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.get_verbosity_level(args.verbose))
+    # conversion logs are too noisy for large graphs
+    logging.set_level(logging.get_verbosity_level(args.verbose, logging.WARNING))
+
+    opset = utils.find_opset(args.opset)
+    results = run_benchmarks(args.graphs, args.sizes, opset, args.repeat)
+    logger.info("Results:\n%s", format_results(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "versions": {"tensorflow": tf.__version__, "onnx": utils.get_onnx_version(),
+                             "tf2onnx": tf2onnx.__version__},
+                "opset": opset,
+                "sizes": args.sizes,
+                "results": results,
+            }, f, indent=2)
+        logger.info("Results are saved at %s", args.output)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold, args.exponent_threshold)
+        for r in regressions:
+            logger.error("REGRESSION: %s", r)
+        logger.info("%s regressions compared to %s", len(regressions), args.baseline)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
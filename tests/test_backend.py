@@ -514,6 +514,36 @@ class BackendTests(Tf2OnnxBackendTestBase):
                             process_args={"inputs_as_nchw": [_INPUT]},
                             onnx_feed_dict={_INPUT: x_val_for_onnx})
 
+    def test_plan_layout(self):
+        x_val = make_xval([2, 16, 16, 3]) / 1000.
+        kernel1 = tf.constant(np.random.random_sample([3, 3, 3, 4]).astype(np.float32), name='k1')
+        kernel2 = tf.constant(np.random.random_sample([1, 1, 4, 4]).astype(np.float32), name='k2')
+        bias = tf.constant(np.random.random_sample([4]).astype(np.float32), name='bias')
+        scale = tf.constant(np.random.random_sample([1, 1, 4]).astype(np.float32), name='scale')
+        x = tf.placeholder(tf.float32, shape=x_val.shape, name=_TFINPUT)
+        conv1 = tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(x, kernel1, strides=[1, 2, 2, 1], padding="SAME"), bias))
+        pool = tf.nn.max_pool(conv1, [1, 2, 2, 1], [1, 1, 1, 1], padding="SAME")
+        conv2 = tf.add_n([tf.nn.conv2d(pool, kernel2, strides=_STRIDE1x1, padding="VALID") * scale, conv1])
+        concat = tf.concat([conv2, pool], axis=-1)
+        padded = tf.pad(concat, [[0, 0], [1, 1], [2, 2], [0, 0]])
+        _ = tf.identity(tf.reduce_mean(padded, [1, 2]), name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val}, rtol=1e-05,
+                            process_args={"inputs_as_nchw": [_INPUT], "plan_layout": True},
+                            onnx_feed_dict={_INPUT: x_val.transpose(NHWC_TO_NCHW)},
+                            graph_validator=lambda g: check_op_count(g, "Transpose", 0))
+
+    def test_plan_layout_boundary(self):
+        x_val = make_xval([1, 8, 8, 3])
+        kernel = tf.constant(np.random.random_sample([3, 3, 3, 2]).astype(np.float32), name='k')
+        x = tf.placeholder(tf.float32, shape=x_val.shape, name=_TFINPUT)
+        conv = tf.nn.conv2d(x, kernel, strides=_STRIDE1x1, padding="SAME")
+        pool = tf.nn.avg_pool(tf.nn.relu(conv), [1, 2, 2, 1], [1, 2, 2, 1], padding="VALID")
+        conv = tf.nn.conv2d(tf.tanh(pool), tf.ones([1, 1, 2, 2]), strides=_STRIDE1x1, padding="SAME")
+        _ = tf.identity(conv, name=_TFOUTPUT)
+        # one transpose entering and one leaving the region
+        self._run_test_case([_OUTPUT], {_INPUT: x_val}, rtol=1e-05, process_args={"plan_layout": True},
+                            graph_validator=lambda g: check_op_count(g, "Transpose", 2))
+
     def test_lrn_default(self):
         x_shape = [1, 3, 4, 3]
         x_val = np.arange(1, 1 + np.prod(x_shape)).astype("float32").reshape(x_shape)
@@ -715,6 +745,16 @@ class BackendTests(Tf2OnnxBackendTestBase):
         _ = tf.identity(x_, name=_TFOUTPUT)
         self._run_test_case([_OUTPUT], {_INPUT: x_val})
 
+    @check_target('rs6', 'GatherNd')
+    def test_gathernd_dynamic_shape(self):
+        x_val = np.arange(60, dtype=np.float32).reshape([3, 5, 4])
+        indices_val = np.array([[[0, 1], [2, 4]], [[1, 3], [0, 0]], [[2, 2], [1, 0]]], dtype=np.int64)
+        x = tf.placeholder(tf.float32, [None, None, 4], name=_TFINPUT)
+        indices = tf.placeholder(tf.int64, [None, None, 2], name=_TFINPUT1)
+        x_ = tf.gather_nd(x, indices)
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val, _INPUT1: indices_val})
+
     @skip_caffe2_backend()
     @check_opset_min_version(7, "tile")
     def test_tile(self):
@@ -1252,6 +1292,42 @@ class BackendTests(Tf2OnnxBackendTestBase):
         g = self._run_test_case([_OUTPUT], {_INPUT: start_val}, process_args=process_args)
         self.assertTrue(extra_opset is None
                         or check_node_domain(group_nodes_by_type(g)["Range"][0], extra_opset.domain))
+        tf.reset_default_graph()
+
+        limit_val = np.array(9, dtype=np.int32)
+        limit = tf.placeholder(tf.int32, shape=(), name=_TFINPUT)
+        x = tf.range(2, limit, 3)
+        _ = tf.identity(x, name=_TFOUTPUT)
+        g = self._run_test_case([_OUTPUT], {_INPUT: limit_val}, process_args=process_args)
+        self.assertTrue(extra_opset is None
+                        or check_node_domain(group_nodes_by_type(g)["Range"][0], extra_opset.domain))
+
+    @check_opset_min_version(9, "ConstantOfShape")
+    def test_range_empty_known_shape(self):
+        # tf knows the length of the range from the identities, they keep the inputs from being const
+        start = tf.identity(np.array(3, dtype=np.int32))
+        limit = tf.identity(np.array(3, dtype=np.int32))
+        x = tf.range(start, limit)
+        _ = tf.identity(x, name=_TFOUTPUT)
+        self.assertEqual([0], x.get_shape().as_list())
+        self._run_test_case([_OUTPUT], {})
+
+    @check_opset_min_version(9, "ConstantOfShape")
+    def test_range_empty(self):
+        start_val = np.array(3.0, dtype=np.float32)
+        start = tf.placeholder(tf.float32, shape=(), name=_TFINPUT)
+        x = tf.range(start, 3.0, 1.5)
+        _ = tf.identity(x, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: start_val})
+
+    @check_opset_min_version(9, "ConstantOfShape")
+    def test_range_negative_trip_count(self):
+        # tf rejects a limit on the wrong side of start, onnx gets one and must return an empty range
+        start_val = np.array(3, dtype=np.int32)
+        start = tf.placeholder(tf.int32, shape=(), name=_TFINPUT)
+        x = tf.range(start, 3, 2)
+        _ = tf.identity(x, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: start_val}, onnx_feed_dict={_INPUT: np.array(8, dtype=np.int32)})
 
     @check_opset_min_version(7, "cast")
     def test_range_const(self):
@@ -2159,6 +2235,29 @@ class BackendTests(Tf2OnnxBackendTestBase):
         _ = tf.identity(picks, name=_TFOUTPUT)
         self._run_test_case([_OUTPUT], {_INPUT: x_val})
 
+    @check_opset_min_version(7, "where")
+    def test_where_inf_nan(self):
+        # the values that are not picked must not leak into the result
+        x_val = np.array([1, 2, -3, 4, -5, -6, -7, 8, 9, 0], dtype=np.float32)
+        true_result = np.array([111, np.nan, 333, np.inf, 555, -np.inf, 777, np.nan, 999, 1000],
+                               dtype=np.float32)
+        false_result = np.array([np.inf, -222, -np.inf, -444, np.nan, -666, np.nan, -888, -999, np.inf],
+                                dtype=np.float32)
+        x = tf.placeholder(tf.float32, [None], name=_TFINPUT)
+        picks = tf.where(tf.greater_equal(x, 0), true_result, false_result)
+        _ = tf.identity(picks, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val})
+
+    @check_opset_min_version(7, "where")
+    def test_where_bool(self):
+        x_val = np.array([1, 2, -3, 4, -5, -6, -7, 8, 9, 0], dtype=np.float32)
+        true_result = np.array([True, False, True, False, True, True, False, False, True, True])
+        false_result = np.array([False, True, True, False, False, True, True, False, True, False])
+        x = tf.placeholder(tf.float32, [None], name=_TFINPUT)
+        picks = tf.where(tf.greater_equal(x, 0), true_result, false_result)
+        _ = tf.identity(picks, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val})
+
     @check_opset_min_version(8, "where")
     @check_target("rs6", "onnxruntime Where type limitation")
     def test_where_int32(self):
@@ -2588,6 +2687,56 @@ class BackendTests(Tf2OnnxBackendTestBase):
                                 graph_validator=lambda g: check_op_count(g, "ThresholdedRelu", 1))
             tf.reset_default_graph()
 
+    def _test_layer_norm(self, layer_norm):
+        x_val = np.random.randn(2, 5, 16).astype(np.float32)
+        gamma_val = np.random.rand(16).astype(np.float32) + 0.5
+        beta_val = np.random.randn(16).astype(np.float32)
+        # before opset 17 there is no LayerNormalization, the canonical form onnxruntime fuses itself is used
+        op_type, count = ("LayerNormalization", 1) if self.config.opset >= 17 else ("ReduceMean", 2)
+        x = tf.placeholder(x_val.dtype, x_val.shape, name=_TFINPUT)
+        x_ = layer_norm(x, tf.constant(gamma_val), tf.constant(beta_val))
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val}, rtol=1e-04, atol=1e-04,
+                            graph_validator=lambda g: check_op_count(g, op_type, count))
+
+    def test_layer_norm_moments(self):
+        def layer_norm(x, gamma, beta):
+            mean, variance = tf.nn.moments(x, [2], keepdims=True)
+            return tf.nn.batch_normalization(x, mean, variance, beta, gamma, 1e-12)
+        self._test_layer_norm(layer_norm)
+
+    def test_gelu(self):
+        x_val = np.random.randn(3, 20).astype(np.float32) * 3
+        process_args = {"extra_opset": [utils.make_opsetid(constants.MICROSOFT_DOMAIN, 1)]}
+        gelus = [
+            lambda x: x * (0.5 * (1.0 + tf.math.erf(x / np.sqrt(2.0)))),
+            lambda x: 0.5 * x * (1.0 + tf.math.erf(x * np.sqrt(0.5))),
+        ]
+        for gelu in gelus:
+            x = tf.placeholder(x_val.dtype, x_val.shape, name=_TFINPUT)
+            _ = tf.identity(gelu(x), name=_TFOUTPUT)
+            self._run_test_case([_OUTPUT], {_INPUT: x_val}, rtol=1e-05, process_args=process_args,
+                                graph_validator=lambda g: (check_op_count(g, "Gelu", 1) and
+                                                           check_node_domain(group_nodes_by_type(g)["Gelu"][0],
+                                                                             constants.MICROSOFT_DOMAIN)))
+            tf.reset_default_graph()
+
+    def test_fast_gelu(self):
+        x_val = np.random.randn(3, 20).astype(np.float32) * 3
+        process_args = {"extra_opset": [utils.make_opsetid(constants.MICROSOFT_DOMAIN, 1)]}
+        x = tf.placeholder(x_val.dtype, x_val.shape, name=_TFINPUT)
+        x_ = 0.5 * x * (1.0 + tf.tanh(np.sqrt(2 / np.pi) * (x + 0.044715 * tf.pow(x, 3))))
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val}, rtol=1e-05, process_args=process_args,
+                            graph_validator=lambda g: check_op_count(g, "FastGelu", 1))
+
+    def test_layer_norm_rsqrt(self):
+        def layer_norm(x, gamma, beta):
+            mean = tf.reduce_mean(x, axis=[-1], keepdims=True)
+            variance = tf.reduce_mean(tf.math.squared_difference(x, mean), axis=[-1], keepdims=True)
+            return (x - mean) * tf.math.rsqrt(variance + 1e-6) * gamma + beta
+        self._test_layer_norm(layer_norm)
+
     @check_tf_min_version("1.13")
     @check_opset_min_version(8, "MaxPoolWithArgmax")
     def test_maxpoolwithargmax(self):
@@ -129,6 +129,41 @@ class Tf2OnnxGraphTests(Tf2OnnxBackendTestBase):
                 'output1:0 -> output2 output2:0 -> output }',
                 onnx_to_graphviz(g))
 
+    def test_graphdef_front_end(self):
+        with tf.Session() as sess:
+            x = tf.placeholder(tf.float32, [2, 3], name="input")
+            x_ = tf.abs(x)
+            _ = tf.identity(x_, name="output")
+            graph_def = sess.graph.as_graph_def(add_shapes=True)
+        g = process_tf_graph(graph_def, opset=self.config.opset)
+        self.assertEqual('digraph { input [op_type=Placeholder shape="[2, 3]"]' \
+                         ' Abs [op_type=Abs] output [op_type=Identity] input:0 -> Abs Abs:0 -> output }',
+                         onnx_to_graphviz(g))
+        self.assertEqual([2, 3], g.get_shape("output:0"))
+
+    def test_graphdef_front_end_without_shapes(self):
+        # no _output_shapes in graph_def, tensorflow shape inference is used
+        with tf.Session() as sess:
+            x = tf.placeholder(tf.float32, [2, 3], name="input")
+            x_ = tf.abs(x)
+            _ = tf.identity(x_, name="output")
+            graph_def = sess.graph.as_graph_def()
+        g = process_tf_graph(graph_def, opset=self.config.opset)
+        self.assertEqual('digraph { input [op_type=Placeholder shape="[2, 3]"]' \
+                         ' Abs [op_type=Abs] output [op_type=Identity] input:0 -> Abs Abs:0 -> output }',
+                         onnx_to_graphviz(g))
+        self.assertEqual([2, 3], g.get_shape("output:0"))
+
+    def test_graphdef_front_end_shape_override(self):
+        # the overridden input shape is propagated to the tensors after it
+        with tf.Session() as sess:
+            x = tf.placeholder(tf.float32, [None, 3], name="input")
+            x_ = tf.abs(x)
+            _ = tf.identity(x_, name="output")
+            graph_def = sess.graph.as_graph_def(add_shapes=True)
+        g = process_tf_graph(graph_def, opset=self.config.opset, shape_override={"input:0": [2, 3]})
+        self.assertEqual([2, 3], g.get_shape("output:0"))
+
     def test_randomnormal(self):
         with tf.Session() as sess:
             x_ = tf.random_normal([2, 3], name="rand")
@@ -15,7 +15,7 @@ from onnx import TensorProto
 from onnx import helper, numpy_helper
 
 import tensorflow as tf
-from tf2onnx import utils
+from tf2onnx import float16, optimizer, ort_profile, profiler, utils
 from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
 from tf2onnx.graph import GraphUtil
 
@@ -272,6 +272,173 @@ class Tf2OnnxInternalTests(Tf2OnnxBackendTestBase):
 
             self.assertTrue(np.array_equal(expected, actual))
 
+    def test_profiler(self):
+        self.assertFalse(profiler.is_enabled())
+        with profiler.phase("ignored") as span:
+            span.graph = None
+        graph_proto = self.sample_net()
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        with profiler.Profiler(trace_memory=True) as prof:
+            self.assertTrue(profiler.is_enabled())
+            with profiler.phase("convert"):
+                with profiler.phase("optimize_graph", g) as span:
+                    span.graph = optimizer.optimize_graph(g)
+        self.assertFalse(profiler.is_enabled())
+
+        events = prof.to_chrome_trace()["traceEvents"]
+        names = [e["name"] for e in events]
+        self.assertEqual(names[:2], ["convert", "optimize_graph"])
+        self.assertTrue("optimizer/optimize_transpose" in names)
+        self.assertTrue(all(e["ph"] == "X" and e["dur"] >= 0 for e in events))
+        convert, optimize = events[:2]
+        self.assertTrue(convert["ts"] <= optimize["ts"])
+        self.assertTrue(optimize["ts"] + optimize["dur"] <= convert["ts"] + convert["dur"])
+        self.assertEqual(optimize["args"]["nodes_before"], 8)
+        self.assertTrue("nodes_after" in optimize["args"])
+        self.assertTrue(convert["args"]["tracemalloc_peak_mb"] >= optimize["args"]["tracemalloc_peak_mb"])
+        self.assertEqual(prof.summary()[0][0], "convert")
+
+    def test_handler_stats(self):
+        node1 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 1], name="trans1")
+        node2 = helper.make_node("Relu", ["Y"], ["Z"], name="relu")
+        node3 = helper.make_node("Transpose", ["Z"], ["Z1"], perm=[0, 3, 1, 2], name="trans2")
+        graph_proto = helper.make_graph(
+            [node1, node2, node3],
+            "test_handler_stats",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, [2, 3, 4, 5])],
+            [helper.make_tensor_value_info("Z1", TensorProto.FLOAT, [2, 3, 4, 5])],
+        )
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        self.assertFalse(profiler.handler_stats_enabled())
+        with profiler.HandlerStats() as stats:
+            optimizer.optimize_graph(g)
+        self.assertFalse(profiler.handler_stats_enabled())
+
+        result = stats.as_dict()
+        self.assertEqual(result["transpose/Relu"]["calls"], 1)
+        # optimize_graph runs the optimizers again until nothing changes
+        self.assertEqual(result["optimizer/optimize_transpose"]["calls"], 2)
+        self.assertTrue(result["optimizer/optimize_transpose"]["nodes_removed"] >= 2)
+        self.assertTrue(result["optimizer/optimize_transpose"]["time"] >= result["transpose/Relu"]["time"])
+        table = stats.format_table().splitlines()
+        self.assertTrue(table[0].startswith("handler"))
+        self.assertEqual(len(table), len(result) + 1)
+
+    def test_node_origin(self):
+        node1 = helper.make_node("Abs", ["X"], ["Y"], name="abs")
+        graph_proto = helper.make_graph(
+            [node1],
+            "test_node_origin",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, [2, 3])],
+            [helper.make_tensor_value_info("Y", TensorProto.FLOAT, [2, 3])],
+        )
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        self.assertEqual(g.get_node_origin("abs"), ("abs", "tf"))
+        with utils.node_origin("abs", "handler/Abs"):
+            neg = g.make_node("Neg", ["Y"], name=utils.make_name("abs"))
+        with utils.node_origin(None, "optimizer/test"):
+            relu = g.make_node("Relu", neg.output, name="abs/relu")
+        self.assertIsNone(utils.get_node_origin())
+        self.assertEqual(g.get_node_origin(neg.name), ("abs", "handler/Abs"))
+        # nodes made without tf node are traced by their name
+        self.assertEqual(g.get_node_origin(relu.name), ("abs", "optimizer/test"))
+        self.assertEqual(g.get_node_origin("abs__123_kernel"), ("abs", "tf"))
+        self.assertEqual(g.get_node_origin("unrelated"), (None, None))
+
+        node_times = {"abs": ("Abs", 10), neg.name: ("Neg", 20), relu.name: ("Relu", 10), "fused": ("Add", 60)}
+        report = ort_profile.attribute_node_times(node_times, g)
+        self.assertEqual([r["tf_node"] for r in report], ["<unknown>", "abs"])
+        self.assertEqual(report[1]["time_us"], 40)
+        self.assertAlmostEqual(report[1]["share"], 0.4)
+        self.assertEqual([n["name"] for n in report[1]["onnx_nodes"]], [neg.name, "abs", relu.name])
+        self.assertEqual(len(ort_profile.format_report(report).splitlines()), 6)
+
+    def test_float16(self):
+        w_val = np.random.randn(4, 3).astype(np.float32)
+        b_val = np.random.randn(3).astype(np.float32)
+        node1 = helper.make_node("MatMul", ["X", "W"], ["Y"], name="matmul")
+        node2 = helper.make_node("Softmax", ["Y"], ["Z"], name="softmax")
+        node3 = helper.make_node("Add", ["Z", "B"], ["res"], name="add")
+        graph_proto = helper.make_graph(
+            [node1, node2, node3],
+            "test_float16",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, [2, 4])],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, [2, 3])],
+            initializer=[numpy_helper.from_array(w_val, "W"), numpy_helper.from_array(b_val, "B")],
+        )
+        opset = helper.make_opsetid("", self.config.opset)
+        g = GraphUtil.create_graph_from_onnx_model(helper.make_model(graph_proto, opset_imports=[opset]))
+        float16.convert_float_to_float16(g)
+        g = optimizer.optimize_graph(g)
+        model_proto = g.make_model("test")
+
+        # MatMul and Add run in float16, Softmax in float, inputs and outputs stay float
+        self.assertEqual(g.get_dtype(g.get_node_by_name("matmul").output[0]), TensorProto.FLOAT16)
+        self.assertEqual(g.get_dtype(g.get_node_by_name("softmax").output[0]), TensorProto.FLOAT)
+        self.assertEqual(g.get_dtype(g.get_node_by_name("add").output[0]), TensorProto.FLOAT16)
+        self.assertEqual(model_proto.graph.input[0].type.tensor_type.elem_type, TensorProto.FLOAT)
+        self.assertEqual(model_proto.graph.output[0].type.tensor_type.elem_type, TensorProto.FLOAT)
+        self.assertTrue(all(t.data_type == TensorProto.FLOAT16 for t in model_proto.graph.initializer))
+        # one cast into and one out of each float16 region
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(model_proto.graph)["Cast"], 4)
+
+        x_val = np.random.randn(2, 4).astype(np.float32)
+        model_path = self.save_onnx_model(model_proto, {"X": x_val})
+        actual = self.run_onnxruntime(model_path, {"X": x_val}, ["res"])[0]
+        y_val = np.dot(x_val, w_val)
+        z_val = np.exp(y_val) / np.sum(np.exp(y_val), axis=1, keepdims=True)
+        self.assertAllClose(z_val + b_val, actual, rtol=1e-2, atol=1e-2)
+
+    def test_float16_layer_norm(self):
+        # the layer norm the rewriter emits before opset 17, epsilon is 0 in float16
+        w_val = np.random.randn(4, 8).astype(np.float32)
+        gamma_val = np.random.randn(8).astype(np.float32)
+        beta_val = np.random.randn(8).astype(np.float32)
+        nodes = [
+            helper.make_node("MatMul", ["X", "W"], ["Y"], name="matmul"),
+            helper.make_node("ReduceMean", ["Y"], ["mean"], axes=[1], keepdims=1, name="mean"),
+            helper.make_node("Sub", ["Y", "mean"], ["centered"], name="centered"),
+            helper.make_node("Pow", ["centered", "two"], ["squared"], name="squared"),
+            helper.make_node("ReduceMean", ["squared"], ["variance"], axes=[1], keepdims=1, name="variance"),
+            helper.make_node("Add", ["variance", "epsilon"], ["variance_epsilon"], name="add_epsilon"),
+            helper.make_node("Sqrt", ["variance_epsilon"], ["std"], name="std"),
+            helper.make_node("Div", ["centered", "std"], ["normalized"], name="normalized"),
+            helper.make_node("Mul", ["normalized", "gamma"], ["scaled"], name="scaled"),
+            helper.make_node("Add", ["scaled", "beta"], ["res"], name="layer_norm"),
+        ]
+        graph_proto = helper.make_graph(
+            nodes,
+            "test_float16_layer_norm",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, [2, 4])],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, [2, 8])],
+            initializer=[numpy_helper.from_array(w_val, "W"), numpy_helper.from_array(gamma_val, "gamma"),
+                         numpy_helper.from_array(beta_val, "beta"),
+                         numpy_helper.from_array(np.array(2, dtype=np.float32), "two"),
+                         numpy_helper.from_array(np.array(1e-12, dtype=np.float32), "epsilon")],
+        )
+        opset = helper.make_opsetid("", self.config.opset)
+        g = GraphUtil.create_graph_from_onnx_model(helper.make_model(graph_proto, opset_imports=[opset]))
+        float16.convert_float_to_float16(g)
+        g = optimizer.optimize_graph(g)
+        model_proto = g.make_model("test")
+
+        # MatMul runs in float16, the whole layer norm in float with casts only at its boundary
+        self.assertEqual(g.get_dtype(g.get_node_by_name("matmul").output[0]), TensorProto.FLOAT16)
+        for node in nodes[1:]:
+            self.assertEqual(g.get_dtype(g.get_node_by_name(node.name).output[0]), TensorProto.FLOAT)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(model_proto.graph)["Cast"], 2)
+
+        # the constant row has variance 0
+        x_val = np.random.randn(2, 4).astype(np.float32)
+        x_val[1] = 0
+        model_path = self.save_onnx_model(model_proto, {"X": x_val})
+        actual = self.run_onnxruntime(model_path, {"X": x_val}, ["res"])[0]
+        y_val = np.dot(x_val, w_val)
+        mean = np.mean(y_val, axis=1, keepdims=True)
+        variance = np.mean(np.square(y_val - mean), axis=1, keepdims=True)
+        expected = (y_val - mean) / np.sqrt(variance + 1e-12) * gamma_val + beta_val
+        self.assertAllClose(expected, actual, rtol=1e-2, atol=1e-2)
+
 
 if __name__ == '__main__':
     unittest_main()
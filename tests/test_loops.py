@@ -12,7 +12,8 @@ import numpy as np
 import tensorflow as tf
 
 from backend_test_base import Tf2OnnxBackendTestBase
-from common import unittest_main, check_tf_min_version, check_onnxruntime_min_version
+from common import unittest_main, check_tf_min_version, check_onnxruntime_min_version, \
+    check_opset_min_version, check_op_count
 
 
 # pylint: disable=missing-docstring,invalid-name,unused-argument,using-constant-test
@@ -227,6 +228,24 @@ class LoopTests(Tf2OnnxBackendTestBase):
         self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-5)
         tf.reset_default_graph()
 
+    @check_opset_min_version(9, "Scan")
+    def test_map_fn_to_scan(self):
+        def fn(elem):
+            res = elem + elem * elem
+            return res
+
+        x_val = 100 * np.random.random_sample([4, 10]).astype(np.float32)
+        x = tf.placeholder(tf.float32, shape=x_val.shape, name="input_0")
+        x_ = tf.identity(x)
+        res_ = tf.map_fn(fn, x_, dtype=tf.float32)
+        _ = tf.identity(res_, name="output_0")
+        feed_dict = {"input_0:0": x_val}
+        input_names_with_port = ["input_0:0"]
+        output_names_with_port = ["output_0:0"]
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-5,
+                           graph_validator=lambda g: (check_op_count(g, "Scan", 1) and
+                                                      check_op_count(g, "Loop", 0)))
+
     @check_tf_min_version("1.9")
     def test_simple_while_loop_var_shape(self):
         # test for while_loop with variant shape variables
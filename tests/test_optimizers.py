@@ -9,10 +9,10 @@ from __future__ import unicode_literals
 
 import numpy as np
 from onnx import helper, TensorProto, OperatorSetIdProto
-from tf2onnx import utils
+from tf2onnx import constants, schemas, utils
 from tf2onnx.graph import GraphUtil
 from backend_test_base import Tf2OnnxBackendTestBase
-from common import unittest_main, group_nodes_by_type, check_opset_min_version
+from common import unittest_main, group_nodes_by_type, check_opset_min_version, check_opset_max_version
 
 
 # pylint: disable=missing-docstring,invalid-name,unused-argument,using-constant-test
@@ -428,6 +428,57 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
         self.run_transpose_compare(["Y"], {"array": np.random.randn(10, 3, 4, 5).astype(np.float32)},
                                    model_proto, remaining_transpose_num=0)
 
+    def _define_invariant_loop_body(self, name, inner_loop=None):
+        # the Transpose of the outer scope W is the same in every iteration
+        nodes = [
+            helper.make_node("Transpose", ["W"], [name + "_WT"], perm=[1, 0], name=name + "_trans"),
+            helper.make_node("MatMul", [name + "_var", name + "_WT"], [name + "_mm"], name=name + "_matmul"),
+            helper.make_node("Identity", [name + "_cond"], [name + "_cond_out"], name=name + "_identity"),
+        ]
+        if inner_loop:
+            nodes.append(helper.make_node("Loop", ["M", "", name + "_mm"], [name + "_var_out"], name=name + "_loop",
+                                          body=inner_loop))
+        else:
+            nodes.append(helper.make_node("Identity", [name + "_mm"], [name + "_var_out"], name=name + "_out"))
+        return helper.make_graph(
+            nodes,
+            name + "_body",
+            [helper.make_tensor_value_info(name + "_iter", TensorProto.INT64, ()),
+             helper.make_tensor_value_info(name + "_cond", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info(name + "_var", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info(name + "_cond_out", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info(name + "_var_out", TensorProto.FLOAT, (2, 3))],
+        )
+
+    def _run_invariant_loop_compare(self, body):
+        loop_node = helper.make_node("Loop", ["M", "", "X"], ["Y"], name="loop", body=body)
+        graph = helper.make_graph(
+            [loop_node],
+            "loop-invariant-test",
+            [helper.make_tensor_value_info("M", TensorProto.INT64, ()),
+             helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3)),
+             helper.make_tensor_value_info("W", TensorProto.FLOAT, (3, 3))],
+            [helper.make_tensor_value_info("Y", TensorProto.FLOAT, (2, 3))],
+        )
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        # the trip count is an input so the loop can't be unrolled
+        feed_dict = {"M": np.array(3, dtype=np.int64), "X": np.random.randn(2, 3).astype(np.float32),
+                     "W": np.random.randn(3, 3).astype(np.float32)}
+        new_proto = self.run_transpose_compare(["Y"], feed_dict, model_proto, remaining_transpose_num=1)
+        bodies = [attr.g for node in new_proto.graph.node for attr in node.attribute if attr.HasField("g")]
+        while bodies:
+            body = bodies.pop()
+            self.assertFalse([node for node in body.node if node.op_type == "Transpose"],
+                             msg="Transpose left in " + body.name)
+            bodies.extend(attr.g for node in body.node for attr in node.attribute if attr.HasField("g"))
+
+    def test_loop_invariant_hoisting(self):
+        self._run_invariant_loop_compare(self._define_invariant_loop_body("outer"))
+
+    def test_loop_invariant_hoisting_nested(self):
+        inner = self._define_invariant_loop_body("inner")
+        self._run_invariant_loop_compare(self._define_invariant_loop_body("outer", inner))
+
     def test_trans_with_sub(self):
         io_shape = [2, 3, 4, 5]
         const_shapes = [[2, 4, 5, 3], [4, 5, 3], [5, 3], [3]]
@@ -599,6 +650,128 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
         self.run_transpose_compare(["res"], {"X": np.random.randn(1, 3, 4, 5).astype(np.float32)},
                                    model_proto, remaining_transpose_num=0)
 
+    def test_transpose_reducesum_no_keepdims(self):
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 1], name="trans_1")
+        node1 = helper.make_node("ReduceSum", ["Y"], ["Z"], axes=[1], keepdims=0, name="reducesum")
+        node2 = helper.make_node("Transpose", ["Z"], ["res"], perm=[0, 2, 1], name="trans_2")
+
+        graph = helper.make_graph(
+            [node0, node1, node2],
+            "transpose-reducesum-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3, 5))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 4, 5).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_rank3_unary_and_div(self):
+        # NCW to NWC as around conv1d
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 1], name="trans_1")
+        node1 = helper.make_node("Sigmoid", ["Y"], ["Y1"], name="sigmoid")
+        node2 = helper.make_node("Div", ["Y1", "A"], ["Y2"], name="div")
+        node3 = helper.make_node("Exp", ["Y2"], ["Z"], name="exp")
+        node4 = helper.make_node("Transpose", ["Z"], ["res"], perm=[0, 2, 1], name="trans_2")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(np.random.uniform(1, 2, [5, 3]).astype(np.float32), "A"),
+             node0, node1, node2, node3, node4],
+            "transpose-rank3-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3, 5))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 5).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_rank5_through_branches(self):
+        # NCDHW to NDHWC, consumed by two branches which transpose back
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 4, 1], name="trans_1")
+        node1 = helper.make_node("Relu", ["Y"], ["Y1"], name="relu")
+        node2 = helper.make_node("Neg", ["Y"], ["Y2"], name="neg")
+        node3 = helper.make_node("Add", ["Y1", "Y2"], ["Z"], name="add")
+        node4 = helper.make_node("Transpose", ["Z"], ["res"], perm=[0, 4, 1, 2, 3], name="trans_2")
+
+        graph = helper.make_graph(
+            [node0, node1, node2, node3, node4],
+            "transpose-rank5-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4, 5, 6))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3, 4, 5, 6))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 4, 5, 6).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_softmax_and_unsqueeze(self):
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[1, 0, 2], name="trans_1")
+        node1 = helper.make_node("Softmax", ["Y"], ["Y1"], axis=2, name="softmax")
+        node2 = helper.make_node("Unsqueeze", ["Y1"], ["Z"], axes=[0], name="unsqueeze")
+        node3 = helper.make_node("Transpose", ["Z"], ["res"], perm=[0, 2, 1, 3], name="trans_2")
+
+        graph = helper.make_graph(
+            [node0, node1, node2, node3],
+            "transpose-softmax-unsqueeze-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 2, 3, 4))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_split(self):
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 1], name="trans_1")
+        node1 = helper.make_node("Split", ["Y"], ["S1", "S2"], axis=3, name="split")
+        node2 = helper.make_node("Transpose", ["S1"], ["res1"], perm=[0, 3, 1, 2], name="trans_2")
+        node3 = helper.make_node("Transpose", ["S2"], ["res2"], perm=[0, 3, 1, 2], name="trans_3")
+
+        graph = helper.make_graph(
+            [node0, node1, node2, node3],
+            "transpose-split-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 4, 5, 6))],
+            [helper.make_tensor_value_info("res1", TensorProto.FLOAT, (2, 2, 5, 6)),
+             helper.make_tensor_value_info("res2", TensorProto.FLOAT, (2, 2, 5, 6))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res1", "res2"], {"X": np.random.randn(2, 4, 5, 6).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_gather_scalar_index(self):
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 1], name="trans_1")
+        node1 = helper.make_node("Gather", ["Y", "index"], ["Z"], axis=1, name="gather")
+        node2 = helper.make_node("Transpose", ["Z"], ["res"], perm=[0, 2, 1], name="trans_2")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(np.array(2, dtype=np.int64), "index"), node0, node1, node2],
+            "transpose-gather-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3, 5))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 4, 5).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=0)
+
+    def test_transpose_combine(self):
+        node0 = helper.make_node("Transpose", ["X"], ["Y"], perm=[0, 2, 3, 1], name="trans_1")
+        node1 = helper.make_node("Transpose", ["Y"], ["res"], perm=[0, 2, 1, 3], name="trans_2")
+
+        graph = helper.make_graph(
+            [node0, node1],
+            "transpose-combine-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 5, 4, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        model_after_opt = self.run_transpose_compare(["res"], {"X": np.random.randn(2, 3, 4, 5).astype(np.float32)},
+                                                     model_proto, remaining_transpose_num=1)
+        self.check_transpose_perm(model_after_opt, [0, 3, 2, 1])
+
     def test_trans_output_as_graph_outputs(self):
         """
         If transpose's output is graph's output, don't optimize it.
@@ -1053,8 +1226,659 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
         model_proto = self.make_model(graph, producer_name="onnx-tests")
         self.run_and_compare(["res"], {"X": np.random.randn(*shape).astype(np.int64)}, model_proto,
                              "Cast", 0)
+
+    @check_opset_min_version(10, "Slice")
+    def test_const_fold_slice_concat_with_const(self):
+        const1 = np.random.randn(4, 6).astype(np.float32)
+        const2 = np.random.randn(2, 3).astype(np.float32)
+        node1 = self._make_onnx_const(const1, "const1")
+        node2 = self._make_onnx_const(const2, "const2")
+        node3 = self._make_onnx_const(np.array([1, 0], dtype=np.int64), "starts")
+        node4 = self._make_onnx_const(np.array([3, 3], dtype=np.int64), "ends")
+        node5 = helper.make_node("Slice", ["const1", "starts", "ends"], ["value1"])
+        node6 = helper.make_node("Concat", ["value1", "const2"], ["value2"], axis=0)
+        node7 = helper.make_node("Add", ["value2", "X"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7],
+            "test_const_fold_slice_concat_with_const",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (4, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (4, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(4, 3).astype(np.float32)}, model_proto,
+                             "Slice", 0)
     # Const Fold Optimizer Tests End
 
+    # Conv Optimizer Tests Start
+
+    def test_conv_batchnorm(self):
+        w = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        scale = np.random.rand(4).astype(np.float32) + 0.5
+        bias = np.random.randn(4).astype(np.float32)
+        mean = np.random.randn(4).astype(np.float32)
+        var = np.random.rand(4).astype(np.float32) + 0.5
+        node0 = helper.make_node("Conv", ["X", "W"], ["Y"], name="conv", pads=[1, 1, 1, 1])
+        node1 = helper.make_node("BatchNormalization", ["Y", "scale", "bias", "mean", "var"], ["Z"],
+                                 name="bn", epsilon=1e-3)
+        node2 = helper.make_node("Relu", ["Z"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(w, "W"), self._make_onnx_const(scale, "scale"),
+             self._make_onnx_const(bias, "bias"), self._make_onnx_const(mean, "mean"),
+             self._make_onnx_const(var, "var"), node0, node1, node2],
+            "conv-batchnorm-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 5, 5))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 3, 5, 5).astype(np.float32)},
+                             model_proto, "BatchNormalization", 0, rtol=1e-5)
+
+    def test_conv_transpose_mul_add(self):
+        # per channel Mul and Add behind the transpose back to NHWC
+        w = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        b = np.random.randn(4).astype(np.float32)
+        mul = np.random.randn(4).astype(np.float32)
+        add = np.random.randn(1, 1, 1, 4).astype(np.float32)
+        node0 = helper.make_node("Conv", ["X", "W", "B"], ["Y"], name="conv")
+        node1 = helper.make_node("Transpose", ["Y"], ["Y1"], perm=[0, 2, 3, 1], name="trans")
+        node2 = helper.make_node("Mul", ["mul", "Y1"], ["Z"], name="mul")
+        node3 = helper.make_node("Add", ["Z", "add"], ["Z1"], name="add")
+        node4 = helper.make_node("Relu", ["Z1"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(w, "W"), self._make_onnx_const(b, "B"), self._make_onnx_const(mul, "mul"),
+             self._make_onnx_const(add, "add"), node0, node1, node2, node3, node4],
+            "conv-transpose-mul-add-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3, 3, 4))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        new_proto = self.run_and_compare(["res"], {"X": np.random.randn(2, 3, 5, 5).astype(np.float32)},
+                                         model_proto, "Mul", 0, rtol=1e-5)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("Add", 0), 0)
+
+    def test_conv_add_not_per_channel(self):
+        w = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        add = np.random.randn(1, 4, 3, 1).astype(np.float32)
+        node0 = helper.make_node("Conv", ["X", "W"], ["Y"], name="conv")
+        node1 = helper.make_node("Add", ["Y", "add"], ["res"], name="add")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(w, "W"), self._make_onnx_const(add, "add"), node0, node1],
+            "conv-add-not-per-channel-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 3, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 3, 5, 5).astype(np.float32)},
+                             model_proto, "Add", 1)
+
+    @check_opset_max_version(10, "pads of Pad is an attribute")
+    def test_pad_conv_and_pool(self):
+        w = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        node0 = helper.make_node("Pad", ["X"], ["Y"], pads=[0, 0, 1, 2, 0, 0, 1, 0], name="pad1")
+        node1 = helper.make_node("Conv", ["Y", "W"], ["Z"], name="conv", pads=[1, 0, 0, 1])
+        node2 = helper.make_node("Pad", ["Z"], ["Z1"], pads=[0, 0, 1, 1, 0, 0, 1, 1], name="pad2")
+        node3 = helper.make_node("AveragePool", ["Z1"], ["res"], kernel_shape=[2, 2], name="pool")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(w, "W"), node0, node1, node2, node3],
+            "pad-conv-pool-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 7, 6))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 3, 5, 5).astype(np.float32)},
+                             model_proto, "Pad", 0)
+
+    @check_opset_min_version(11, "pads of Pad is an input")
+    def test_pad_conv_empty_constant_value(self):
+        w = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        node0 = helper.make_node("Pad", ["X", "pads", ""], ["Y"], name="pad")
+        node1 = helper.make_node("Conv", ["Y", "W"], ["res"], name="conv")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(w, "W"),
+             self._make_onnx_const(np.array([0, 0, 1, 2, 0, 0, 1, 0], dtype=np.int64), "pads"), node0, node1],
+            "pad-conv-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 5, 5))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 3, 5, 5).astype(np.float32)},
+                             model_proto, "Pad", 0)
+    # Conv Optimizer Tests End
+
+    # Attention Optimizer Tests Start
+
+    def _make_ms_model(self, graph):
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        model_proto.opset_import.extend([helper.make_opsetid(constants.MICROSOFT_DOMAIN, 1)])
+        return model_proto
+
+    @check_opset_min_version(5, "Reshape")
+    def test_attention(self):
+        # bert self attention with batch 2, sequence 4, 2 heads of size 4
+        consts = []
+        nodes = []
+        for name, perm in [("q", [0, 2, 1, 3]), ("k", [0, 2, 3, 1]), ("v", [0, 2, 1, 3])]:
+            consts += [self._make_onnx_const(np.random.randn(8, 8).astype(np.float32), name + "_w"),
+                       self._make_onnx_const(np.random.randn(8).astype(np.float32), name + "_b")]
+            nodes += [helper.make_node("MatMul", ["X", name + "_w"], [name + "_mm"], name=name + "_mm"),
+                      helper.make_node("Add", [name + "_mm", name + "_b"], [name + "_add"], name=name + "_add"),
+                      helper.make_node("Reshape", [name + "_add", "heads_shape"], [name + "_heads"],
+                                       name=name + "_reshape"),
+                      helper.make_node("Transpose", [name + "_heads"], [name], perm=perm, name=name + "_trans")]
+        consts += [self._make_onnx_const(np.array([2, 4, 2, 4], dtype=np.int64), "heads_shape"),
+                   self._make_onnx_const(np.array([2, 4, 8], dtype=np.int64), "output_shape"),
+                   self._make_onnx_const(np.array(0.5, dtype=np.float32), "scale"),
+                   self._make_onnx_const(np.array(1, dtype=np.float32), "one"),
+                   self._make_onnx_const(np.array(-10000, dtype=np.float32), "filter_value")]
+        nodes += [helper.make_node("Sub", ["one", "mask"], ["inverted_mask"], name="mask_sub"),
+                  helper.make_node("Mul", ["inverted_mask", "filter_value"], ["adder"], name="mask_mul"),
+                  helper.make_node("MatMul", ["q", "k"], ["qk"], name="qk"),
+                  helper.make_node("Mul", ["qk", "scale"], ["scaled"], name="scale_mul"),
+                  helper.make_node("Add", ["scaled", "adder"], ["scores"], name="mask_add"),
+                  helper.make_node("Softmax", ["scores"], ["probs"], axis=3, name="softmax"),
+                  helper.make_node("MatMul", ["probs", "v"], ["context"], name="context"),
+                  helper.make_node("Transpose", ["context"], ["context_trans"], perm=[0, 2, 1, 3], name="trans"),
+                  helper.make_node("Reshape", ["context_trans", "output_shape"], ["res"], name="reshape")]
+
+        graph = helper.make_graph(
+            consts + nodes,
+            "attention-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 4, 8)),
+             helper.make_tensor_value_info("mask", TensorProto.FLOAT, (2, 1, 1, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 8))],
+        )
+
+        mask = np.array([[1, 1, 1, 0], [1, 1, 0, 0]], dtype=np.float32).reshape([2, 1, 1, 4])
+        new_proto = self.run_and_compare(["res"], {"X": np.random.randn(2, 4, 8).astype(np.float32), "mask": mask},
+                                         self._make_ms_model(graph), "Attention", 1, rtol=1e-5)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("Softmax", 0), 0)
+
+    def _make_layer_norm(self, x, output, axis):
+        """Layer norm of x over its last axis in the form the layer norm rewriter emits at the test opset."""
+        if self.config.opset >= 17:
+            return [helper.make_node("LayerNormalization", [x, "gamma", "beta"], [output], axis=axis, epsilon=1e-5,
+                                     name="layer_norm")]
+        return [self._make_onnx_const(np.array(2, dtype=np.float32), "two"),
+                self._make_onnx_const(np.array(1e-5, dtype=np.float32), "epsilon"),
+                helper.make_node("ReduceMean", [x], ["mean"], axes=[axis], keepdims=1, name="mean"),
+                helper.make_node("Sub", [x, "mean"], ["centered"], name="centered"),
+                helper.make_node("Pow", ["centered", "two"], ["squared"], name="squared"),
+                helper.make_node("ReduceMean", ["squared"], ["variance"], axes=[axis], keepdims=1, name="variance"),
+                helper.make_node("Add", ["variance", "epsilon"], ["variance_epsilon"], name="add_epsilon"),
+                helper.make_node("Sqrt", ["variance_epsilon"], ["std"], name="std"),
+                helper.make_node("Div", ["centered", "std"], ["normalized"], name="normalized"),
+                helper.make_node("Mul", ["normalized", "gamma"], ["scaled"], name="scaled"),
+                helper.make_node("Add", ["scaled", "beta"], [output], name="layer_norm")]
+
+    @check_opset_min_version(7, "Pow")
+    def test_skip_layer_norm(self):
+        node0 = helper.make_node("Add", ["Y", "bias"], ["Y1"], name="bias_add")
+        node1 = helper.make_node("Add", ["X", "Y1"], ["Z"], name="residual_add")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(np.random.randn(8).astype(np.float32), "bias"),
+             self._make_onnx_const(np.random.randn(8).astype(np.float32), "gamma"),
+             self._make_onnx_const(np.random.randn(8).astype(np.float32), "beta"), node0, node1] +
+            self._make_layer_norm("Z", "res", 1),
+            "skip-layer-norm-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (6, 8)),
+             helper.make_tensor_value_info("Y", TensorProto.FLOAT, (6, 8))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (6, 8))],
+        )
+
+        new_proto = self.run_and_compare(["res"], {"X": np.random.randn(6, 8).astype(np.float32),
+                                                   "Y": np.random.randn(6, 8).astype(np.float32)},
+                                         self._make_ms_model(graph), "Add", 0, rtol=1e-5)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("SkipLayerNormalization", 0),
+                         1)
+
+    @check_opset_min_version(7, "Pow")
+    def test_embed_layer_norm(self):
+        node0 = helper.make_node("Gather", ["word_table", "ids"], ["word"], name="word_gather")
+        node1 = helper.make_node("Gather", ["segment_table", "segment_ids"], ["segment"], name="segment_gather")
+        node2 = helper.make_node("Add", ["word", "position"], ["word_position"], name="position_add")
+        node3 = helper.make_node("Add", ["word_position", "segment"], ["Z"], name="segment_add")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(np.random.randn(10, 8).astype(np.float32), "word_table"),
+             self._make_onnx_const(np.random.randn(2, 8).astype(np.float32), "segment_table"),
+             self._make_onnx_const(np.random.randn(1, 4, 8).astype(np.float32), "position"),
+             self._make_onnx_const(np.random.randn(8).astype(np.float32), "gamma"),
+             self._make_onnx_const(np.random.randn(8).astype(np.float32), "beta"), node0, node1, node2, node3] +
+            self._make_layer_norm("Z", "res", 2),
+            "embed-layer-norm-test",
+            [helper.make_tensor_value_info("ids", TensorProto.INT64, (2, 4)),
+             helper.make_tensor_value_info("segment_ids", TensorProto.INT64, (2, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 4, 8))],
+        )
+
+        new_proto = self.run_and_compare(["res"], {"ids": np.random.randint(0, 10, [2, 4]).astype(np.int64),
+                                                   "segment_ids": np.array([[0, 0, 1, 1], [0, 1, 1, 1]])},
+                                         self._make_ms_model(graph), "Gather", 0, rtol=1e-5)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("EmbedLayerNormalization", 0),
+                         1)
+
+    @check_opset_min_version(7, "Pow")
+    def test_attention_without_ms_domain(self):
+        node0 = helper.make_node("Add", ["X", "Y"], ["Z"], name="residual_add")
+
+        graph = helper.make_graph(
+            [self._make_onnx_const(np.ones(8, dtype=np.float32), "gamma"),
+             self._make_onnx_const(np.zeros(8, dtype=np.float32), "beta"), node0] +
+            self._make_layer_norm("Z", "res", 1),
+            "skip-layer-norm-onnx-domain-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (6, 8)),
+             helper.make_tensor_value_info("Y", TensorProto.FLOAT, (6, 8))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (6, 8))],
+        )
+
+        new_proto = GraphUtil.optimize_model_proto(self.make_model(graph, producer_name="onnx-tests"))
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("SkipLayerNormalization", 0),
+                         0)
+    # Attention Optimizer Tests End
+
+    # Reshape Optimizer Tests Start
+
+    def run_reshape_compare(self, output_names_with_port, onnx_feed_dict, origin_proto, op_type="Reshape",
+                            remaining_op_num=None):
+        return self.run_and_compare(output_names_with_port, onnx_feed_dict, origin_proto, op_type=op_type,
+                                    remaining_op_num=remaining_op_num)
+
+    def test_reshape_chain(self):
+        shape = np.array([1, 6, 4], dtype=np.int64)
+        node1 = helper.make_node("Unsqueeze", ["X"], ["Y1"], axes=[0], name="unsqueeze")
+        node2 = self._make_onnx_const(shape, "shape")
+        node3 = helper.make_node("Reshape", ["Y1", "shape"], ["Y2"], name="reshape")
+        node4 = helper.make_node("Squeeze", ["Y2"], ["Y3"], axes=[0], name="squeeze")
+        node5 = helper.make_node("Flatten", ["Y3"], ["Y4"], axis=0, name="flatten")
+        node6 = helper.make_node("Relu", ["Y4"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6],
+            "reshape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 24))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        model_after_opt = self.run_reshape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                                   model_proto, remaining_op_num=1)
+        ops = GraphUtil.get_node_count_from_onnx_graph(model_after_opt.graph)
+        self.assertEqual(sum(ops.get(op, 0) for op in ["Squeeze", "Unsqueeze", "Flatten"]), 0)
+
+    def test_reshape_noop(self):
+        shape = np.array([0, 3, -1], dtype=np.int64)
+        node1 = self._make_onnx_const(shape, "shape")
+        node2 = helper.make_node("Reshape", ["X", "shape"], ["Y"], name="reshape")
+        node3 = helper.make_node("Relu", ["Y"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2, node3],
+            "reshape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, ("N", 3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, ("N", 3, 4))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_reshape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                 model_proto, remaining_op_num=0)
+
+    def test_squeeze_unsqueeze_noop(self):
+        node1 = helper.make_node("Unsqueeze", ["X"], ["Y1"], axes=[1, 3], name="unsqueeze")
+        node2 = helper.make_node("Squeeze", ["Y1"], ["Y2"], axes=[3, 1], name="squeeze")
+        node3 = helper.make_node("Relu", ["Y2"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2, node3],
+            "reshape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, ("N", "M"))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, ("N", "M"))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_reshape_compare(["res"], {"X": np.random.randn(2, 3).astype(np.float32)},
+                                 model_proto, op_type="Squeeze", remaining_op_num=0)
+
+    def test_reshape_chain_unknown_dims(self):
+        shape = np.array([0, 0, 2, 2], dtype=np.int64)
+        node1 = helper.make_node("Unsqueeze", ["X"], ["Y1"], axes=[3], name="unsqueeze")
+        node2 = helper.make_node("Squeeze", ["Y1"], ["Y2"], axes=[3], name="squeeze")
+        node3 = self._make_onnx_const(shape, "shape")
+        node4 = helper.make_node("Reshape", ["Y2", "shape"], ["res"], name="reshape")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "reshape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, ("N", "M", 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, ("N", "M", 2, 2))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        model_after_opt = self.run_reshape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                                   model_proto, remaining_op_num=1)
+        ops = GraphUtil.get_node_count_from_onnx_graph(model_after_opt.graph)
+        self.assertEqual(ops.get("Shape", 0), 0)
+
+    def test_reshape_chain_gathered_dims(self):
+        shape = np.array([0, 0, 0, 2, 2], dtype=np.int64)
+        node1 = helper.make_node("Unsqueeze", ["X"], ["Y1"], axes=[0], name="unsqueeze1")
+        node2 = helper.make_node("Unsqueeze", ["Y1"], ["Y2"], axes=[4], name="unsqueeze2")
+        node3 = helper.make_node("Squeeze", ["Y2"], ["Y3"], axes=[4], name="squeeze")
+        node4 = self._make_onnx_const(shape, "shape")
+        node5 = helper.make_node("Reshape", ["Y3", "shape"], ["res"], name="reshape")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5],
+            "reshape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, ("N", "M", 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, "N", "M", 2, 2))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_reshape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                 model_proto, op_type="Unsqueeze", remaining_op_num=0)
+
+    # Reshape Optimizer Tests End
+
+    # Cast Optimizer Tests Start
+
+    def run_cast_compare(self, output_names_with_port, onnx_feed_dict, origin_proto, remaining_cast_num=None):
+        return self.run_and_compare(output_names_with_port, onnx_feed_dict, origin_proto, op_type="Cast",
+                                    remaining_op_num=remaining_cast_num)
+
+    def test_cast_to_same_dtype(self):
+        node1 = helper.make_node("Cast", ["X"], ["Y"], to=TensorProto.FLOAT, name="cast")
+        node2 = helper.make_node("Relu", ["Y"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2],
+            "cast-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_cast_compare(["res"], {"X": np.random.randn(2, 3).astype(np.float32)},
+                              model_proto, remaining_cast_num=0)
+
+    def test_cast_pair_lossless(self):
+        node1 = helper.make_node("Cast", ["X"], ["Y1"], to=TensorProto.INT64, name="cast1")
+        node2 = helper.make_node("Cast", ["Y1"], ["Y2"], to=TensorProto.INT32, name="cast2")
+        node3 = helper.make_node("Cast", ["X"], ["Y3"], to=TensorProto.DOUBLE, name="cast3")
+        node4 = helper.make_node("Cast", ["Y3"], ["Y4"], to=TensorProto.FLOAT, name="cast4")
+        node5 = helper.make_node("Cast", ["Y2"], ["Y5"], to=TensorProto.FLOAT, name="cast5")
+        node6 = helper.make_node("Add", ["Y4", "Y5"], ["res"], name="add")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6],
+            "cast-test",
+            [helper.make_tensor_value_info("X", TensorProto.INT32, (2, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        # both branches end up as the same Cast of X to float
+        self.run_cast_compare(["res"], {"X": np.random.randint(-100, 100, (2, 3)).astype(np.int32)},
+                              model_proto, remaining_cast_num=1)
+
+    def test_cast_pair_lossy(self):
+        # int32 values above 2**24 change in a round trip through float
+        node1 = helper.make_node("Cast", ["X"], ["Y"], to=TensorProto.FLOAT, name="cast1")
+        node2 = helper.make_node("Cast", ["Y"], ["res"], to=TensorProto.INT32, name="cast2")
+
+        graph = helper.make_graph(
+            [node1, node2],
+            "cast-test",
+            [helper.make_tensor_value_info("X", TensorProto.INT32, (3,))],
+            [helper.make_tensor_value_info("res", TensorProto.INT32, (3,))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_cast_compare(["res"], {"X": np.array([1, 2 ** 24 + 1, -2 ** 30 - 1], dtype=np.int32)},
+                              model_proto, remaining_cast_num=2)
+
+    def test_cast_through_shape_ops(self):
+        node1 = helper.make_node("Cast", ["X"], ["Y1"], to=TensorProto.INT64, name="cast1")
+        node2 = helper.make_node("Unsqueeze", ["Y1"], ["Y2"], axes=[0], name="unsqueeze")
+        node3 = helper.make_node("Transpose", ["Y2"], ["Y3"], perm=[0, 2, 1], name="transpose")
+        node4 = helper.make_node("Cast", ["Y3"], ["res"], to=TensorProto.INT32, name="cast2")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "cast-test",
+            [helper.make_tensor_value_info("X", TensorProto.INT32, (2, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.INT32, (1, 3, 2))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_cast_compare(["res"], {"X": np.random.randint(-100, 100, (2, 3)).astype(np.int32)},
+                              model_proto, remaining_cast_num=0)
+
+    # Cast Optimizer Tests End
+
+    # Shape Optimizer Tests Start
+
+    def run_shape_compare(self, output_names_with_port, onnx_feed_dict, origin_proto, op_type="Shape",
+                          remaining_op_num=None):
+        return self.run_and_compare(output_names_with_port, onnx_feed_dict, origin_proto, op_type=op_type,
+                                    remaining_op_num=remaining_op_num)
+
+    def _make_shape_graph(self, input_shape, output_shape):
+        # reshape X to the dims 0, 2 and 1 of its shape
+        node1 = helper.make_node("Shape", ["X"], ["S"], name="shape")
+        node2 = self._make_onnx_const(np.array([0], dtype=np.int64), "index0")
+        node3 = self._make_onnx_const(np.array([2], dtype=np.int64), "index2")
+        node4 = self._make_onnx_const(np.array([1], dtype=np.int64), "index1")
+        node5 = helper.make_node("Gather", ["S", "index0"], ["D0"], name="gather0")
+        node6 = helper.make_node("Gather", ["S", "index2"], ["D2"], name="gather2")
+        node7 = helper.make_node("Gather", ["S", "index1"], ["D1"], name="gather1")
+        node8 = helper.make_node("Concat", ["D0", "D2", "D1"], ["new_shape"], axis=0, name="concat")
+        node9 = helper.make_node("Reshape", ["X", "new_shape"], ["res"], name="reshape")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7, node8, node9],
+            "shape-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, input_shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, output_shape)],
+        )
+        return self.make_model(graph, producer_name="onnx-tests")
+
+    @check_opset_min_version(5, "Reshape")
+    def test_shape_known_dims(self):
+        model_proto = self._make_shape_graph((2, 3, 4), (2, 4, 3))
+        new_proto = self.run_shape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                                           model_proto, remaining_op_num=0)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("Concat", 0), 0)
+
+    @check_opset_min_version(5, "Reshape")
+    def test_shape_unknown_batch(self):
+        # the batch dim stays dynamic, the other dims become consts
+        model_proto = self._make_shape_graph(("N", 3, 4), ("N", 4, 3))
+        self.run_shape_compare(["res"], {"X": np.random.randn(2, 3, 4).astype(np.float32)},
+                               model_proto, op_type="Gather", remaining_op_num=1)
+
+    @check_opset_min_version(9, "Less")
+    def test_shape_loop_carried(self):
+        # the loop carried value grows each iteration, the shape its static shape claims is only the first one
+        ten_node = self._make_onnx_const(np.array([10], dtype=np.int64), "ten")
+        two_node = self._make_onnx_const(np.array([2], dtype=np.float32), "two")
+        sub_node1 = helper.make_node("Concat", ["loop_var", "two"], ["loop_var_out"], axis=0, name="sub_concat")
+        sub_node2 = helper.make_node("Shape", ["loop_var_out"], ["shape"], name="sub_shape")
+        sub_node3 = helper.make_node("Less", ["shape", "ten"], ["less"], name="sub_less")
+        sub_node4 = helper.make_node("Squeeze", ["less"], ["cond_out"], axes=[0], name="sub_squeeze")
+        sub_graph = helper.make_graph(
+            [sub_node1, sub_node2, sub_node3, sub_node4],
+            "loop-body",
+            [helper.make_tensor_value_info("iter_num", TensorProto.INT64, ()),
+             helper.make_tensor_value_info("cond", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info("loop_var", TensorProto.FLOAT, (1,))],
+            [helper.make_tensor_value_info("cond_out", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info("loop_var_out", TensorProto.FLOAT, (2,))],
+        )
+        cond_init_node = self._make_onnx_const(np.array(True, dtype=np.bool), "cond_init")
+        loop_node = helper.make_node("Loop", ["", "cond_init", "X"], ["Y"], name="loop", body=sub_graph)
+        graph = helper.make_graph(
+            [ten_node, two_node, cond_init_node, loop_node],
+            "shape-loop-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1,))],
+            [helper.make_tensor_value_info("Y", TensorProto.FLOAT, ("N",))],
+        )
+
+        # onnxruntime folds the Shape by the static shapes as well, the loop would not end
+        new_proto = GraphUtil.optimize_model_proto(self.make_model(graph, producer_name="onnx-tests"))
+        loop = [n for n in new_proto.graph.node if n.op_type == "Loop"][0]
+        body = helper.get_attribute_value(loop.attribute[0])
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(body).get("Shape", 0), 1)
+
+    # Shape Optimizer Tests End
+
+    # Control Flow Optimizer Tests Start
+
+    def _make_loop_graph(self, trip_count, cond_node):
+        trip_count_node = self._make_onnx_const(np.array(trip_count, dtype=np.int64), "trip_count")
+        cond_init_node = self._make_onnx_const(np.array(True, dtype=np.bool), "cond_init")
+
+        # the body adds W to the loop carried value and returns it as scan output as well
+        sub_node1 = helper.make_node("Add", ["loop_var", "W"], ["sum"], name="sub_add")
+        sub_node2 = helper.make_node("Identity", ["sum"], ["loop_var_out"], name="sub_identity_1")
+        sub_node3 = helper.make_node("Identity", ["sum"], ["scan_out"], name="sub_identity_2")
+        sub_graph = helper.make_graph(
+            [sub_node1, sub_node2, sub_node3, cond_node],
+            "loop-body",
+            [helper.make_tensor_value_info("iter_num", TensorProto.INT64, ()),
+             helper.make_tensor_value_info("cond", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info("loop_var", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info("cond_out", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info("loop_var_out", TensorProto.FLOAT, (2, 3)),
+             helper.make_tensor_value_info("scan_out", TensorProto.FLOAT, (2, 3))],
+        )
+        loop_node = helper.make_node("Loop", ["trip_count", "cond_init", "X"], ["Y", "Z"], name="loop",
+                                     body=sub_graph)
+        graph = helper.make_graph(
+            [trip_count_node, cond_init_node, loop_node],
+            "loop-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3)),
+             helper.make_tensor_value_info("W", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info("Y", TensorProto.FLOAT, (2, 3)),
+             helper.make_tensor_value_info("Z", TensorProto.FLOAT, (trip_count, 2, 3))],
+        )
+        return self.make_model(graph, producer_name="onnx-tests")
+
+    def test_if_const_cond(self):
+        then_graph = helper.make_graph(
+            [helper.make_node("Add", ["X", "X"], ["then_out"], name="then_add")],
+            "then-branch", [], [helper.make_tensor_value_info("then_out", TensorProto.FLOAT, (2, 3))],
+        )
+        else_graph = helper.make_graph(
+            [helper.make_node("Sub", ["X", "X"], ["else_out"], name="else_sub")],
+            "else-branch", [], [helper.make_tensor_value_info("else_out", TensorProto.FLOAT, (2, 3))],
+        )
+        node1 = self._make_onnx_const(np.array(True, dtype=np.bool), "cond")
+        node2 = helper.make_node("If", ["cond"], ["Y"], name="if", then_branch=then_graph, else_branch=else_graph)
+        node3 = helper.make_node("Relu", ["Y"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2, node3],
+            "if-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 3).astype(np.float32)},
+                             model_proto, "If", 0)
+
+    def test_loop_unroll(self):
+        cond_node = helper.make_node("Identity", ["cond"], ["cond_out"], name="sub_identity_3")
+        model_proto = self._make_loop_graph(3, cond_node)
+        self.run_and_compare(["Y", "Z"], {"X": np.random.randn(2, 3).astype(np.float32),
+                                          "W": np.random.randn(2, 3).astype(np.float32)},
+                             model_proto, "Loop", 0)
+
+    @check_opset_min_version(9, "Less")
+    def test_loop_unroll_early_exit(self):
+        # the loop can stop before its trip count, it is kept
+        cond_node = helper.make_node("Less", ["iter_num", "trip_count"], ["cond_out"], name="sub_less")
+        model_proto = self._make_loop_graph(3, cond_node)
+        self.run_and_compare(["Y", "Z"], {"X": np.random.randn(2, 3).astype(np.float32),
+                                          "W": np.random.randn(2, 3).astype(np.float32)},
+                             model_proto, "Loop", 1)
+
+    # Control Flow Optimizer Tests End
+
+    # Unused Output Optimizer Tests Start
+
+    def test_split_to_slices(self):
+        node1 = helper.make_node("Split", ["X"], ["S1", "S2", "S3"], axis=1, name="split")
+        node2 = helper.make_node("Relu", ["S2"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2],
+            "split-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (4, 6))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (4, 2))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        new_proto = self.run_and_compare(["res"], {"X": np.random.randn(4, 6).astype(np.float32)},
+                                         model_proto, "Split", 0)
+        self.assertEqual(GraphUtil.get_node_count_from_onnx_graph(new_proto.graph).get("Slice", 0), 1)
+
+    @check_opset_min_version(7, "LSTM")
+    def test_unused_lstm_outputs(self):
+        # only Y_h is read, Y gets an empty name and Y_c is left out
+        hidden_size = 2
+        node1 = self._make_onnx_const(np.random.randn(1, 4 * hidden_size, 3).astype(np.float32), "W")
+        node2 = self._make_onnx_const(np.random.randn(1, 4 * hidden_size, hidden_size).astype(np.float32), "R")
+        node3 = helper.make_node("LSTM", ["X", "W", "R"], ["Y", "Y_h", "Y_c"], hidden_size=hidden_size,
+                                 name="lstm")
+        node4 = helper.make_node("Relu", ["Y_h"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "lstm-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (5, 1, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 1, hidden_size))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        new_proto = self.run_and_compare(["res"], {"X": np.random.randn(5, 1, 3).astype(np.float32)},
+                                         model_proto, "LSTM", 1, rtol=1e-05)
+        lstm = [n for n in new_proto.graph.node if n.op_type == "LSTM"][0]
+        self.assertEqual(list(lstm.output), ["", "Y_h"])
+
+    def test_unused_outputs_of_unknown_op(self):
+        # an op missing from the schema registry is left as it is, and not added to the registry
+        node1 = helper.make_node("UnknownOp", ["X"], ["Y", "Z"], name="unknown")
+        node2 = helper.make_node("Relu", ["Y"], ["res"], name="relu")
+
+        graph = helper.make_graph(
+            [node1, node2],
+            "unknown-test",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = self.make_model(graph, producer_name="onnx-tests")
+        new_proto = GraphUtil.optimize_model_proto(model_proto)
+        unknown = [n for n in new_proto.graph.node if n.op_type == "UnknownOp"][0]
+        self.assertEqual(list(unknown.output), ["Y", "Z"])
+        self.assertFalse(schemas.has_schema("UnknownOp"))
+
+    # Unused Output Optimizer Tests End
+
 
 if __name__ == "__main__":
     unittest_main()
@@ -12,10 +12,8 @@ from __future__ import unicode_literals
 import argparse
 import sys
 
-import tensorflow as tf
-
 from tf2onnx.tfonnx import process_tf_graph, tf_optimize
-from tf2onnx import constants, loader, logging, utils, optimizer
+from tf2onnx import constants, float16, loader, logging, utils, optimizer, profiler
 
 
 # pylint: disable=unused-argument
@@ -58,8 +56,19 @@ def get_args():
     parser.add_argument("--debug", help="debug mode", action="store_true")
     parser.add_argument("--fold_const", help="enable tf constant_folding transformation before conversion",
                         action="store_true")
+    parser.add_argument("--profile", help="write a chrome trace of the conversion phases to this file")
+    parser.add_argument("--profile-memory", help="record python memory peaks of each phase in --profile, slower",
+                        action="store_true")
     # experimental
     parser.add_argument("--inputs-as-nchw", help="transpose inputs as from nhwc to nchw")
+    parser.add_argument("--plan-layout", help="convert regions of nhwc conv, pool and batchnorm ops to nchw",
+                        action="store_true")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "fp16"],
+                        help="precision of the float computations and initializers")
+    parser.add_argument("--fp32-ops", help="op types kept in fp32 with --precision fp16, default is {}".format(
+        ",".join(float16.FP32_OPS)))
+    parser.add_argument("--fp16-io", help="use fp16 for the float inputs and outputs with --precision fp16",
+                        action="store_true")
     args = parser.parse_args()
 
     args.shape_override = None
@@ -80,6 +89,8 @@ def get_args():
         args.inputs_as_nchw = args.inputs_as_nchw.split(",")
     if args.target:
         args.target = args.target.split(",")
+    if args.fp32_ops is not None:
+        args.fp32_ops = [op for op in args.fp32_ops.split(",") if op]
     if args.signature_def:
         args.signature_def = [args.signature_def]
     if args.extra_opset:
@@ -96,14 +107,8 @@ def default_custom_op_handler(ctx, node, name, args):
     return node
 
 
-def main():
-    args = get_args()
-    logging.basicConfig(level=logging.get_verbosity_level(args.verbose))
-    if args.debug:
-        utils.set_debug_mode(True)
-
-    logger = logging.getLogger(constants.TF2ONNX_PACKAGE_NAME)
-
+def convert_model(args, logger):
+    """Convert the model given on the commandline and save it, phases are timed by the profiler."""
     extra_opset = args.extra_opset or []
     custom_ops = {}
     if args.custom_ops:
@@ -112,28 +117,31 @@ def main():
         extra_opset.append(constants.TENSORFLOW_OPSET)
 
     # get the frozen tensorflow model from graphdef, checkpoint or saved_model.
-    if args.graphdef:
-        graph_def, inputs, outputs = loader.from_graphdef(args.graphdef, args.inputs, args.outputs)
-        model_path = args.graphdef
-    if args.checkpoint:
-        graph_def, inputs, outputs = loader.from_checkpoint(args.checkpoint, args.inputs, args.outputs)
-        model_path = args.checkpoint
-    if args.saved_model:
-        graph_def, inputs, outputs = loader.from_saved_model(
-            args.saved_model, args.inputs, args.outputs, args.signature_def)
-        model_path = args.saved_model
+    with profiler.phase("load") as span:
+        if args.graphdef:
+            graph_def, inputs, outputs = loader.from_graphdef(args.graphdef, args.inputs, args.outputs)
+            model_path = args.graphdef
+        if args.checkpoint:
+            graph_def, inputs, outputs = loader.from_checkpoint(args.checkpoint, args.inputs, args.outputs)
+            model_path = args.checkpoint
+        if args.saved_model:
+            graph_def, inputs, outputs = loader.from_saved_model(
+                args.saved_model, args.inputs, args.outputs, args.signature_def)
+            model_path = args.saved_model
+        span.graph = graph_def
 
     if args.verbose:
         logger.info("inputs: %s", inputs)
         logger.info("outputs: %s", outputs)
 
     # todo: consider to enable const folding by default?
-    graph_def = tf_optimize(inputs, outputs, graph_def, args.fold_const)
+    with profiler.phase("tf_optimize", graph_def) as span:
+        graph_def = tf_optimize(inputs, outputs, graph_def, args.fold_const)
+        span.graph = graph_def
 
-    with tf.Graph().as_default() as tf_graph:
-        tf.import_graph_def(graph_def, name='')
-    with tf.Session(graph=tf_graph):
-        g = process_tf_graph(tf_graph,
+    # the frozen graph_def carries _output_shapes, so it is converted without importing it into tensorflow
+    with profiler.phase("process_tf_graph", graph_def) as span:
+        g = process_tf_graph(graph_def,
                              continue_on_error=args.continue_on_error,
                              target=args.target,
                              opset=args.opset,
@@ -142,20 +150,53 @@ def main():
                              shape_override=args.shape_override,
                              input_names=inputs,
                              output_names=outputs,
-                             inputs_as_nchw=args.inputs_as_nchw)
+                             inputs_as_nchw=args.inputs_as_nchw,
+                             plan_layout=args.plan_layout)
+        span.graph = g
 
-    onnx_graph = optimizer.optimize_graph(g)
-    model_proto = onnx_graph.make_model("converted from {}".format(model_path))
+    if args.precision == "fp16":
+        # the optimizers fold the casts and consts left by the conversion
+        with profiler.phase("float16", g):
+            float16.convert_float_to_float16(g, args.fp32_ops, keep_io_types=not args.fp16_io)
+
+    with profiler.phase("optimize_graph", g) as span:
+        onnx_graph = optimizer.optimize_graph(g)
+        span.graph = onnx_graph
+    with profiler.phase("make_model", onnx_graph):
+        model_proto = onnx_graph.make_model("converted from {}".format(model_path))
 
     # write onnx graph
     logger.info("")
     logger.info("Successfully converted TensorFlow model %s to ONNX", model_path)
     if args.output:
-        utils.save_protobuf(args.output, model_proto)
+        with profiler.phase("save_model"):
+            utils.save_protobuf(args.output, model_proto)
         logger.info("ONNX model is saved at %s", args.output)
     else:
         logger.info("To export ONNX model to file, please run with `--output` option")
 
 
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.get_verbosity_level(args.verbose))
+    if args.debug:
+        utils.set_debug_mode(True)
+
+    logger = logging.getLogger(constants.TF2ONNX_PACKAGE_NAME)
+
+    if args.profile:
+        with profiler.Profiler(trace_memory=args.profile_memory) as prof:
+            with profiler.phase("convert"):
+                convert_model(args, logger)
+        prof.save(args.profile)
+    elif logger.isEnabledFor(logging.DEBUG):
+        # -vv, show which handlers the conversion time went to
+        with profiler.HandlerStats() as stats:
+            convert_model(args, logger)
+        logger.debug("Handler stats:\n%s", stats.format_table())
+    else:
+        convert_model(args, logger)
+
+
 if __name__ == "__main__":
     main()
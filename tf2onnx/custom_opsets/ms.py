@@ -42,6 +42,14 @@ class Range:
         make_range(ctx, node.input[0], node.input[1], node.input[2], node.output[0], node.name, shape, dtype)
 
 
+@tf_op(["Gelu", "FastGelu"], domain=constants.MICROSOFT_DOMAIN)
+class Gelu:
+    @classmethod
+    def version_1(cls, ctx, node, **kwargs):
+        # made by rewrite_gelu, T output = Gelu(T input)
+        node.domain = constants.MICROSOFT_DOMAIN
+
+
 @tf_op("Conv2DBackpropInput", domain=constants.MICROSOFT_DOMAIN, onnx_op="ConvTransposeWithDynamicPads")
 class ConvTransposeWithDynamicPads:
     @classmethod
@@ -0,0 +1,153 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.float16 - run the float computations of a converted graph in float16
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+
+import numpy as np
+from onnx import TensorProto
+
+from tf2onnx import schemas, utils
+from tf2onnx.rewriter.layer_norm_rewriter import match_layer_norm
+
+# pylint: disable=logging-not-lazy,missing-docstring
+
+logger = logging.getLogger(__name__)
+
+# ops losing too much precision in float16: exponentials, normalizations and reductions summing up many values
+FP32_OPS = ["CumSum", "EmbedLayerNormalization", "Exp", "InstanceNormalization", "LayerNormalization", "Log",
+            "LogSoftmax", "LpNormalization", "MeanVarianceNormalization", "Pow", "ReduceL1", "ReduceL2",
+            "ReduceLogSum", "ReduceLogSumExp", "ReduceMean", "ReduceProd", "ReduceSum", "ReduceSumSquare",
+            "SkipLayerNormalization", "Softmax", "Sqrt"]
+
+# ops whose output dtype is given by an attribute, Cast is handled by setting its "to"
+_DTYPE_ATTR_OPS = ["ConstantOfShape", "EyeLike", "Multinomial", "RandomNormal", "RandomNormalLike",
+                   "RandomUniform", "RandomUniformLike"]
+
+_FLOAT16_TYPE = "tensor(float16)"
+
+
+def _dtype(g, name):
+    node = g.get_node_by_output(name)
+    if node is not None and node.type == "Cast":
+        # handlers don't always update the dtype left on the output of a Cast
+        return node.get_attr_value("to")
+    return g.get_dtype(name)
+
+
+def _float16_items(g, node, fp32_ops, keep_io_types):
+    """Indices of the float inputs and outputs of node that change to float16, None if node stays in float."""
+    if node.is_const() or node.is_graph_input() or node.type in fp32_ops or node.type in _DTYPE_ATTR_OPS or \
+            not utils.is_onnx_domain(node.domain) or node.get_body_graphs():
+        # the inputs subgraphs read from outer scopes would need casts inside the subgraphs
+        return None
+    if keep_io_types and any(o in g.outputs for o in node.output):
+        return None
+    schema = schemas.get_schema(node.type, g.opset, node.domain)
+    if schema is None:
+        return None
+    inputs = [i for i, name in enumerate(node.input)
+              if name and _dtype(g, name) == TensorProto.FLOAT and
+              _FLOAT16_TYPE in schema.allowed_types(schema.inputs, i)]
+    outputs = [i for i, name in enumerate(node.output)
+               if name and _dtype(g, name) == TensorProto.FLOAT and
+               _FLOAT16_TYPE in schema.allowed_types(schema.outputs, i)]
+    if not inputs and not outputs:
+        return None
+    return inputs, outputs
+
+
+def _consumers(g):
+    """Nodes of g and of the subgraphs in it."""
+    for node in g.get_nodes():
+        yield node
+        for body_graph in (node.get_body_graphs() or {}).values():
+            for n in _consumers(body_graph):
+                yield n
+
+
+def convert_float_to_float16(g, fp32_ops=None, keep_io_types=True):
+    """Run the float computations of g in float16 and store its float initializers as float16.
+    Args:
+        g: converted onnx graph
+        fp32_ops: op types kept in float, default is FP32_OPS
+        keep_io_types: keep the float inputs and outputs of the model
+    Nodes with subgraphs and the subgraphs themselves stay in float. Casts are inserted where tensors go
+    from float to float16 ops and back, one for each tensor and dtype.
+    """
+    if fp32_ops is None:
+        fp32_ops = FP32_OPS
+    # before opset 17 layer norms are a chain of ops, it stays in float as a whole like LayerNormalization
+    fp32_nodes = set()
+    if "LayerNormalization" in fp32_ops:
+        for node in g.get_nodes():
+            match = match_layer_norm(g, node)
+            if match is not None:
+                fp32_nodes.update(n.name for n in match[-1])
+    float16_items = {}
+    for node in g.get_nodes():
+        if node.name in fp32_nodes:
+            continue
+        items = _float16_items(g, node, fp32_ops, keep_io_types)
+        if items:
+            float16_items[node.name] = items
+    # ops only reading floats, e.g. Shape or ArgMax, stay in float if they read no float16 tensor anyway
+    for name, (inputs, outputs) in list(float16_items.items()):
+        node = g.get_node_by_name(name)
+        producers = [g.get_node_by_output(node.input[i]) for i in inputs]
+        if not outputs and not any(p is not None and (p.name in float16_items or p.is_const()) for p in producers):
+            del float16_items[name]
+
+    # the dtype every consumer expects for its float inputs, before the producers are changed
+    edges = []
+    for node in _consumers(g):
+        inputs = float16_items[node.name][0] if node.graph == g and node.name in float16_items else []
+        for i, name in enumerate(node.input):
+            dtype = _dtype(g, name) if name else None
+            if dtype == TensorProto.FLOAT:
+                edges.append((node, i, TensorProto.FLOAT16 if i in inputs else TensorProto.FLOAT))
+
+    for node in g.get_nodes():
+        if node.name in float16_items:
+            for i in float16_items[node.name][1]:
+                g.set_dtype(node.output[i], TensorProto.FLOAT16)
+            if node.type == "Cast" and node.get_attr_value("to") == TensorProto.FLOAT:
+                node.set_attr("to", TensorProto.FLOAT16)
+        elif node.is_graph_input() and not keep_io_types and g.get_dtype(node.output[0]) == TensorProto.FLOAT:
+            g.set_dtype(node.output[0], TensorProto.FLOAT16)
+
+    # float consts only read in float16 are stored as float16
+    fp32_reads = set(node.input[i] for node, i, dtype in edges if dtype == TensorProto.FLOAT)
+    for node in g.get_nodes():
+        if node.is_const() and g.get_dtype(node.output[0]) == TensorProto.FLOAT and \
+                node.output[0] not in fp32_reads and node.output[0] not in g.outputs:
+            node.set_tensor_value(node.get_tensor_value(as_list=False).astype(np.float16))
+            g.set_dtype(node.output[0], TensorProto.FLOAT16)
+
+    casts = {}
+    for node, i, dtype in edges:
+        name = node.input[i]
+        if _dtype(g, name) == dtype:
+            continue
+        if (name, dtype) not in casts:
+            producer = g.get_node_by_output(name)
+            if producer.is_const():
+                value = producer.get_tensor_value(as_list=False)
+                value = value.astype(np.float16 if dtype == TensorProto.FLOAT16 else np.float32)
+                new_name = g.make_const(utils.make_name(producer.name), value).output[0]
+            else:
+                new_name = g.make_node("Cast", [name], attr={"to": dtype}, op_name_scope=producer.name,
+                                       shapes=[g.get_shape(name)], dtypes=[dtype]).output[0]
+            casts[(name, dtype)] = new_name
+        node.input[i] = casts[(name, dtype)]
+
+    logger.info("Converted %d nodes to float16, %d tensors are cast between float and float16",
+                len(float16_items), len(casts))
+    return g
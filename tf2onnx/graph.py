@@ -12,13 +12,14 @@ from __future__ import unicode_literals
 import collections
 import copy
 import logging
+import re
 import six
 import numpy as np
 
 from onnx import helper, numpy_helper, shape_inference, OperatorSetIdProto, AttributeProto, TensorProto
 from tf2onnx import utils, __version__
 from tf2onnx.utils import make_name, port_name, find_opset
-from tf2onnx import optimizer
+from tf2onnx import optimizer, profiler
 from tf2onnx.schemas import get_schema, infer_onnx_shape_dtype
 from tf2onnx import constants
 
@@ -69,12 +70,15 @@ class Node(object):
         """
         self._graph_check()
         for o in self._output:
-            del self.graph._output_to_node_name[o]
+            if o:
+                del self.graph._output_to_node_name[o]
 
         self._output = val
         for o in self._output:
-            utils.make_sure(o not in self.graph._output_to_node_name, "output %s already in output mapping", o)
-            self.graph._output_to_node_name[o] = self.name
+            # an empty name marks an optional output that is not produced
+            if o:
+                utils.make_sure(o not in self.graph._output_to_node_name, "output %s already in output mapping", o)
+                self.graph._output_to_node_name[o] = self.name
 
     @property
     def inputs(self):
@@ -397,8 +401,15 @@ class Graph(object):
         self.parent_graph = None
         self.contained_graphs = {}  # {node_name: {node_attribute_name: Graph}}
 
+        # {node_name: (tf node name, producer)}, entries are kept when nodes are removed
+        self.provenance = {}
+
         ops = [Node(node, self) for node in nodes]
         self.reset_nodes(ops)
+        origin = utils.get_node_origin()
+        producer = origin[1] if origin else "tf"
+        for op in ops:
+            self.provenance[op.name] = (op.name, producer)
 
         # add identity node after each output, in case it is renamed during conversion.
         for o in self.outputs:
@@ -438,6 +449,11 @@ class Graph(object):
     def extra_opset(self):
         return self._extra_opset
 
+    @property
+    def input_names(self):
+        """Outputs of the placeholders that are the ordered inputs of a subgraph."""
+        return [node.output[0] for node in self._order_sensitive_inputs]
+
     def is_target(self, *names):
         """Return True if target platform contains any name."""
         return any(name in self._target for name in names)
@@ -526,8 +542,33 @@ class Graph(object):
 
         logger.debug("Made node: %s\n%s", node.name, node.summary)
         self._nodes.append(node)
+        profiler.counters.nodes_created += 1
+        origin = utils.get_node_origin()
+        if origin:
+            self.provenance[name] = origin
         return node
 
+    def get_node_origin(self, node_name):
+        """
+        Return (tf node name, producer) of a node. Nodes made without tf node are traced by their name,
+        dropping the __N suffix of utils.make_name and trailing name parts added to an op_name_scope.
+        """
+        tf_node, producer = self.provenance.get(node_name, (None, None))
+        if tf_node:
+            return tf_node, producer
+        candidate = re.sub(r"__\d+", "", node_name)
+        while candidate:
+            origin = self.provenance.get(candidate)
+            if origin and origin[0]:
+                return origin[0], producer or origin[1]
+            cut = max(candidate.rfind("/"), candidate.rfind("_"))
+            if cut <= 0:
+                break
+            candidate = candidate[:cut]
+        if self.parent_graph is not None:
+            return self.parent_graph.get_node_origin(node_name)[0], producer
+        return None, producer
+
     def remove_node(self, node_name):
         """Remove node in current graph."""
         utils.make_sure(node_name in self._nodes_by_name, "node %s not in current graph, cannot remove", node_name)
@@ -540,6 +581,8 @@ class Graph(object):
             self._order_sensitive_inputs.remove(node)
 
         for op_output in node.output:
+            if not op_output:
+                continue
             del self._output_to_node_name[op_output]
 
             if op_output in self._output_shapes:
@@ -549,6 +592,7 @@ class Graph(object):
 
         self._nodes.remove(node)
         node.graph = None
+        profiler.counters.nodes_removed += 1
 
     def reset_nodes(self, ops):
         """Reset the graph with node list."""
@@ -566,13 +610,18 @@ class Graph(object):
             if op.name in self.contained_graphs:
                 remained_sub_graphs[op.name] = self.contained_graphs[op.name]
 
+        if profiler.handler_stats_enabled():
+            kept = set(op.name for op in ops)
+            profiler.counters.nodes_removed += sum(1 for name in self._nodes_by_name if name not in kept)
+
         self._nodes = ops
         self.contained_graphs = remained_sub_graphs
         self._nodes_by_name = {op.name: op for op in ops}
         self._output_to_node_name = {}
         for op in ops:
             for op_output in op.output:
-                self._output_to_node_name[op_output] = op.name
+                if op_output:
+                    self._output_to_node_name[op_output] = op.name
 
         for n in self._order_sensitive_inputs:
             if n not in ops:
@@ -633,6 +682,7 @@ class Graph(object):
         input_shapes = [self.get_shape(i) for i in node.input]
         input_dtypes = [self.get_dtype(i) for i in node.input]
 
+        profiler.counters.shape_inferences += 1
         shapes, dtypes = infer_onnx_shape_dtype(node, self._opset, input_shapes, input_dtypes, initializers)
         if not shapes or not dtypes:
             return
@@ -705,7 +755,8 @@ class Graph(object):
         """Set node by name."""
         self._nodes_by_name[node.name] = node
         for op_output in node.output:
-            self._output_to_node_name[op_output] = node.name
+            if op_output:
+                self._output_to_node_name[op_output] = node.name
 
     def add_graph_input(self, name, dtype=None, shape=None):
         """Add placeholder node as graph's input. Order matters only for subgraph.
@@ -13,6 +13,7 @@ import logging
 
 import numpy as np
 
+from onnx import helper
 from onnx.onnx_pb import TensorProto
 from tf2onnx import utils
 from tf2onnx.handler import tf_op
@@ -170,13 +171,8 @@ def make_range_const(ctx, start, limit, delta, output, scope_name, shape, dtype)
     ctx.make_node("Identity", [const_range.output[0]], shapes=[shape], dtypes=[dtype], outputs=[output])
 
 
-def make_range_non_const(ctx, start, limit, delta, output, scope_name, shape, dtype):
-    """make Range subgraph."""
-    # T range = Range(T start, T limit, T delta)
-    # V v_final_and_scan_outputs = Loop(int64 M, B cond, V v_initial)
-    base_name = utils.make_name(scope_name)
-
-    # trip_count
+def _make_range_trip_count(ctx, start, limit, delta, base_name, dtype):
+    """make the float output of ceil((limit - start) / delta)."""
     diff_node = ctx.make_node("Sub",
                               [limit, start],
                               op_name_scope=base_name,
@@ -194,9 +190,44 @@ def make_range_non_const(ctx, start, limit, delta, output, scope_name, shape, dt
         delta_cast = cast_node.output[0]
     div_node = ctx.make_node("Div", [diff_output, delta_cast], op_name_scope=base_name, name="div")
     ceil_node = ctx.make_node("Ceil", [div_node.output[0]], op_name_scope=base_name, name="ceil")
-    trip_count_node = ctx.make_node("Cast", [ceil_node.output[0]], op_name_scope=base_name, name="trip_cnt",
-                                    attr={"to": TensorProto.INT64})
+    return ceil_node.output[0]
+
+
+def make_range_ramp(ctx, start, limit, delta, output, scope_name, shape, dtype):
+    """make Range subgraph as start + ramp * delta, without Loop."""
+    # ramp = [0, 1, ..., n-1] is a constant if n is known, NonZero of n ones otherwise
+    base_name = utils.make_name(scope_name)
+    if shape is not None and len(shape) == 1 and shape[0] >= 0:
+        ramp = ctx.make_const(utils.make_name("ramp"), np.arange(shape[0], dtype=np.int64)).output[0]
+    else:
+        trip_count = _make_range_trip_count(ctx, start, limit, delta, base_name, dtype)
+        # limit on the wrong side of start gives a negative count, tf returns an empty range for it
+        trip_count = ctx.make_node("Relu", [trip_count], op_name_scope=base_name, name="clamp").output[0]
+        trip_count = ctx.make_node("Cast", [trip_count], op_name_scope=base_name, name="trip_cnt",
+                                   attr={"to": TensorProto.INT64}).output[0]
+        ones_shape = ctx.make_node("Unsqueeze", [trip_count], attr={"axes": [0]}, op_name_scope=base_name)
+        one = helper.make_tensor("value", TensorProto.BOOL, [1], [True])
+        ones = ctx.make_node("ConstantOfShape", [ones_shape.output[0]], attr={"value": one},
+                             op_name_scope=base_name)
+        # NonZero returns the indices as [rank, n]
+        non_zero = ctx.make_node("NonZero", [ones.output[0]], op_name_scope=base_name)
+        ramp = ctx.make_node("Squeeze", [non_zero.output[0]], attr={"axes": [0]}, op_name_scope=base_name).output[0]
+    if dtype != TensorProto.INT64:
+        ramp = ctx.make_node("Cast", [ramp], attr={"to": dtype}, op_name_scope=base_name).output[0]
+    scaled = ctx.make_node("Mul", [ramp, delta], op_name_scope=base_name)
+    ctx.make_node("Add", [scaled.output[0], start], name=base_name, shapes=[shape], dtypes=[dtype], outputs=[output])
+
+
+def make_range_non_const(ctx, start, limit, delta, output, scope_name, shape, dtype):
+    """make Range subgraph."""
+    # T range = Range(T start, T limit, T delta)
+    # V v_final_and_scan_outputs = Loop(int64 M, B cond, V v_initial)
+    base_name = utils.make_name(scope_name)
 
+    # trip_count
+    trip_count = _make_range_trip_count(ctx, start, limit, delta, base_name, dtype)
+    trip_count_node = ctx.make_node("Cast", [trip_count], op_name_scope=base_name, name="trip_cnt",
+                                    attr={"to": TensorProto.INT64})
     # cond
     # Use initializer here since Constant OP before opset 9 does not support bool type
     cond_name = "{}_cond".format(base_name)
@@ -228,6 +259,11 @@ def make_range_non_const(ctx, start, limit, delta, output, scope_name, shape, dt
 def make_range(ctx, start, limit, delta, output, scope_name, shape, dtype):
     if all(ctx.get_node_by_output(n).is_const() for n in [start, limit, delta]) is True:
         make_range_const(ctx, start, limit, delta, output, scope_name, shape, dtype)
+    elif ctx.opset >= 11:
+        ctx.make_node("Range", [start, limit, delta], outputs=[output], name=utils.make_name(scope_name),
+                      shapes=[shape], dtypes=[dtype])
+    elif ctx.opset >= 9 or (shape is not None and len(shape) == 1 and shape[0] >= 0):
+        make_range_ramp(ctx, start, limit, delta, output, scope_name, shape, dtype)
     else:
         make_range_non_const(ctx, start, limit, delta, output, scope_name, shape, dtype)
 
@@ -253,7 +289,6 @@ class Range:
     def version_7(cls, ctx, node, **kwargs):
         """Range."""
         # T range = Range(T start, T limit, T delta)
-        # V v_final_and_scan_outputs = Loop(int64 M, B cond, V v_initial)
         dtype = node.get_attr_int("Tidx")
         shape = node.output_shapes[0]
         utils.make_sure(dtype is not None, "Tidx of %s is None", node.name)
@@ -261,15 +296,80 @@ class Range:
         make_range(ctx, node.input[0], node.input[1], node.input[2],
                    node.output[0], node.name, shape, dtype)
 
+    @classmethod
+    def version_11(cls, ctx, node, **kwargs):
+        # make_range emits Range-11 for non const inputs
+        cls.version_7(ctx, node, **kwargs)
+
 
 @tf_op("Select")
 class Select:
     @classmethod
-    def version_8(cls, ctx, node, **kwargs):
+    def version_7(cls, ctx, node, **kwargs):
         # T output = Select(bool condition, T x, T y)
-        # V v_final_and_scan_outputs = Loop(int64 M, B cond, V v_initial)
+        # there is no Where before opset 9, blend x and y elementwise with the condition instead
         utils.make_sure(len(node.input) > 1, "Select with only condition is not supported.")
+        dtype = ctx.get_dtype(node.input[1])
+        if dtype in [TensorProto.FLOAT, TensorProto.DOUBLE, TensorProto.FLOAT16, TensorProto.INT32,
+                     TensorProto.INT64, TensorProto.BOOL]:
+            cls._select_with_blend(ctx, node, dtype)
+        else:
+            cls._select_with_loop(ctx, node)
+
+    @classmethod
+    def _select_with_blend(cls, ctx, node, dtype):
+        """Lower Select to elementwise ops, the cost is linear in the element count with no control flow."""
+        cond, true_data, false_data = node.input
+        cond_shape = ctx.get_shape(cond)
+        shape = ctx.get_shape(true_data)
+        make_sure(cond_shape is not None, "shape of {} is None".format(cond))
+        make_sure(shape is not None, "select true data shape cannot be None")
+        if len(cond_shape) == 1 and len(shape) > 1:
+            # tf selects whole rows with a 1-D condition, reshape it to broadcast
+            broadcast_shape = [-1] + [1] * (len(shape) - 1)
+            shape_const = ctx.make_const(utils.make_name(node.name), np.array(broadcast_shape, dtype=np.int64))
+            cond = ctx.make_node("Reshape", [cond, shape_const.output[0]], op_name_scope=node.name).output[0]
+        not_cond = ctx.make_node("Not", [cond], op_name_scope=node.name).output[0]
+        outputs = node.output
+        ctx.remove_node(node.name)
+
+        def make(op_type, inputs, **kwargs):
+            return ctx.make_node(op_type, inputs, op_name_scope=node.name, **kwargs).output[0]
+
+        if dtype == TensorProto.BOOL:
+            x = make("And", [cond, true_data])
+            y = make("And", [not_cond, false_data])
+            ctx.make_node("Or", [x, y], outputs=outputs, op_name_scope=node.name, shapes=[shape], dtypes=[dtype])
+            return
+
+        if dtype in [TensorProto.INT32, TensorProto.INT64]:
+            # integers have no inf or nan, cond * x + (1 - cond) * y is exact
+            x = make("Mul", [make("Cast", [cond], attr={"to": dtype}), true_data])
+            y = make("Mul", [make("Cast", [not_cond], attr={"to": dtype}), false_data])
+            ctx.make_node("Add", [x, y], outputs=outputs, op_name_scope=node.name, shapes=[shape], dtypes=[dtype])
+            return
+
+        # 0 * inf and 0 * nan are nan, so floats can't be masked by Mul. pow(v, 1) = v and pow(v, 0) = 1
+        # for every v including inf and nan, pow(x, cond) - not_cond is x where cond is true and 0 elsewhere.
+        compute_dtype = dtype
+        if dtype == TensorProto.FLOAT16:
+            compute_dtype = TensorProto.FLOAT
+            true_data = make("Cast", [true_data], attr={"to": compute_dtype})
+            false_data = make("Cast", [false_data], attr={"to": compute_dtype})
+        cond = make("Cast", [cond], attr={"to": compute_dtype})
+        not_cond = make("Cast", [not_cond], attr={"to": compute_dtype})
+        x = make("Sub", [make("Pow", [true_data, cond]), not_cond])
+        y = make("Sub", [make("Pow", [false_data, not_cond]), cond])
+        if compute_dtype == dtype:
+            ctx.make_node("Add", [x, y], outputs=outputs, op_name_scope=node.name, shapes=[shape], dtypes=[dtype])
+        else:
+            ctx.make_node("Cast", [make("Add", [x, y])], attr={"to": dtype}, outputs=outputs,
+                          op_name_scope=node.name, shapes=[shape], dtypes=[dtype])
 
+    @classmethod
+    def _select_with_loop(cls, ctx, node):
+        # V v_final_and_scan_outputs = Loop(int64 M, B cond, V v_initial)
+        # a Loop per dimension of the condition and an If per element, slow but takes any type
         true_data_type = ctx.get_dtype(node.input[1])
         true_data_shape = ctx.get_shape(node.input[1])
         make_sure(true_data_type is not None, "select true data dtype cannot be None")
@@ -331,6 +431,10 @@ class Select:
         # T1 output = Where(bool condition, T1 x, T1 y)
         # NOTE: condition can be 1-dimension in tensorflow, while in onnx,
         # it should be broadcastable with other two inputs
+        if ctx.get_dtype(node.input[1]) == TensorProto.BOOL:
+            # onnxruntime has no bool kernel for Where, And/Or pick the values as well
+            cls._select_with_blend(ctx, node, TensorProto.BOOL)
+            return
         node.type = "Where"
         cond_shape = ctx.get_shape(node.input[0])
         make_sure(cond_shape is not None, "shape of {} is None".format(node.input[0]))
@@ -149,7 +149,7 @@ class Reshape:
         # onnx < opset 8 does not know reshape for other types than float*, wrap the reshape in casts
         input_cast = ctx.insert_new_node_on_input(node, "Cast", node.input[0])
         input_cast.set_attr("to", onnx_pb.TensorProto.FLOAT)
-        ctx.copy_shape(node.output[0], input_cast.output[0])
+        ctx.copy_shape(input_cast.input[0], input_cast.output[0])
 
         # if the next node is already a cast we don't need to insert another one
         next_nodes = ctx.find_output_consumers(node.output[0])
@@ -393,6 +393,62 @@ def _make_gathernd_inner_loop(ctx, params, index, dtype):
 def make_gathernd(ctx, params, indices, output, scope_name, t_params, shapes, dtypes):
     """make GatherNd op."""
     # Tparams output = GatherNd(Tparams params, Tidx indices)
+    indices_shape = ctx.get_shape(indices)
+    if indices_shape and indices_shape[-1] > 0:
+        _make_gathernd_flat(ctx, params, indices, output, scope_name, shapes, dtypes)
+    else:
+        # the length of the index tuples is needed to flatten them
+        _make_gathernd_loop(ctx, params, indices, output, scope_name, t_params, shapes, dtypes)
+
+
+def _make_gathernd_flat(ctx, params, indices, output, scope_name, shapes, dtypes):
+    """make GatherNd as a single Gather on params flattened over the indexed dims."""
+    # flat_indices = sum(indices * strides, axis=-1) with the row-major strides of params.shape[:k]
+    # output = Gather(Reshape(params, [-1] + params.shape[k:]), flat_indices)
+    scope_name = utils.make_name(scope_name)
+    indices_shape = ctx.get_shape(indices)
+    k = indices_shape[-1]
+    params_shape = ctx.get_shape(params)
+    if ctx.get_dtype(indices) != TensorProto.INT64:
+        indices = ctx.make_node("Cast", [indices], attr={"to": TensorProto.INT64}, op_name_scope=scope_name).output[0]
+
+    params_shape_node = None
+    if params_shape is not None and len(params_shape) >= k and all(d >= 0 for d in params_shape[1:k]):
+        strides = np.array([np.prod(params_shape[i + 1:k]) for i in range(k)], dtype=np.int64)
+        strides = ctx.make_const(utils.make_name("strides"), strides).output[0]
+    else:
+        params_shape_node = ctx.make_node("Shape", [params], op_name_scope=scope_name)
+        stride = ctx.make_const(utils.make_name("one"), np.array([1], dtype=np.int64)).output[0]
+        strides = [stride]
+        for i in range(k - 1, 0, -1):
+            inputs_map = {"data": params_shape_node.output[0], "axes": [0], "starts": [i], "ends": [i + 1]}
+            dim = GraphBuilder(ctx).make_slice(inputs_map, dtypes=[TensorProto.INT64])
+            stride = ctx.make_node("Mul", [dim, stride], op_name_scope=scope_name).output[0]
+            strides.insert(0, stride)
+        if k > 1:
+            strides = ctx.make_node("Concat", strides, attr={"axis": 0}, op_name_scope=scope_name).output[0]
+    offsets = ctx.make_node("Mul", [indices, strides], op_name_scope=scope_name)
+    flat_indices = ctx.make_node("ReduceSum", [offsets.output[0]],
+                                 attr={"axes": [len(indices_shape) - 1], "keepdims": 0}, op_name_scope=scope_name)
+
+    if params_shape is not None and len(params_shape) >= k and all(d >= 0 for d in params_shape[k:]):
+        flat_shape = ctx.make_const(utils.make_name("flat_shape"),
+                                    np.array([-1] + params_shape[k:], dtype=np.int64)).output[0]
+    else:
+        if params_shape_node is None:
+            params_shape_node = ctx.make_node("Shape", [params], op_name_scope=scope_name)
+        inputs_map = {"data": params_shape_node.output[0], "axes": [0], "starts": [k], "ends": [sys.maxsize]}
+        inner_shape = GraphBuilder(ctx).make_slice(inputs_map, dtypes=[TensorProto.INT64])
+        minus_one = ctx.make_const(utils.make_name("minus_one"), np.array([-1], dtype=np.int64))
+        flat_shape = ctx.make_node("Concat", [minus_one.output[0], inner_shape], attr={"axis": 0},
+                                   op_name_scope=scope_name).output[0]
+    flat_params = ctx.make_node("Reshape", [params, flat_shape], op_name_scope=scope_name)
+    ctx.make_node("Gather", [flat_params.output[0], flat_indices.output[0]], attr={"axis": 0},
+                  outputs=[output], op_name_scope=scope_name, shapes=shapes, dtypes=dtypes)
+
+
+def _make_gathernd_loop(ctx, params, indices, output, scope_name, t_params, shapes, dtypes):
+    """make GatherNd as a Loop over the index tuples, each one gathered by an inner Loop."""
     scope_name = utils.make_name(scope_name)
     # reshape indices into [sum(indices[:-1]), indices[-1]]
     indices_shape = ctx.make_node("Shape", [indices], dtypes=[TensorProto.INT64])
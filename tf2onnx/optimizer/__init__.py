@@ -9,21 +9,42 @@ from __future__ import unicode_literals
 from collections import OrderedDict
 import copy
 
+from .attention_optimizer import AttentionOptimizer
+from .cast_optimizer import CastOptimizer
 from .const_fold_optimizer import ConstFoldOptimizer
+from .control_flow_optimizer import ControlFlowOptimizer
+from .conv_optimizer import ConvOptimizer
 from .identity_optimizer import IdentityOptimizer
 from .merge_duplicated_nodes_optimizer import MergeDuplicatedNodesOptimizer
+from .reshape_optimizer import ReshapeOptimizer
+from .shape_optimizer import ShapeOptimizer
 from .transpose_optimizer import TransposeOptimizer
+from .unused_output_optimizer import UnusedOutputOptimizer
 from .loop_optimizer import LoopOptimizer
-from .. import logging
+from .. import logging, profiler, utils
 
 # optimizer sequence need to be considered carefully
 _optimizers = OrderedDict([
     ("optimize_transpose", TransposeOptimizer),
+    # optimize_shape replaces the known dims read by Shape with consts for fold_constants
+    ("optimize_shape", ShapeOptimizer),
     ("fold_constants", ConstFoldOptimizer),
+    # optimize_control_flow needs the conditions and trip counts folded to consts
+    ("optimize_control_flow", ControlFlowOptimizer),
+    # optimize_cast leaves the casts of constants to fold_constants
+    ("optimize_cast", CastOptimizer),
+    # optimize_conv needs the weights which fold_constants transposed to NCHW
+    ("optimize_conv", ConvOptimizer),
+    # optimize_attention matches the transposes and reshapes of the heads left by optimize_transpose
+    ("optimize_attention", AttentionOptimizer),
+    # optimize_reshape runs after the fusions above which match single Reshapes
+    ("optimize_reshape", ReshapeOptimizer),
     ("loop_optimizer", LoopOptimizer),
     # merge_duplication should be used after optimize_transpose
     # for optimize_transpose may have some trans nodes that can be merge
     ("merge_duplication", MergeDuplicatedNodesOptimizer),
+    # remove_unused_outputs runs after merge_duplication moved the consumers of merged nodes
+    ("remove_unused_outputs", UnusedOutputOptimizer),
     ("remove_identity", IdentityOptimizer),
 ])
 
@@ -45,9 +66,12 @@ def optimize_graph(graph):
         for name, factory in opts.items():
             try:
                 logger.verbose("Apply %s", name)
-                current = copy.deepcopy(graph)
-                opt = factory()
-                graph = opt.optimize(current) or graph
+                with profiler.phase("optimizer/" + name, graph) as span, profiler.handler("optimizer/" + name), \
+                        utils.node_origin(None, "optimizer/" + name):
+                    current = copy.deepcopy(graph)
+                    opt = factory()
+                    graph = opt.optimize(current) or graph
+                    span.graph = graph
                 continue_flag = continue_flag or opt.graph_been_opt
 
             except Exception:  # pylint: disable=broad-except
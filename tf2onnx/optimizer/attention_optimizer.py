@@ -0,0 +1,412 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Attention Optimizer.
+   Fuse the multi-head self attention of bert like models into Attention, the residual Add followed by a
+   layer norm into SkipLayerNormalization and the sum of the word, position and segment embeddings
+   followed by a layer norm into EmbedLayerNormalization of onnxruntime. A layer norm is LayerNormalization
+   or the ReduceMean/Sub/Pow/ReduceMean/Add/Sqrt/Div/Mul/Add form the layer norm rewriter emits before opset 17.
+   Only applies if the ms domain is requested.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+from onnx import onnx_pb
+
+from .. import constants, utils
+from ..rewriter.layer_norm_rewriter import match_layer_norm
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+# dtypes supported by the Attention, SkipLayerNormalization and EmbedLayerNormalization kernels of onnxruntime
+_FUSED_DTYPES = [onnx_pb.TensorProto.FLOAT, onnx_pb.TensorProto.FLOAT16]
+
+# the value Attention adds to the scores of masked positions
+_MASK_FILTER_VALUE = -10000.0
+
+
+class AttentionOptimizer(GraphOptimizerBase):
+    """Attention Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(AttentionOptimizer, self).__init__()
+        self._mask_index = {}
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        if not any(opset.domain == constants.MICROSOFT_DOMAIN for opset in g.extra_opset or []):
+            return g
+        # the mask is shared by all layers, it is converted to the mask index of Attention only once
+        self._mask_index = {}
+        for node in g.get_nodes():
+            if node.graph is None:
+                continue
+            if node.type == "Softmax":
+                changed = self._fuse_attention(g, node)
+            elif node.type in ["LayerNormalization", "Add"] and not node.domain:
+                layer_norm = self._get_layer_norm(g, node)
+                if layer_norm is None:
+                    continue
+                changed = self._fuse_embed_layer_norm(g, node, layer_norm) or \
+                    self._fuse_skip_layer_norm(g, node, layer_norm)
+            else:
+                continue
+            if changed:
+                self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _single_consumer(g, node):
+        if node.output[0] in g.outputs:
+            return None
+        consumers = g.find_output_consumers(node.output[0])
+        return consumers[0] if len(consumers) == 1 else None
+
+    @staticmethod
+    def _get_scalar(node):
+        if not node.is_const():
+            return None
+        val = node.get_tensor_value(as_list=False)
+        return float(val.flatten()[0]) if val.size == 1 else None
+
+    @staticmethod
+    def _is_read_only_by(g, name, nodes):
+        return name not in g.outputs and all(c in nodes for c in g.find_output_consumers(name))
+
+    @classmethod
+    def _get_layer_norm(cls, g, node):
+        """Check node is LayerNormalization or ends (x - mean) / sqrt(variance + epsilon) * gamma + beta over the
+           last axis, return (x, gamma, beta, epsilon, nodes) or None."""
+        if node.type == "LayerNormalization":
+            if len(node.output) != 1 or len(node.input) != 3:
+                return None
+            shape = g.get_shape(node.input[0])
+            axis = node.get_attr_value("axis", -1)
+            if axis != -1 and (shape is None or axis != len(shape) - 1):
+                return None
+            return node.input[0], node.input[1], node.input[2], node.get_attr_value("epsilon", 1e-5), [node]
+
+        match = match_layer_norm(g, node)
+        if match is None:
+            return None
+        x, axes, epsilon, gamma, beta, nodes = match
+        shape = g.get_shape(x)
+        if axes not in ([[-1]] if shape is None else [[-1], [len(shape) - 1]]):
+            return None
+        # all nodes in between are replaced, nothing else may use them
+        if any(not cls._is_read_only_by(g, n.output[0], nodes) for n in nodes[:-1]):
+            return None
+        return x, gamma, beta, epsilon, nodes
+
+    @staticmethod
+    def _has_perm(node, perm):
+        return node.type == "Transpose" and node.get_attr_value("perm") == perm
+
+    def _get_projection(self, g, node, perms):
+        """Check node is dense(x) reshaped to [batch, seq, heads, head_size] and transposed by perms.
+           Return (x, weights, bias, shape of the reshape, nodes) or None."""
+        nodes = []
+        for perm in perms:
+            if not self._has_perm(node, perm):
+                return None
+            nodes.append(node)
+            node = node.inputs[0]
+        if node.type != "Reshape" or not node.inputs[1].is_const():
+            return None
+        nodes.append(node)
+        shape = node.inputs[1].get_tensor_value()
+        if len(shape) != 4 or shape[2] <= 0 or shape[3] <= 0:
+            return None
+        node = node.inputs[0]
+        bias = None
+        if node.type == "Add":
+            nodes.append(node)
+            const_inputs = [inp for inp in node.inputs if inp.is_const()]
+            if len(const_inputs) != 1:
+                return None
+            bias = const_inputs[0].get_tensor_value(as_list=False)
+            node = [inp for inp in node.inputs if not inp.is_const()][0]
+        if node.type != "MatMul" or not node.inputs[1].is_const() or node.inputs[0].is_const():
+            return None
+        nodes.append(node)
+        weights = node.inputs[1].get_tensor_value(as_list=False)
+        hidden_size = shape[2] * shape[3]
+        if weights.ndim != 2 or weights.shape[1] != hidden_size:
+            return None
+        if bias is None:
+            bias = np.zeros([hidden_size], dtype=weights.dtype)
+        elif bias.shape != (hidden_size,) or bias.dtype != weights.dtype:
+            return None
+        return node.input[0], weights, bias, shape, nodes
+
+    def _get_mask(self, g, node):
+        """Check node is (1 - mask) * -10000 broadcast over the heads, return mask or None."""
+        if node.type != "Mul":
+            return None
+        value_index = 0 if node.inputs[0].is_const() else 1
+        value = self._get_scalar(node.inputs[value_index])
+        if value is None or not np.isclose(value, _MASK_FILTER_VALUE):
+            return None
+        sub = node.inputs[1 - value_index]
+        if sub.type != "Sub" or self._get_scalar(sub.inputs[0]) != 1.0:
+            return None
+        mask = sub.input[1]
+        shape = g.get_shape(mask)
+        # [batch, 1, 1, seq] or [batch, 1, seq, seq], Attention takes them as 2d and 3d mask
+        if shape is None or len(shape) != 4 or shape[1] != 1 or shape[3] <= 0 or shape[2] not in [1, shape[3]]:
+            return None
+        return mask
+
+    def _get_mask_index(self, g, mask):
+        if mask not in self._mask_index:
+            shape = g.get_shape(mask)
+            new_shape = [-1, shape[3]] if shape[2] == 1 else [-1, shape[3], shape[3]]
+            new_shape_const = g.make_const(utils.make_name("mask_shape"), np.array(new_shape, dtype=np.int64))
+            reshape = g.make_node("Reshape", [mask, new_shape_const.output[0]],
+                                  shapes=[[shape[0]] + new_shape[1:]], dtypes=[g.get_dtype(mask)])
+            cast = g.make_node("Cast", [reshape.output[0]], attr={"to": onnx_pb.TensorProto.INT32},
+                               shapes=[[shape[0]] + new_shape[1:]], dtypes=[onnx_pb.TensorProto.INT32])
+            self._mask_index[mask] = cast.output[0]
+        return self._mask_index[mask]
+
+    def _fuse_attention(self, g, softmax):
+        """Fuse softmax(q * k^T / sqrt(head_size) + mask) * v and the projections around it into Attention,
+           return True if graph changed."""
+        if softmax.get_attr_value("axis", 1) not in [3, -1]:
+            return False
+        if g.get_dtype(softmax.output[0]) not in _FUSED_DTYPES:
+            return False
+        inner_nodes = [softmax]
+
+        scores = softmax.inputs[0]
+        mask = None
+        if scores.type == "Add":
+            for i in range(2):
+                # the mask is usually shared by all layers, so it is not replaced
+                mask = self._get_mask(g, scores.inputs[i])
+                if mask is not None:
+                    inner_nodes.append(scores)
+                    scores = scores.inputs[1 - i]
+                    break
+            else:
+                return False
+
+        # the scaling, Div by sqrt(head_size) or Mul with its inverse
+        if scores.type == "Mul":
+            scale_index = 0 if scores.inputs[0].is_const() else 1
+            scale = self._get_scalar(scores.inputs[scale_index])
+        elif scores.type == "Div":
+            scale_index = 1
+            scale = self._get_scalar(scores.inputs[1])
+            scale = 1 / scale if scale else None
+        else:
+            return False
+        if scale is None:
+            return False
+        inner_nodes.append(scores)
+        qk = scores.inputs[1 - scale_index]
+        if qk.type != "MatMul":
+            return False
+        inner_nodes.append(qk)
+
+        probs_v = self._single_consumer(g, softmax)
+        if probs_v is None or probs_v.type != "MatMul" or probs_v.input[0] != softmax.output[0]:
+            return False
+        inner_nodes.append(probs_v)
+        context = self._single_consumer(g, probs_v)
+        if context is None or not self._has_perm(context, [0, 2, 1, 3]):
+            return False
+        output_node = self._single_consumer(g, context)
+        if output_node is None or output_node.type != "Reshape" or not output_node.inputs[1].is_const():
+            return False
+        inner_nodes.append(context)
+
+        # k might be transposed twice or the transposes are merged already
+        projections = [self._get_projection(g, qk.inputs[0], [[0, 2, 1, 3]]),
+                       self._get_projection(g, qk.inputs[1], [[0, 1, 3, 2], [0, 2, 1, 3]]) or
+                       self._get_projection(g, qk.inputs[1], [[0, 2, 3, 1]]),
+                       self._get_projection(g, probs_v.inputs[1], [[0, 2, 1, 3]])]
+        if any(p is None for p in projections):
+            return False
+        inputs, weights, biases, shapes, nodes = zip(*projections)
+        for n in nodes:
+            inner_nodes += n
+        x = inputs[0]
+        x_shape = g.get_shape(x)
+        if len(set(inputs)) != 1 or len(set(tuple(s[1:]) for s in shapes)) != 1 or x_shape is None:
+            return False
+        _, seq_len, num_heads, head_size = shapes[0]
+        hidden_size = num_heads * head_size
+        if not np.isclose(scale, 1 / np.sqrt(head_size)):
+            return False
+
+        # the input is [batch, seq, hidden] or [batch * seq, hidden] as in bert
+        output_shape = output_node.inputs[1].get_tensor_value()
+        if len(x_shape) not in [2, 3] or len(output_shape) not in [2, 3] or output_shape[-1] != hidden_size or \
+                x_shape[-1] != weights[0].shape[0] or g.get_dtype(x) not in _FUSED_DTYPES:
+            return False
+        if seq_len <= 0:
+            seq_len = x_shape[1] if len(x_shape) == 3 else -1
+            if seq_len <= 0:
+                return False
+
+        # all nodes in between are replaced, nothing else may use them
+        if any(self._single_consumer(g, n) is None for n in inner_nodes):
+            return False
+
+        self.logger.debug("fuse attention ending with %s", output_node.name)
+        scope = output_node.name
+        output = output_node.output[0]
+        dtype = g.get_dtype(output)
+        out_shape = g.get_shape(output)
+        batch_size = x_shape[0] if len(x_shape) == 3 else -1
+        if len(x_shape) == 2:
+            shape_const = g.make_const(utils.make_name(scope + "_input_shape"),
+                                       np.array([-1, seq_len, x_shape[1]], dtype=np.int64))
+            x = g.make_node("Reshape", [x, shape_const.output[0]], op_name_scope=scope,
+                            shapes=[[batch_size, seq_len, x_shape[1]]], dtypes=[dtype]).output[0]
+        weights_const = g.make_const(utils.make_name(scope + "_qkv_weights"), np.concatenate(weights, axis=1))
+        bias_const = g.make_const(utils.make_name(scope + "_qkv_bias"), np.concatenate(biases, axis=0))
+        attention_inputs = [x, weights_const.output[0], bias_const.output[0]]
+        if mask is not None:
+            attention_inputs.append(self._get_mask_index(g, mask))
+
+        g.remove_node(output_node.name)
+        attention_shape = [batch_size, seq_len, hidden_size]
+        if len(output_shape) == 3:
+            g.make_node("Attention", attention_inputs, attr={"num_heads": num_heads}, outputs=[output],
+                        op_name_scope=scope, domain=constants.MICROSOFT_DOMAIN, shapes=[out_shape], dtypes=[dtype])
+        else:
+            attention = g.make_node("Attention", attention_inputs, attr={"num_heads": num_heads}, op_name_scope=scope,
+                                    domain=constants.MICROSOFT_DOMAIN, shapes=[attention_shape], dtypes=[dtype])
+            shape_const = g.make_const(utils.make_name(scope + "_output_shape"),
+                                       np.array([-1, hidden_size], dtype=np.int64))
+            g.make_node("Reshape", [attention.output[0], shape_const.output[0]], outputs=[output],
+                        op_name_scope=scope, shapes=[out_shape], dtypes=[dtype])
+        return True
+
+    def _fuse_skip_layer_norm(self, g, node, layer_norm):
+        """Fuse the layer norm of x + skip + bias ending with node into SkipLayerNormalization,
+           return True if graph changed."""
+        x, gamma, beta, epsilon, nodes = layer_norm
+        add = g.get_node_by_output(x)
+        shape = g.get_shape(x)
+        dtype = g.get_dtype(x)
+        if add is None or add.type != "Add" or not self._is_read_only_by(g, x, nodes) or dtype not in _FUSED_DTYPES:
+            return False
+        # the kernel normalizes the last dim of 2d or 3d inputs without broadcasting
+        if shape is None or len(shape) not in [2, 3] or shape[-1] <= 0:
+            return False
+        if any(g.get_shape(inp) != shape for inp in add.input):
+            return False
+
+        inputs = list(add.input)
+        bias = None
+        for i, inp in enumerate(add.inputs):
+            # the bias of the dense layer before the residual connection
+            if inp.type == "Add" and self._single_consumer(g, inp) is not None:
+                const_index = 0 if inp.inputs[0].is_const() else 1
+                if inp.inputs[const_index].is_const() and g.get_shape(inp.input[const_index]) == [shape[-1]] and \
+                        g.get_shape(inp.input[1 - const_index]) == shape:
+                    inputs[i] = inp.input[1 - const_index]
+                    bias = inp.input[const_index]
+                    break
+        inputs += [gamma, beta]
+        if bias is not None:
+            inputs.append(bias)
+        if any(g.get_shape(inp) != [shape[-1]] for inp in inputs[2:]):
+            return False
+
+        self.logger.debug("fuse skip layer norm %s", node.name)
+        output = node.output[0]
+        g.remove_node(node.name)
+        g.make_node("SkipLayerNormalization", inputs, attr={"epsilon": epsilon}, outputs=[output],
+                    name=node.name, domain=constants.MICROSOFT_DOMAIN, shapes=[shape], dtypes=[dtype])
+        return True
+
+    def _get_embedding(self, g, node):
+        """Check node is Gather(table, ids) with const [vocab, hidden] table and [batch, seq] ids,
+           return (ids, table) or None."""
+        if node.type != "Gather" or node.get_attr_value("axis", 0) != 0 or not node.inputs[0].is_const() or \
+                node.inputs[1].is_const():
+            return None
+        ids_shape = g.get_shape(node.input[1])
+        if len(g.get_shape(node.input[0]) or []) != 2 or ids_shape is None or len(ids_shape) != 2 or \
+                g.get_dtype(node.input[1]) not in [onnx_pb.TensorProto.INT32, onnx_pb.TensorProto.INT64]:
+            return None
+        return node.input[1], node.input[0]
+
+    def _fuse_embed_layer_norm(self, g, node, layer_norm):
+        """Fuse the layer norm of word_embedding + position_embedding + segment_embedding of bert ending with node
+           into EmbedLayerNormalization, return True if graph changed."""
+        x, gamma, beta, epsilon, nodes = layer_norm
+        shape = g.get_shape(x)
+        dtype = g.get_dtype(x)
+        if shape is None or len(shape) != 3 or shape[-1] <= 0 or dtype not in _FUSED_DTYPES:
+            return False
+
+        # the three embeddings are summed up by two Adds in any order
+        add = g.get_node_by_output(x)
+        if add is None or add.type != "Add" or not self._is_read_only_by(g, x, nodes):
+            return False
+        inner_nodes = []
+        terms = []
+        for inp in add.inputs:
+            if inp.type == "Add" and self._single_consumer(g, inp) is not None:
+                inner_nodes.append(inp)
+                terms += inp.inputs
+            else:
+                terms.append(inp)
+        if len(terms) != 3:
+            return False
+
+        # the position embedding sliced to the sequence length was folded to a const by fold_constants
+        hidden_size = shape[-1]
+        position = [t for t in terms if t.is_const()]
+        embeddings = [self._get_embedding(g, t) for t in terms if not t.is_const()]
+        if len(position) != 1 or len(embeddings) != 2 or any(e is None for e in embeddings):
+            return False
+        position_table = position[0].get_tensor_value(as_list=False)
+        if position_table.ndim == 3 and position_table.shape[0] == 1:
+            position_table = position_table[0]
+        if position_table.ndim != 2 or position_table.shape[1] != hidden_size:
+            return False
+        seq_len = position_table.shape[0]
+
+        # the word embedding has the larger vocabulary, the segment embedding is usually 2 rows
+        (word_ids, word_table), (segment_ids, segment_table) = \
+            sorted(embeddings, key=lambda e: g.get_shape(e[1])[0], reverse=True)
+        for ids, table in embeddings:
+            if g.get_shape(ids)[1] not in [-1, seq_len] or g.get_shape(table)[1] != hidden_size or \
+                    g.get_dtype(table) != dtype:
+                return False
+        if g.get_shape(word_ids) != g.get_shape(segment_ids) or \
+                any(g.get_shape(inp) != [hidden_size] for inp in [gamma, beta]):
+            return False
+        inner_nodes += [n for n in terms if not n.is_const()]
+        if any(self._single_consumer(g, n) is None for n in inner_nodes):
+            return False
+
+        self.logger.debug("fuse embed layer norm %s", node.name)
+        scope = node.name
+        ids_inputs = []
+        for ids in [word_ids, segment_ids]:
+            if g.get_dtype(ids) != onnx_pb.TensorProto.INT32:
+                ids = g.make_node("Cast", [ids], attr={"to": onnx_pb.TensorProto.INT32}, op_name_scope=scope,
+                                  shapes=[g.get_shape(ids)], dtypes=[onnx_pb.TensorProto.INT32]).output[0]
+            ids_inputs.append(ids)
+        position_const = g.make_const(utils.make_name(scope + "_position_embedding"), position_table)
+        output = node.output[0]
+        g.remove_node(node.name)
+        # the second output is the mask index, nothing uses it since no mask is given
+        g.make_node("EmbedLayerNormalization",
+                    [ids_inputs[0], ids_inputs[1], word_table, position_const.output[0], segment_table, gamma, beta],
+                    attr={"epsilon": epsilon}, outputs=[output, utils.make_name(scope + "_mask_index")],
+                    name=node.name, domain=constants.MICROSOFT_DOMAIN,
+                    shapes=[shape, [shape[0]]], dtypes=[dtype, onnx_pb.TensorProto.INT32])
+        return True
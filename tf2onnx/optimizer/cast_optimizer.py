@@ -0,0 +1,146 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Cast Optimizer.
+   Remove Casts to the dtype their input already has, fold pairs of Casts if the first one is lossless
+   and move Casts up through shape only ops so they meet the Cast they can be folded with.
+   Casts of constants are folded by the const fold optimizer.
+"""
+
+from __future__ import unicode_literals
+
+from onnx import TensorProto
+
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+_SHAPE_OPS = ["Flatten", "Reshape", "Squeeze", "Transpose", "Unsqueeze"]
+
+# ops whose output has the dtype of their first input
+_SAME_DTYPE_OPS = _SHAPE_OPS + ["Abs", "Concat", "Expand", "Gather", "Identity", "Neg", "Pad", "Relu",
+                                "Slice", "Split", "Tile"]
+
+# dtypes that can represent every value of the dtype, casting to them and back gives the original value
+_LOSSLESS_CASTS = {
+    TensorProto.BOOL: [TensorProto.INT8, TensorProto.UINT8, TensorProto.INT16, TensorProto.UINT16,
+                       TensorProto.INT32, TensorProto.UINT32, TensorProto.INT64, TensorProto.UINT64,
+                       TensorProto.FLOAT16, TensorProto.FLOAT, TensorProto.DOUBLE],
+    TensorProto.INT8: [TensorProto.INT16, TensorProto.INT32, TensorProto.INT64, TensorProto.FLOAT16,
+                       TensorProto.FLOAT, TensorProto.DOUBLE],
+    TensorProto.UINT8: [TensorProto.INT16, TensorProto.UINT16, TensorProto.INT32, TensorProto.UINT32,
+                        TensorProto.INT64, TensorProto.UINT64, TensorProto.FLOAT16, TensorProto.FLOAT,
+                        TensorProto.DOUBLE],
+    TensorProto.INT16: [TensorProto.INT32, TensorProto.INT64, TensorProto.FLOAT, TensorProto.DOUBLE],
+    TensorProto.UINT16: [TensorProto.INT32, TensorProto.UINT32, TensorProto.INT64, TensorProto.UINT64,
+                         TensorProto.FLOAT, TensorProto.DOUBLE],
+    # float has a 24 bit mantissa, int32 and int64 values above 2**24 don't survive a round trip through it
+    TensorProto.INT32: [TensorProto.INT64, TensorProto.DOUBLE],
+    TensorProto.UINT32: [TensorProto.INT64, TensorProto.UINT64, TensorProto.DOUBLE],
+    TensorProto.FLOAT16: [TensorProto.FLOAT, TensorProto.DOUBLE],
+    TensorProto.FLOAT: [TensorProto.DOUBLE],
+}
+
+
+def is_lossless_cast(from_dtype, to_dtype):
+    """True if every value of from_dtype is kept exactly by a cast to to_dtype."""
+    return from_dtype == to_dtype or to_dtype in _LOSSLESS_CASTS.get(from_dtype, [])
+
+
+class CastOptimizer(GraphOptimizerBase):
+    """Cast Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(CastOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        has_update = True
+        while has_update:
+            has_update = False
+            nodes = [n for n in g.get_nodes() if n.type == "Cast"]
+            for node in nodes:
+                if node.graph is None:
+                    # removed by an earlier fold in this round
+                    continue
+                if self._remove_identity_cast(g, node) or self._fold_cast_pair(g, node) or \
+                        self._move_cast_up(g, node):
+                    has_update = True
+                    self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _single_consumer(g, node):
+        if node.output[0] in g.outputs:
+            return None
+        consumers = g.find_output_consumers(node.output[0])
+        return consumers[0] if len(consumers) == 1 else None
+
+    @staticmethod
+    def _dtype(g, name):
+        """Dtype of a tensor, None if unsure.
+           Handlers don't always update the dtype they leave on a tensor (e.g. the int32 of tf Shape),
+           only the dtypes that follow from the graph itself are used.
+        """
+        while True:
+            node = g.get_node_by_output(name)
+            if node is None or node.is_graph_input() or node.is_const():
+                return g.get_dtype(name)
+            if node.type == "Cast":
+                return node.get_attr_value("to")
+            if node.type in ["Shape", "Size"]:
+                return TensorProto.INT64
+            if node.type not in _SAME_DTYPE_OPS or node.graph != g:
+                return None
+            name = node.input[0]
+
+    def _remove_identity_cast(self, g, node):
+        if node.output[0] in g.outputs or self._dtype(g, node.input[0]) != node.get_attr_value("to"):
+            return False
+        self.logger.debug("remove cast %s to the dtype of its input", node.name)
+        g.replace_all_inputs(g.get_nodes(), node.output[0], node.input[0])
+        g.remove_node(node.name)
+        return True
+
+    def _fold_cast_pair(self, g, node):
+        """Cast(Cast(x, a), b) is Cast(x, b) if the cast from x to a is lossless."""
+        first = node.inputs[0]
+        if first is None or first.type != "Cast" or first.graph != g:
+            return False
+        from_dtype = self._dtype(g, first.input[0])
+        if from_dtype is None or not is_lossless_cast(from_dtype, first.get_attr_value("to")):
+            return False
+        self.logger.debug("fold cast %s into cast %s", first.name, node.name)
+        g.replace_input(node, node.input[0], first.input[0])
+        if first.output[0] not in g.outputs and not g.find_output_consumers(first.output[0]):
+            g.remove_node(first.name)
+        return True
+
+    def _is_movable(self, g, node, consumer):
+        return node is not None and node.type in _SHAPE_OPS and node.graph == g and \
+            self._single_consumer(g, node) == consumer
+
+    def _move_cast_up(self, g, node):
+        """Swap a Cast with the shape only op before it if that brings it closer to a Cast it folds with."""
+        shape_op = node.inputs[0]
+        if node.output[0] in g.outputs or not self._is_movable(g, shape_op, node):
+            return False
+        before = shape_op
+        while self._is_movable(g, before.inputs[0], before):
+            before = before.inputs[0]
+        before = before.inputs[0]
+        if before is None or before.type != "Cast" or \
+                not is_lossless_cast(self._dtype(g, before.input[0]), before.get_attr_value("to")):
+            return False
+        self.logger.debug("move cast %s before %s", node.name, shape_op.name)
+        consumers = g.find_output_consumers(node.output[0])
+        input_shape = g.get_shape(shape_op.input[0])
+        g.replace_input(node, node.input[0], shape_op.input[0])
+        g.replace_input(shape_op, shape_op.input[0], node.output[0])
+        g.replace_all_inputs(consumers, node.output[0], shape_op.output[0])
+        g.set_shape(node.output[0], input_shape)
+        g.set_dtype(shape_op.output[0], node.get_attr_value("to"))
+        return True
@@ -6,7 +6,9 @@
    for example, input of transpose node is const then we can do transpose statically instead of at runtime
 """
 
-from .. import utils
+import numpy as np
+
+from .. import profiler, utils
 from .optimizer_base import GraphOptimizerBase
 
 # pylint: disable=logging-not-lazy,unused-argument,missing-docstring
@@ -67,7 +69,8 @@ class ConstFoldOptimizer(GraphOptimizerBase):
         if self._all_inputs_are_const(node.inputs) and not self._is_graph_output(node, graph):
             process_func = _func_map.get(node.type, None)
             if process_func:
-                const_outputs = process_func(node, graph)
+                with profiler.handler("fold_constants/" + node.type):
+                    const_outputs = process_func(node, graph)
                 self._replace_node_with_const(node, graph, const_outputs)
                 return True
             self.logger.debug("need to add function to fold op %s whose op_type is %s", node.name, node.type)
@@ -133,3 +136,57 @@ class ConstFoldOptimizer(GraphOptimizerBase):
 
         const_val_after_unsqueeze = const_val.reshape(shape_out)
         return [const_val_after_unsqueeze]
+
+    @staticmethod
+    @_register_func("Concat")
+    def _fold_concat(node, graph):
+        const_vals = [inp.get_tensor_value(as_list=False) for inp in node.inputs]
+        return [np.concatenate(const_vals, axis=node.get_attr_value("axis"))]
+
+    @staticmethod
+    @_register_func("Gather")
+    def _fold_gather(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        indices = node.inputs[1].get_tensor_value(as_list=False)
+        return [np.take(const_val, indices, axis=node.get_attr_value("axis", 0))]
+
+    @staticmethod
+    @_register_func("Reshape")
+    def _fold_reshape(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        if graph.opset < 5:
+            shape = node.get_attr_value("shape")
+        else:
+            shape = node.inputs[1].get_tensor_value()
+        # 0 copies the dim of the input
+        shape = [const_val.shape[i] if s == 0 else s for i, s in enumerate(shape)]
+        return [const_val.reshape(shape)]
+
+    @staticmethod
+    @_register_func("Slice")
+    def _fold_slice(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        if graph.opset < 10:
+            starts = node.get_attr_value("starts")
+            ends = node.get_attr_value("ends")
+            axes = node.get_attr_value("axes", list(range(len(starts))))
+            steps = [1] * len(starts)
+        else:
+            starts, ends = [node.inputs[i].get_tensor_value() for i in [1, 2]]
+            axes = node.inputs[3].get_tensor_value() if len(node.input) > 3 and node.input[3] \
+                else list(range(len(starts)))
+            steps = node.inputs[4].get_tensor_value() if len(node.input) > 4 and node.input[4] \
+                else [1] * len(starts)
+        slices = [slice(None)] * const_val.ndim
+        for start, end, axis, step in zip(starts, ends, axes, steps):
+            slices[axis] = slice(start, end, step)
+        return [const_val[tuple(slices)]]
+
+    @staticmethod
+    @_register_func("Squeeze")
+    def _fold_squeeze(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        axes = node.get_attr_value("axes")
+        if axes is None:
+            return [np.squeeze(const_val)]
+        return [np.squeeze(const_val, axis=tuple(axes))]
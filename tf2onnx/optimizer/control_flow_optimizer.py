@@ -0,0 +1,161 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Control Flow Optimizer.
+   Inline the taken branch of an If with a const condition and unroll Loops with a small const trip count,
+   every If and every Loop iteration costs a dispatch of a subgraph in the runtime.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from .. import utils
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class ControlFlowOptimizer(GraphOptimizerBase):
+    """Control Flow Optimizer."""
+
+    # Loops are unrolled only if their trip count and the nodes they add stay within these
+    max_unroll_trip_count = 16
+    max_unroll_nodes = 256
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(ControlFlowOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        has_update = True
+        while has_update:
+            has_update = False
+            for node in [n for n in g.get_nodes() if n.type in ["If", "Loop"]]:
+                if node.type == "If":
+                    changed = self._inline_if(g, node)
+                else:
+                    changed = self._unroll_loop(g, node)
+                if changed:
+                    has_update = True
+                    self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _const_value(node):
+        if node is None or not node.is_const():
+            return None
+        return node.get_tensor_value(as_list=False)
+
+    def _inline_if(self, g, node):
+        cond = self._const_value(node.inputs[0])
+        if cond is None or cond.size != 1:
+            return False
+        branch = node.get_body_graphs()["then_branch" if cond.flatten()[0] else "else_branch"]
+        if not self._can_inline(branch):
+            return False
+        self.logger.debug("inline the %s taken by %s", "then_branch" if cond.flatten()[0] else "else_branch",
+                          node.name)
+        outputs = self._inline_graph(g, branch, {}, utils.make_name(node.name))
+        self._replace_outputs(g, node, outputs)
+        return True
+
+    def _unroll_loop(self, g, node):
+        trip_count = self._const_value(node.inputs[0]) if node.input[0] else None
+        if trip_count is None or trip_count.size != 1:
+            return False
+        trip_count = int(trip_count.flatten()[0])
+        if node.input[1]:
+            cond = self._const_value(node.inputs[1])
+            if cond is None or cond.size != 1 or not cond.flatten()[0]:
+                return False
+        body = node.get_body_graphs()["body"]
+        if not 0 < trip_count <= self.max_unroll_trip_count or \
+                trip_count * len(body.get_nodes()) > self.max_unroll_nodes or \
+                not self._can_inline(body) or not self._loop_runs_to_end(body):
+            return False
+
+        self.logger.debug("unroll %d iterations of %s", trip_count, node.name)
+        body_inputs = body.input_names
+        carried = list(node.input[2:])
+        scan_outputs = []
+        for i in range(trip_count):
+            name = utils.make_name("{}_iter{}".format(node.name, i))
+            input_map = {
+                body_inputs[0]: self._make_scalar(g, body, body_inputs[0], i, np.int64, name),
+                body_inputs[1]: self._make_scalar(g, body, body_inputs[1], True, bool, name),
+            }
+            input_map.update(zip(body_inputs[2:], carried))
+            outputs = self._inline_graph(g, body, input_map, name)
+            carried = outputs[1:len(carried) + 1]
+            scan_outputs.append(outputs[len(carried) + 1:])
+
+        # scan outputs are the values of all iterations stacked along a new first axis
+        stacked = []
+        for values in zip(*scan_outputs):
+            unsqueezed = [g.make_node("Unsqueeze", [v], attr={"axes": [0]}, op_name_scope=node.name).output[0]
+                          for v in values]
+            stacked.append(g.make_node("Concat", unsqueezed, attr={"axis": 0}, op_name_scope=node.name).output[0])
+        self._replace_outputs(g, node, carried + stacked)
+        return True
+
+    @staticmethod
+    def _can_inline(body):
+        # nested subgraphs would need the names they read from the body renamed as well
+        return not any(n.get_body_graphs() for n in body.get_nodes())
+
+    @staticmethod
+    def _loop_runs_to_end(body):
+        """True if the condition the body returns is its cond input or a const True."""
+        cond = body.get_node_by_output(body.outputs[0])
+        while cond is not None and cond.type == "Identity":
+            cond = body.get_node_by_output(cond.input[0])
+        if cond is None:
+            return False
+        if cond.is_const():
+            value = cond.get_tensor_value(as_list=False)
+            return value.size == 1 and bool(value.flatten()[0])
+        return cond.is_graph_input() and cond.output[0] == body.input_names[1]
+
+    @staticmethod
+    def _make_scalar(g, body, input_name, value, dtype, name):
+        # body inputs are scalars by the spec, some producers declare them with shape [1]
+        shape = body.get_shape(input_name) or []
+        const = g.make_const(utils.make_name(name + "_" + input_name), np.array(value, dtype=dtype).reshape(shape))
+        return const.output[0]
+
+    @staticmethod
+    def _inline_graph(g, body, input_map, name):
+        """Copy the nodes of body into g, return the names its outputs got.
+           input_map maps the inputs of body to tensors of g, names body reads from outer scopes are kept.
+        """
+        name_map = dict(input_map)
+        body.topological_sort(body.get_nodes())
+        for node in body.get_nodes():
+            if node.is_graph_input():
+                continue
+            outputs = [utils.port_name(utils.make_name(name + "_" + node.name), i) for i in range(len(node.output))]
+            name_map.update(zip(node.output, outputs))
+            g.make_node(node.type, [name_map.get(i, i) for i in node.input], attr=node.attr, outputs=outputs,
+                        op_name_scope=name, name=node.name, domain=node.domain, infer_shape_dtype=False)
+            for old, new in zip(node.output, outputs):
+                if body.get_shape(old) is not None:
+                    g.set_shape(new, body.get_shape(old))
+                if body.get_dtype(old) is not None:
+                    g.set_dtype(new, body.get_dtype(old))
+        return [name_map.get(o, o) for o in body.outputs]
+
+    @staticmethod
+    def _replace_outputs(g, node, new_outputs):
+        old_outputs = node.output
+        dtypes = node.output_dtypes
+        shapes = node.output_shapes
+        g.remove_node(node.name)
+        for old, new, dtype, shape in zip(old_outputs, new_outputs, dtypes, shapes):
+            if old in g.outputs:
+                g.make_node("Identity", [new], outputs=[old], dtypes=[dtype], shapes=[shape])
+            else:
+                g.replace_all_inputs(g.get_nodes(), old, new)
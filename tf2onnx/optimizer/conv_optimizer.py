@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Conv Optimizer.
+   Fold BatchNormalization and per channel Mul/Add/Sub following a Conv into the Conv's weights and bias,
+   and merge a constant Pad into the pads of the Conv or Pool consuming it.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from .. import utils
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class ConvOptimizer(GraphOptimizerBase):
+    """Conv Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(ConvOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        has_update = True
+        while has_update:
+            has_update = False
+            for node in g.get_nodes():
+                if node.graph is None:
+                    # removed by an earlier fold in this round
+                    continue
+                if node.type == "Conv":
+                    changed = self._fold_into_conv(g, node)
+                elif node.type == "Pad":
+                    changed = self._merge_pad(g, node)
+                else:
+                    continue
+                if changed:
+                    has_update = True
+                    self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _single_consumer(g, node):
+        if node.output[0] in g.outputs:
+            return None
+        consumers = g.find_output_consumers(node.output[0])
+        return consumers[0] if len(consumers) == 1 else None
+
+    def _fold_into_conv(self, g, conv):
+        """Fold the op following conv into its weights and bias, return True if graph changed."""
+        if not conv.inputs[1].is_const() or (len(conv.input) > 2 and not conv.inputs[2].is_const()):
+            return False
+        weights = conv.inputs[1].get_tensor_value(as_list=False)
+        # conv_convert_inputs may leave a Transpose back to NHWC between Conv and the op
+        channel_axis = 1
+        data_input = conv.output[0]
+        node = self._single_consumer(g, conv)
+        if node is not None and node.type == "Transpose":
+            channel_axis = list(node.get_attr("perm").ints).index(1)
+            data_input = node.output[0]
+            node = self._single_consumer(g, node)
+        if node is None or node.output[0] in g.outputs:
+            return False
+
+        if node.type == "BatchNormalization" and node.input[0] == data_input:
+            scale_shift = self._batchnorm_scale_shift(node, channel_axis)
+        elif node.type in ["Mul", "Add", "Sub"] and data_input in node.input:
+            scale_shift = self._elementwise_scale_shift(node, node.input.index(data_input), weights, channel_axis)
+        else:
+            return False
+        if scale_shift is None:
+            return False
+        scale, shift = scale_shift
+
+        bias = conv.inputs[2].get_tensor_value(as_list=False) if len(conv.input) > 2 else 0
+        new_weights = weights * scale.reshape([-1] + [1] * (weights.ndim - 1))
+        new_bias = np.broadcast_to(bias * scale + shift, [weights.shape[0]])
+        new_weights = g.make_const(utils.make_name(conv.name + "_weights"), new_weights.astype(weights.dtype))
+        new_bias = g.make_const(utils.make_name(conv.name + "_bias"), new_bias.astype(weights.dtype))
+        conv.input[1] = new_weights.output[0]
+        if len(conv.input) > 2:
+            conv.input[2] = new_bias.output[0]
+        else:
+            conv.input.append(new_bias.output[0])
+
+        self.logger.debug("fold %s %s into %s", node.type, node.name, conv.name)
+        g.replace_all_inputs(g.get_nodes(), node.output[0], data_input)
+        g.remove_node(node.name)
+        return True
+
+    @staticmethod
+    def _batchnorm_scale_shift(node, channel_axis):
+        # training mode BatchNormalization has more outputs, spatial=0 normalizes per element
+        if channel_axis != 1 or len(node.output) > 1 or node.get_attr_value("spatial", 1) != 1:
+            return None
+        if not all(inp.is_const() for inp in node.inputs[1:]):
+            return None
+        gamma, beta, mean, var = [inp.get_tensor_value(as_list=False).astype(np.float64) for inp in node.inputs[1:]]
+        epsilon = node.get_attr_value("epsilon", 1e-5)
+        scale = gamma / np.sqrt(var + epsilon)
+        return scale, beta - mean * scale
+
+    def _elementwise_scale_shift(self, node, data_index, weights, channel_axis):
+        const_index = 1 - data_index
+        if not node.inputs[const_index].is_const() or (node.type == "Sub" and const_index == 0):
+            return None
+        val = node.inputs[const_index].get_tensor_value(as_list=False)
+        if val.dtype != weights.dtype or val.ndim > weights.ndim:
+            return None
+        # the const must not broadcast the conv output to a larger shape and must hold one value per channel
+        val_shape = [1] * (weights.ndim - val.ndim) + list(val.shape)
+        if any(d != 1 for i, d in enumerate(val_shape) if i != channel_axis) or \
+                val_shape[channel_axis] not in [1, weights.shape[0]]:
+            self.logger.debug("%s is not per channel, can not fold %s into Conv", node.inputs[const_index].name,
+                              node.name)
+            return None
+        val = np.broadcast_to(val.reshape(-1), [weights.shape[0]]).astype(np.float64)
+        if node.type == "Mul":
+            return val, np.zeros_like(val)
+        if node.type == "Add":
+            return np.ones_like(val), val
+        return np.ones_like(val), -val
+
+    def _merge_pad(self, g, pad):
+        """Merge constant Pad into the pads of the Conv or Pool consuming it, return True if graph changed."""
+        consumer = self._single_consumer(g, pad)
+        if consumer is None or consumer.type not in ["Conv", "AveragePool", "MaxPool"] or \
+                consumer.input[0] != pad.output[0]:
+            return False
+        if pad.get_attr_value("mode", b"constant") != b"constant" or \
+                consumer.get_attr_value("auto_pad", b"NOTSET") != b"NOTSET":
+            return False
+        if g.opset < 11:
+            pads = pad.get_attr_value("pads")
+            value = pad.get_attr_value("value", 0.)
+        else:
+            # Pad-11 takes pads and constant_value as inputs, a missing constant_value pads with 0
+            if not all(inp.is_const() for inp in pad.inputs[1:] if inp is not None):
+                return False
+            pads = pad.inputs[1].get_tensor_value()
+            value = 0.
+            if len(pad.input) > 2 and pad.input[2]:
+                value = pad.inputs[2].get_tensor_value()
+        rank = len(pads) // 2
+        if any(p < 0 for p in pads) or any(pads[i] != 0 for i in [0, 1, rank, rank + 1]):
+            # only spatial padding can go into the pads attribute
+            return False
+
+        if consumer.type == "MaxPool":
+            # MaxPool ignores padded elements, a Pad only matches that with -inf. Its indices would differ.
+            if value != -np.inf or len(consumer.output) > 1:
+                return False
+        elif value != 0:
+            return False
+        old_pads = consumer.get_attr_value("pads", [0] * (2 * rank - 4))
+        if consumer.type == "AveragePool" and consumer.get_attr_value("count_include_pad", 0) == 0:
+            # the zeros of the Pad are counted in the average
+            if any(old_pads):
+                return False
+            consumer.set_attr("count_include_pad", 1)
+        spatial_pads = pads[2:rank] + pads[rank + 2:]
+        consumer.set_attr("pads", [int(p + q) for p, q in zip(old_pads, spatial_pads)])
+
+        self.logger.debug("merge %s into pads of %s", pad.name, consumer.name)
+        consumer.input[0] = pad.input[0]
+        g.remove_node(pad.name)
+        return True
@@ -5,7 +5,7 @@
    some op in loop's body graph can be moved out to the loop
 """
 
-from tf2onnx.utils import make_name, make_sure
+from tf2onnx.utils import is_onnx_domain, make_name, make_sure
 from .optimizer_base import GraphOptimizerBase
 
 
@@ -27,9 +27,11 @@ class LoopOptimizer(GraphOptimizerBase):
         has_update = True
         while has_update:
             has_update = False
-            nodes = [n for n in g.get_nodes() if n.type == "Loop"]
+            nodes = [n for n in g.get_nodes() if n.type in ["Loop", "Scan"]]
             for n in nodes:
-                has_update_tmp = self._try_move_transpose_out_of_body_graph(n)
+                has_update_tmp = self._try_hoist_invariant_nodes(n)
+                if n.type == "Loop":
+                    has_update_tmp = self._try_move_transpose_out_of_body_graph(n) or has_update_tmp
                 if has_update_tmp:
                     has_update = True
                     self.graph_been_opt = True
@@ -81,6 +83,46 @@ class LoopOptimizer(GraphOptimizerBase):
 
         return graph_is_changed
 
+    def _try_hoist_invariant_nodes(self, loop_node):
+        # nodes of the body graph that only read outer scope tensors and consts compute the same value in every
+        # iteration, they are moved to the parent graph and read by the body graph from there.
+        # inner loops are handled first by the optimizer, what they hoist can move further out in the next round.
+        # return True if moving some nodes successfully
+        body_graph = loop_node.get_body_graphs()["body"]
+        parent_graph = loop_node.graph
+        body_graph.topological_sort(body_graph.get_nodes())
+        invariant = set()
+        for node in body_graph.get_nodes():
+            if node.is_graph_input() or node.get_body_graphs() or not is_onnx_domain(node.domain) or \
+                    node.type.startswith("Random"):
+                continue
+            # body graph outputs must be produced in the body graph
+            if set(node.output) & set(body_graph.outputs) or \
+                    any(parent_graph.get_node_by_output(o) for o in node.output):
+                continue
+            inputs = [body_graph.get_node_by_output(i) for i in node.input if i]
+            if all(inp is None or inp.graph != body_graph or inp.name in invariant for inp in inputs):
+                invariant.add(node.name)
+
+        # consts are only moved along with the nodes reading them
+        moved = set()
+        for node in body_graph.get_nodes():
+            if node.name in invariant and not node.is_const():
+                moved.add(node.name)
+                moved |= set(inp.name for inp in node.inputs if inp is not None and inp.name in invariant)
+        if not moved:
+            return False
+
+        for node in [n for n in body_graph.get_nodes() if n.name in moved]:
+            self.logger.debug("move loop invariant node %s out of %s", node.name, loop_node.name)
+            shapes = node.output_shapes
+            dtypes = node.output_dtypes
+            body_graph.remove_node(node.name)
+            name = node.name if parent_graph.get_node_by_name(node.name) is None else make_name(node.name)
+            parent_graph.make_node(node.type, node.input, attr=node.attr, outputs=node.output, name=name,
+                                   shapes=shapes, dtypes=dtypes, domain=node.domain, infer_shape_dtype=False)
+        return True
+
     @classmethod
     def _scan_outputs(cls, loop):
         # loop has 2+N inputs; loop has N+K outputs;
@@ -0,0 +1,222 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Reshape Optimizer.
+   Collapse chains of Reshape, Squeeze, Unsqueeze and Flatten into a single Reshape and remove
+   the chains that don't change the shape of their input.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from .. import utils
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+_SHAPE_OPS = ["Reshape", "Squeeze", "Unsqueeze", "Flatten"]
+
+
+class _Src(object):
+    """A dim copied from the input of the chain, unknown at conversion time."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, _Src) and other.index == self.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.index)
+
+
+class ReshapeOptimizer(GraphOptimizerBase):
+    """Reshape Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(ReshapeOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        if g.opset < 5:
+            # Reshape takes the shape as attribute
+            return g
+        has_update = True
+        while has_update:
+            has_update = False
+            for node in g.get_nodes():
+                if node.graph is None or node.type not in _SHAPE_OPS:
+                    continue
+                if self._is_chain_inner(g, node):
+                    # handled from the end of the chain
+                    continue
+                if self._collapse_chain(g, node):
+                    has_update = True
+                    self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _is_chain_inner(g, node):
+        if node.output[0] in g.outputs:
+            return False
+        consumers = g.find_output_consumers(node.output[0])
+        return len(consumers) == 1 and consumers[0].type in _SHAPE_OPS and consumers[0].graph == g
+
+    def _find_chain(self, g, last):
+        chain = [last]
+        while True:
+            producer = chain[0].inputs[0]
+            if producer is None or producer.graph != g or producer.type not in _SHAPE_OPS or \
+                    not self._is_chain_inner(g, producer):
+                return chain
+            chain.insert(0, producer)
+
+    def _collapse_chain(self, g, last):
+        """Replace the chain of shape ops ending with last by one Reshape, return True if graph changed."""
+        chain = self._find_chain(g, last)
+        input_name = chain[0].input[0]
+        input_shape = g.get_shape(input_name)
+        if input_shape is None:
+            return False
+        input_dims = [d if d >= 0 else _Src(i) for i, d in enumerate(input_shape)]
+        dims = self._track_dims(g, chain, input_dims)
+        if dims is None:
+            return False
+
+        if dims == input_dims and last.output[0] not in g.outputs:
+            self.logger.debug("remove %d shape ops not changing the shape of %s", len(chain), input_name)
+            g.replace_all_inputs(g.get_nodes(), last.output[0], input_name)
+            for node in chain:
+                g.remove_node(node.name)
+            return True
+
+        if len(chain) == 1 or dims.count(None) > 1 or 0 in dims:
+            return False
+        # dims copied from an other position of the input are read with Shape and Gather
+        pieces = []
+        gathered = []
+        for i, d in enumerate(dims):
+            if isinstance(d, _Src) and d.index != i:
+                if not gathered:
+                    pieces.append(gathered)
+                gathered.append(d.index)
+            else:
+                gathered = []
+                value = -1 if d is None else 0 if isinstance(d, _Src) else d
+                if pieces and isinstance(pieces[-1], np.ndarray):
+                    pieces[-1] = np.append(pieces[-1], value)
+                else:
+                    pieces.append(np.array([value], dtype=np.int64))
+        gathers = sum(1 for p in pieces if isinstance(p, list))
+        # Shape, Gathers and Concat must be fewer nodes than the chain they replace
+        if gathers and gathers + 3 > len(chain):
+            return False
+
+        self.logger.debug("collapse %d shape ops ending with %s into a Reshape", len(chain), last.name)
+        shape_name = self._make_shape_input(g, input_name, pieces, last.name)
+        output_shapes = last.output_shapes
+        output_dtypes = last.output_dtypes
+        for node in chain:
+            g.remove_node(node.name)
+        g.make_node("Reshape", [input_name, shape_name], outputs=last.output, name=last.name,
+                    shapes=output_shapes, dtypes=output_dtypes)
+        return True
+
+    @staticmethod
+    def _make_shape_input(g, input_name, pieces, name):
+        if len(pieces) == 1 and isinstance(pieces[0], np.ndarray):
+            return g.make_const(utils.make_name(name + "_shape"), pieces[0]).output[0]
+        shape = g.make_node("Shape", [input_name], op_name_scope=name)
+        inputs = []
+        for piece in pieces:
+            if isinstance(piece, np.ndarray):
+                inputs.append(g.make_const(utils.make_name(name + "_dims"), piece).output[0])
+            else:
+                indices = g.make_const(utils.make_name(name + "_indices"), np.array(piece, dtype=np.int64))
+                inputs.append(g.make_node("Gather", [shape.output[0], indices.output[0]],
+                                          op_name_scope=name).output[0])
+        return g.make_node("Concat", inputs, attr={"axis": 0}, op_name_scope=name).output[0]
+
+    def _track_dims(self, g, chain, dims):
+        """Follow the dims of the chain input through the chain.
+           A dim is an int if known, _Src if it is copied from a dim of the input and None otherwise.
+           Static shapes are only used to fill in unknown dims if they agree with the tracked ones,
+           some handlers leave the shape of the tf op on a tensor they reshape afterwards.
+        """
+        for node in chain:
+            dims = self._node_dims(node, dims)
+            if dims is None:
+                return None
+            output_shape = g.get_shape(node.output[0])
+            if output_shape is not None and len(output_shape) == len(dims) and \
+                    not any(isinstance(d, int) and s >= 0 and d != s for d, s in zip(dims, output_shape)):
+                dims = [s if d is None and s >= 0 else d for d, s in zip(dims, output_shape)]
+        return dims
+
+    @staticmethod
+    def _node_dims(node, dims):
+        if node.type == "Reshape":
+            if len(node.input) != 2 or not node.inputs[1].is_const():
+                return None
+            new_dims = []
+            for i, s in enumerate(node.inputs[1].get_tensor_value()):
+                if s == 0:
+                    if i >= len(dims):
+                        return None
+                    new_dims.append(dims[i])
+                else:
+                    new_dims.append(s if s > 0 else None)
+            if all(isinstance(d, int) for d in dims + new_dims) and np.prod(dims) != np.prod(new_dims):
+                return None
+            return new_dims
+
+        if node.type == "Squeeze":
+            axes = node.get_attr_value("axes")
+            if len(node.input) > 1:
+                return None
+            if axes is None:
+                if not all(isinstance(d, int) for d in dims):
+                    return None
+                axes = [i for i, d in enumerate(dims) if d == 1]
+            axes = [a + len(dims) if a < 0 else a for a in axes]
+            if any(a < 0 or a >= len(dims) or isinstance(dims[a], int) and dims[a] != 1 for a in axes):
+                return None
+            return [d for i, d in enumerate(dims) if i not in axes]
+
+        if node.type == "Unsqueeze":
+            axes = node.get_attr_value("axes")
+            if len(node.input) > 1 or axes is None:
+                return None
+            rank = len(dims) + len(axes)
+            axes = sorted(a + rank if a < 0 else a for a in axes)
+            if any(a < 0 or a >= rank for a in axes):
+                return None
+            new_dims = list(dims)
+            for a in axes:
+                new_dims.insert(a, 1)
+            return new_dims
+
+        if node.type == "Flatten":
+            axis = node.get_attr_value("axis", 1)
+            if axis < 0:
+                axis += len(dims)
+            if axis < 0 or axis > len(dims):
+                return None
+
+            def merge(part):
+                if len(part) == 1:
+                    return part[0]
+                if all(isinstance(d, int) for d in part):
+                    return int(np.prod(part))
+                return None
+
+            return [merge(dims[:axis]), merge(dims[axis:])]
+
+        return None
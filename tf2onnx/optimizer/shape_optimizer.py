@@ -0,0 +1,128 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Shape Optimizer.
+   Replace Shape ops, and the Gathers and Slices of them, by constants where the graph knows the dims
+   they read, so the shape computations following them can be folded by the const fold optimizer.
+   Unknown dims, e.g. the batch size, stay dynamic.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from .. import utils
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class ShapeOptimizer(GraphOptimizerBase):
+    """Shape Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(ShapeOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        varying = self._varying_tensors(g)
+        for node in g.get_nodes():
+            if node.type != "Shape" or not utils.is_onnx_domain(node.domain) or node.input[0] in varying:
+                continue
+            dims = self._known_dims(g, node)
+            if dims is None:
+                continue
+            if all(d >= 0 for d in dims):
+                if node.output[0] not in g.outputs:
+                    self.logger.debug("replace %s by the shape of %s", node.name, node.input[0])
+                    self._replace_by_const(g, node, np.array(dims, dtype=np.int64))
+                continue
+            for consumer in g.find_output_consumers(node.output[0]):
+                if consumer.graph != g or consumer.output[0] in g.outputs:
+                    continue
+                values = self._read_dims(g, consumer, node.output[0], dims)
+                if values is not None and np.all(values >= 0):
+                    self.logger.debug("replace %s by the dims it reads from %s", consumer.name, node.name)
+                    self._replace_by_const(g, consumer, values)
+            if not g.find_output_consumers(node.output[0]) and node.output[0] not in g.outputs:
+                g.remove_node(node.name)
+        return g
+
+    @classmethod
+    def _varying_tensors(cls, g):
+        """Tensors of a Loop or Scan body computed from its inputs, their shapes can change each iteration.
+           Subgraphs of the body, e.g. If branches, see them from the outer scope."""
+        if g.parent_graph is None:
+            return set()
+        outer = cls._varying_tensors(g.parent_graph)
+        # nested subgraphs can read any tensor, the outputs of their nodes are taken as varying too
+        names = [out for node in g.get_nodes() if node.is_graph_input() or node.get_body_graphs()
+                 for out in node.output]
+        names += [inp for node in g.get_nodes() for inp in node.input
+                  if inp in outer and g.get_node_by_output(inp, search_in_parent_graphs=False) is None]
+        varying = set()
+        while names:
+            name = names.pop()
+            if name in varying:
+                continue
+            varying.add(name)
+            for consumer in g.find_output_consumers(name):
+                if consumer.graph == g:
+                    names.extend(consumer.output)
+        return varying
+
+    @staticmethod
+    def _known_dims(g, node):
+        producer = node.inputs[0]
+        while producer is not None and producer.type == "Identity":
+            producer = producer.inputs[0]
+        if producer is not None and producer.get_body_graphs():
+            # loop carried tensors can change their shape from one iteration to the next
+            return None
+        shape = g.get_shape(node.input[0])
+        if shape is None:
+            return None
+        # Shape takes the range of the dims as attributes since opset 15
+        start = node.get_attr_value("start", 0)
+        end = node.get_attr_value("end", len(shape))
+        return shape[start:end]
+
+    @staticmethod
+    def _read_dims(g, node, shape_name, dims):
+        """Values of the 1-D dims tensor read by node, None if node reads it differently."""
+        if node.input[0] != shape_name or not all(inp.is_const() for inp in node.inputs[1:] if inp):
+            return None
+        dims = np.array(dims, dtype=np.int64)
+
+        if node.type == "Gather":
+            if node.get_attr_value("axis", 0) != 0:
+                return None
+            indices = node.inputs[1].get_tensor_value(as_list=False)
+            if np.any(indices < -len(dims)) or np.any(indices >= len(dims)):
+                return None
+            return dims[indices]
+
+        if node.type == "Slice":
+            if g.opset < 10:
+                starts = node.get_attr_value("starts")
+                ends = node.get_attr_value("ends")
+                axes = node.get_attr_value("axes", [0])
+                steps = [1]
+            else:
+                starts, ends = [node.inputs[i].get_tensor_value() for i in [1, 2]]
+                axes = node.inputs[3].get_tensor_value() if len(node.input) > 3 and node.input[3] else [0]
+                steps = node.inputs[4].get_tensor_value() if len(node.input) > 4 and node.input[4] else [1]
+            if list(axes) not in [[0], [-1]]:
+                return None
+            return dims[starts[0]:ends[0]:steps[0]]
+
+        return None
+
+    @staticmethod
+    def _replace_by_const(g, node, value):
+        const = g.make_const(utils.make_name(node.name), value)
+        g.replace_all_inputs(g.get_nodes(), node.output[0], const.output[0])
+        g.remove_node(node.name)
@@ -4,12 +4,12 @@
 """Transpose Optimizer."""
 
 from __future__ import unicode_literals
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import numpy as np
 import onnx
 from tf2onnx.constants import NCHW_TO_NHWC, NHWC_TO_NCHW
-from .. import utils
+from .. import profiler, utils
 from .optimizer_base import GraphOptimizerBase
 
 
@@ -17,6 +17,31 @@ from .optimizer_base import GraphOptimizerBase
 # FIXME:
 # pylint: disable=unused-variable
 
+# ops computing each output element from the element at the same position of their single input
+_UNARY_OPS = [
+    "Abs", "Acos", "Acosh", "Asin", "Asinh", "Atan", "Atanh", "Cast", "Ceil", "Clip", "Cos", "Cosh", "Dropout",
+    "Elu", "Erf", "Exp", "Floor", "HardSigmoid", "IsInf", "IsNaN", "LeakyRelu", "Log", "Neg", "Not",
+    "Reciprocal", "Relu", "Round", "Selu", "Sigmoid", "Sign", "Sin", "Sinh", "Softplus", "Softsign", "Sqrt",
+    "Tan", "Tanh", "ThresholdedRelu",
+]
+
+# elementwise ops broadcasting their inputs
+_BROADCAST_OPS = [
+    "And", "BitShift", "Div", "Equal", "Greater", "Less", "Max", "Mean", "Min", "Mod", "Or", "Pow", "PRelu",
+    "Sub", "Sum", "Where", "Xor",
+]
+
+_REDUCE_OPS = [
+    "ReduceL1", "ReduceL2", "ReduceLogSum", "ReduceLogSumExp", "ReduceMax", "ReduceMean", "ReduceMin",
+    "ReduceProd", "ReduceSum", "ReduceSumSquare",
+]
+
+
+def is_tranpose(transpose_node):
+    perm_attr = transpose_node.get_attr('perm')
+    return transpose_node.type == "Transpose" and perm_attr
+
+
 def is_nhwc_transpose(transpose_node):
     perm_attr = transpose_node.get_attr('perm')
     return transpose_node.type == "Transpose" and perm_attr and perm_attr.ints == NCHW_TO_NHWC
@@ -32,14 +57,39 @@ def is_useless_transpose(transpose_node):
     return transpose_node.type == "Transpose" and perm_attr and perm_attr.ints == list(range(len(perm_attr.ints)))
 
 
+def is_channel_last_perm(perm):
+    """True for the perm from NC... to N...C of any rank, as the converter puts after NCHW ops."""
+    return len(perm) >= 3 and list(perm) == [0] + list(range(2, len(perm))) + [1]
+
+
+def invert_perm(perm):
+    inv = [0] * len(perm)
+    for i, p in enumerate(perm):
+        inv[p] = i
+    return inv
+
+
+def permute_axes_values(perm, values):
+    """Per axis values of the transposed tensor reordered for the tensor before the transpose."""
+    new_values = [0] * len(perm)
+    for i, p in enumerate(perm):
+        new_values[p] = values[i]
+    return new_values
+
+
 class TransposeOptimizer(GraphOptimizerBase):
-    """Transpose Optimizer."""
+    """Transpose Optimizer.
+       Transposes of any rank are pushed down through the ops following them, until they cancel out with
+       another transpose or meet an op they can't pass. Every transpose is put on a worklist, pushing one
+       queues the transposes around the nodes it touched, so the graph is not rescanned after each push.
+    """
 
     def __init__(self):
         super(TransposeOptimizer, self).__init__()
 
         self._handler_map = {}
-        self._force_stop = {}
+        self._worklist = deque()
+        self._queued = set()
 
         self._initialize_handlers()
         self._g = None
@@ -72,43 +122,40 @@ class TransposeOptimizer(GraphOptimizerBase):
                         if name == output_name:
                             child.input[i] = const_name
 
+        if constable_reshape_ops:
             self._g.topological_sort(self._g.get_nodes())
 
     def post_optimize_action(self):
-        def _calculate_new_shape(graph, op):
-            input_shape = graph.get_shape(op.input[0])
+        def _calculate_new_shape(graph, op, input_shape, perm):
             if input_shape.count(-1) <= 1:
-                if is_nchw_transpose(op):
-                    new_shape = [input_shape[0], input_shape[3], input_shape[1], input_shape[2]]
-                else:
-                    new_shape = [input_shape[0], input_shape[2], input_shape[3], input_shape[1]]
+                new_shape = [input_shape[i] for i in perm]
                 return graph.make_const(utils.make_name("new_shape"), np.array(new_shape, dtype=np.int64)).output[0]
 
             # reshape requires tha output shape can only contain one -1, if not some extra op needed.
             input_shape = graph.make_node("Shape", [op.input[0]]).output[0]
-            if is_nchw_transpose(op):
-                indice = graph.make_const(utils.make_name("indice"), np.array(NHWC_TO_NCHW)).output[0]
-            else:
-                indice = graph.make_const(utils.make_name("indice"), np.array(NCHW_TO_NHWC)).output[0]
-
+            indice = graph.make_const(utils.make_name("indice"), np.array(perm, dtype=np.int64)).output[0]
             return graph.make_node("Gather", [input_shape, indice]).output[0]
 
         nodes = self.nodes
-        # if channel==1 or height==width==1, replace transpose with reshape
+        replaced = False
+        # if a transpose only moves dims of size 1, e.g. channel==1 or height==width==1, replace it with reshape
         # replacing trans with reshape is because transpose will copy data even if this transpose doesn't nothing
         for op in nodes:
-            if op.type == "Transpose":
+            if is_tranpose(op):
                 input_shape = self._g.get_shape(op.input[0])
-                if not input_shape:
+                perm = op.get_attr_value("perm")
+                if not input_shape or len(input_shape) != len(perm):
                     continue
 
-                if (is_nchw_transpose(op) and (input_shape[3] == 1 or (input_shape[1:3] == [1, 1])))\
-                   or (is_nhwc_transpose(op) and (input_shape[1] == 1 or (input_shape[2:4] == [1, 1]))):
-                    new_shape = _calculate_new_shape(self._g, op)
+                moved_dims = [p for p in perm if input_shape[p] != 1]
+                if moved_dims == sorted(moved_dims):
+                    new_shape = _calculate_new_shape(self._g, op, input_shape, perm)
                     # replace transpose with reshape
                     self._g.remove_node(op.name)
                     self._g.make_node("Reshape", [op.input[0], new_shape], name=op.name, outputs=op.output)
-                    self._g.topological_sort(self._g.get_nodes())
+                    replaced = True
+        if replaced:
+            self._g.topological_sort(self._g.get_nodes())
 
     def merge_duplicated_transposes(self):
         # strategy used in previous procedure is to move transpose nodes down if possible,
@@ -137,30 +184,29 @@ class TransposeOptimizer(GraphOptimizerBase):
     def _optimize_at_current_graph_level(self, graph):
         self._g = graph
         self.pre_optimize_action()
-        no_action = False
         iteration_cnt = 0
-        while not no_action:
-            no_action = True
-            nodes = self.nodes
-            self._force_stop = {}
-            for n in nodes:
-                if is_nhwc_transpose(n):
-                    if self._handle_nhwc_tranpose(n):
-                        no_action = False
-                        self.graph_been_opt = True
-                        iteration_cnt += 1
-                        # need break, because handler may change nodes set, making the n stale object
-                        # referencing already deleted elements
-                        break
-
-                if is_useless_transpose(n):
-                    no_action = False
-                    iteration_cnt += 1
-                    self._remove_useless_tranpose(n)
-                    break
-            # for debugging purpose
-            if "stop" in self._force_stop and self._force_stop["stop"] == 1:
-                break
+        # a push can enable one further away than the nodes it queues, so sweep once more until nothing moves
+        changed = True
+        while changed:
+            changed = False
+            for n in self.nodes:
+                if is_tranpose(n):
+                    self._enqueue(n)
+            while self._worklist:
+                trans = self._worklist.popleft()
+                self._queued.discard(trans)
+                if trans.graph is not self._g:
+                    # removed by an earlier push
+                    continue
+                if is_useless_transpose(trans):
+                    producer = trans.inputs[0]
+                    self._remove_useless_tranpose(trans)
+                    self._enqueue_around(producer)
+                elif not self._handle_tranpose(trans):
+                    continue
+                changed = True
+                self.graph_been_opt = True
+                iteration_cnt += 1
 
         self.logger.debug("finish after " + str(iteration_cnt) + " iteration(s)")
 
@@ -168,58 +214,152 @@ class TransposeOptimizer(GraphOptimizerBase):
         self.post_optimize_action()
         return self._g
 
+    def _enqueue(self, node):
+        if node is not None and node not in self._queued and node.graph is self._g and is_tranpose(node):
+            self._queued.add(node)
+            self._worklist.append(node)
+
+    def _enqueue_around(self, node):
+        """Queue node if it is a transpose, and the transposes producing its inputs or consuming its outputs."""
+        if node is None or node.graph is not self._g:
+            return
+        self._enqueue(node)
+        for inp in node.inputs:
+            self._enqueue(inp)
+        for output in node.output:
+            for consumer in self._g.find_output_consumers(output):
+                self._enqueue(consumer)
+
+    def _make_transpose(self, input_id, perm, shape=None, dtype=None):
+        shapes = [shape] if shape is not None else None
+        dtypes = [dtype] if dtype is not None else None
+        trans = self._g.make_node("Transpose", [input_id], attr={"perm": perm}, shapes=shapes, dtypes=dtypes)
+        self._enqueue(trans)
+        return trans
+
     def _initialize_handlers(self):
         self._handler_map = {
             "Add": self._add_handler,
-            "Cast": self._simple_through_handler,
-            "Clip": self._simple_through_handler,
+            "ArgMax": self._arg_handler,
+            "ArgMin": self._arg_handler,
             "Concat": self._concat_handler,
+            "Gather": self._gather_handler,
+            "Hardmax": self._softmax_handler,
             "Identity": self._identity_handler,
-            "LeakyRelu": self._simple_through_handler,
-            "Max": self._maxmin_handler,
-            "Min": self._maxmin_handler,
+            "LogSoftmax": self._softmax_handler,
             "Mul": self._mul_handler,
             "Pad": self._pad_handler,
-            "ReduceMean": self._reducemean_handler,
-            "Relu": self._simple_through_handler,
+            "Resize": self._resize_handler,
             "Shape": self._shape_handler,
+            "Size": self._size_handler,
             "Slice": self._slice_handler,
+            "Softmax": self._softmax_handler,
             "Split": self._split_handler,
             "Squeeze": self._squeeze_handler,
-            "Sub": self._sub_handler,
-            "Tanh": self._simple_through_handler,
+            "Tile": self._tile_handler,
             "Transpose": self._transpose_handler,
+            "Unsqueeze": self._unsqueeze_handler,
+            "Upsample": self._resize_handler,
         }
-
-    def _handle_node_having_branches(self, node):
-        # create transpose pairs if some input are not.
-        if not self._create_transpose_pairs_before_node(node):
+        for op in _UNARY_OPS:
+            self._handler_map[op] = self._simple_through_handler
+        for op in _BROADCAST_OPS:
+            self._handler_map[op] = self._handle_node_having_branches
+        for op in _REDUCE_OPS:
+            self._handler_map[op] = self._reduce_handler
+
+    def _handle_node_having_branches(self, trans, node):
+        """Push trans below node whose inputs broadcast against each other. Transposes with the same perm
+           on the other inputs are removed, const inputs are transposed in place. Other inputs get the
+           inverse transpose, which only pays off for the channel last transposes the converter makes."""
+        perm = trans.get_attr_value("perm")
+        rank = len(perm)
+        if len(node.output) != 1:
             return False
-        # make sure node's all input transpose all have only 1 consumer node,
-        # otherwise, it would impact their other output nodes
-        if self._nodes_has_single_consumer_node(node.inputs) and len(node.output) == 1:
-            self._create_transpose_pairs_after_node(node)
-            input_transposes = set(node.inputs)
-            for n in input_transposes:
-                n_input = n.input[0]
-                utils.make_sure(len(n.output) == 1, "only expect single output")
-                self._g.replace_all_inputs(self._g.get_nodes(), n.output[0], n_input)
-                self._g.remove_node(n.name)
-
-            utils.make_sure(len(node.output) == 1, "only expect single output")
-            # currently we assume node only has 1 output, for cases where it is more than 1 for example Split
-            # we need consider the fact that Split's multiple output will not always has data in NCHW/NHWC,
-            # it might be a different shape.
-            output_transposes = self._g.find_output_consumers(node.output[0])
-            for n in output_transposes:
-                n_input = n.input[0]
-                utils.make_sure(len(n.output) == 1, "only expect single output")
-                self._g.replace_all_inputs(self._g.get_nodes(), n.output[0], n_input)
-                self._g.remove_node(n.name)
-            return True
 
-        self.logger.debug("input transpose does not have single consumer, skipping...")
-        return False
+        # check all inputs before changing anything
+        transposed = []
+        consts = []
+        others = []
+        for i, (input_id, n) in enumerate(zip(node.input, node.inputs)):
+            if n is not None and n.type == "Transpose" and n.get_attr_value("perm") == perm and \
+                    self._nodes_has_single_consumer_node([n]):
+                transposed.append(i)
+                continue
+            shape = self._g.get_shape(input_id)
+            if shape is not None and len(shape) > rank:
+                return False
+            # reshape can take one -1 at most, otherwise the rank is expanded with ConstantOfShape
+            needs_dynamic_reshape = shape is None or (len(shape) < rank and shape.count(-1) >= 2)
+            if n is not None and n.is_const():
+                consts.append(i)
+            elif shape is not None and all(d == 1 for d in shape):
+                # broadcasts the same way against either layout
+                continue
+            elif not is_channel_last_perm(perm):
+                self.logger.debug("%s has an input which is no %s transpose, skipping", node.name, perm)
+                return False
+            elif needs_dynamic_reshape and self._g.opset <= 9:
+                self.logger.warning("%s 's shape is %s, ConstantOfShape will be used which exists in version 9 "
+                                    "or higher while graph's opset version is %s", input_id, shape, self._g.opset)
+                return False
+            else:
+                others.append(i)
+
+        inv_perm = invert_perm(perm)
+        input_transposes = set()
+        for i in transposed:
+            input_transposes.add(node.inputs[i])
+            node.input[i] = node.inputs[i].input[0]
+        for n in input_transposes:
+            self._g.remove_node(n.name)
+
+        for i in consts:
+            val = node.inputs[i].get_tensor_value(as_list=False)
+            if all(d == 1 for d in val.shape):
+                continue
+            val = np.transpose(val.reshape([1] * (rank - val.ndim) + list(val.shape)), inv_perm)
+            new_const = self._g.make_const(utils.make_name(node.inputs[i].name), val)
+            node.input[i] = new_const.output[0]
+
+        for i in others:
+            input_id = node.input[i]
+            shape = self._g.get_shape(input_id)
+            # if rank of the input is lower, then we need to insert a reshape op before inserting a transpose
+            # for example shape of n is [x, y], then output shape of reshape will be [1, 1, x, y]
+            if shape is None or (len(shape) < rank and shape.count(-1) >= 2):
+                const_rank = self._g.make_const(utils.make_name("const_rank"), np.array([rank], np.int64)).output[0]
+                tensor_1 = onnx.helper.make_tensor("value", onnx.TensorProto.INT64, [1], [1])
+                shape_node = self._g.make_node("Shape", [input_id]).output[0]
+                rank_node = self._g.make_node("Shape", [shape_node]).output[0]
+                expand_rank = self._g.make_node("Sub", [const_rank, rank_node]).output[0]
+                array_fill_1 = self._g.make_node("ConstantOfShape", [expand_rank], attr={"value": tensor_1}).output[0]
+                new_shape = self._g.make_node("Concat", [array_fill_1, shape_node], attr={"axis": 0}).output[0]
+                input_id = self._g.make_node("Reshape", [input_id, new_shape]).output[0]
+            elif len(shape) < rank:
+                # according to broadcasting rule to expand shape while not tile the tensor here
+                # still count on the broadcasting op to tile the tensor
+                shape = [1] * (rank - len(shape)) + shape
+                const = self._g.make_const(utils.make_name("reshape_shape"), np.array(shape, np.int64)).output[0]
+                input_id = self._g.make_node("Reshape", [input_id, const]).output[0]
+            nchw_node = self._make_transpose(input_id, inv_perm)
+            self._g.replace_input(node, node.input[i], nchw_node.output[0])
+
+        self._create_transpose_after_node(node, perm)
+        return True
+
+    def _create_transpose_after_node(self, node, perm):
+        """Transpose every output of node by perm, the consumers read the transposed outputs."""
+        for output in node.output:
+            consumers = self._g.find_output_consumers(output)
+            if not consumers:
+                continue
+            shape = self._g.get_shape(output)
+            dtype = self._g.get_dtype(output)
+            if shape is not None and len(shape) == len(perm):
+                self._g.set_shape(output, permute_axes_values(perm, shape))
+            trans = self._make_transpose(output, perm, shape, dtype)
+            self._g.replace_all_inputs(consumers, output, trans.output[0])
 
     # get the input index of transpose op in node's inputs.
     def _get_input_index_for_trans(self, node, trans):
@@ -231,8 +371,9 @@ class TransposeOptimizer(GraphOptimizerBase):
         return input_index
 
     # the assumption is: both node and trans have only 1 output
-    def _switch_transpose_and_node(self, node, trans):
-        if not self._nodes_has_single_consumer_node([trans]):
+    def _switch_transpose_and_node(self, node, trans, new_perm=None):
+        """Move trans below node, new_perm is the perm of trans after node if node changes the rank."""
+        if not self._nodes_has_single_consumer_node([trans]) or len(node.output) != 1:
             return False
 
         input_index = self._get_input_index_for_trans(node, trans)
@@ -241,36 +382,64 @@ class TransposeOptimizer(GraphOptimizerBase):
         self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
         node.input[input_index] = trans.input[0]
         trans.input[0] = node.output[0]
+        if new_perm is not None:
+            trans.set_attr("perm", new_perm)
 
         # need to transpose node shape in backward direction as well after switch
         # otherwise, reshape added in post_optimize_action may not work correctly
+        perm = trans.get_attr_value("perm")
         shape = self._g.get_shape(node.output[0])
-        if shape:
-            # only nhwc transpose can reach here
-            new_shape = [shape[i] for i in NHWC_TO_NCHW]
-            self._g.set_shape(node.output[0], new_shape)
+        if shape and len(shape) == len(perm):
+            self._g.set_shape(trans.output[0], shape)
+            self._g.set_shape(node.output[0], permute_axes_values(perm, shape))
         return True
 
+    def _switch_transpose_and_node_removing_axes(self, node, trans, axes):
+        """Move trans below node which drops the given axes of its transposed input."""
+        perm = trans.get_attr_value("perm")
+        kept = [p for i, p in enumerate(perm) if i not in axes]
+        if not kept:
+            # the output is a scalar, nothing left to transpose
+            if not self._nodes_has_single_consumer_node([trans]):
+                return False
+            self._g.replace_input(node, trans.output[0], trans.input[0])
+            self._g.remove_node(trans.name)
+            return True
+        sorted_kept = sorted(kept)
+        return self._switch_transpose_and_node(node, trans, [sorted_kept.index(p) for p in kept])
+
     # if return value is True, then it means Transpose is handled as designed
     # otherwise, it means that we skip handling since it is not in our support set
-    def _handle_nhwc_tranpose(self, trans):
+    def _handle_tranpose(self, trans):
         if trans.output[0] in self._g.outputs:
             self.logger.debug("%s connects to graph outputs, skip", trans.output[0])
             return False
         out_nodes = self._g.find_output_consumers(trans.output[0])
         if len(out_nodes) == 1:
             p = out_nodes[0]
-            if p.name in self._output_names:
+            # graph outputs are not always named after their node, e.g. once an output Identity is removed.
+            # Transpose and Identity handlers keep the graph outputs themselves.
+            if p.name in self._output_names or \
+                    (p.type not in ["Transpose", "Identity"] and set(p.output).intersection(self._g.outputs)):
                 self.logger.debug("cannot move transpose down since it met output node %s", p.name)
                 return False
+            if p.graph is not self._g:
+                self.logger.debug("cannot move transpose down into the body graph of %s", p.name)
+                return False
 
-            if p.type in self._handler_map:
+            if p.type in self._handler_map and not p.domain:
                 op_handler = self._handler_map[p.type]
-                return op_handler(trans, p)
+                with profiler.handler("transpose/" + p.type), \
+                        utils.node_origin(self._g.get_node_origin(p.name)[0], "transpose/" + p.type):
+                    if not op_handler(trans, p):
+                        return False
+                self._enqueue_around(trans)
+                self._enqueue_around(p)
+                return True
             return False
         # move transpose into branches to let Transposes can be "handled" in each branch
         for n in out_nodes:
-            branch_trans = self._g.make_node("Transpose", [trans.input[0]], attr=trans.attr_onnx)
+            branch_trans = self._make_transpose(trans.input[0], trans.get_attr_value("perm"))
             self._g.replace_input(n, trans.output[0], branch_trans.output[0])
 
         self._g.remove_node(trans.name)
@@ -288,125 +457,66 @@ class TransposeOptimizer(GraphOptimizerBase):
                     return False
         return True
 
-    def _get_non_nchw_transpose_output_nodes(self, node):
-        # we just support node having 1 output, we need consider cases where node has more than 1 outputs
-        assert len(node.output) == 1
-        non_nchw_tranpose_nodes = []
-        consumers = self._g.find_output_consumers(node.output[0])
-        for o in consumers:
-            if not is_nchw_transpose(o) and o not in non_nchw_tranpose_nodes:
-                non_nchw_tranpose_nodes.append(o)
-        return non_nchw_tranpose_nodes
-
-    def _create_transpose_pairs_after_node(self, node):
-        assert len(node.output) == 1  # just support node who has 1 output
-        non_nchw_trans_consumers = self._get_non_nchw_transpose_output_nodes(node)
-        # add Transpose(0, 3, 1, 2) and Transpose(0, 2, 3, 1) before each non_nchw_trans_consumers
-        for consumer in non_nchw_trans_consumers:
-            nchw_node = self._g.make_node("Transpose", [node.output[0]], attr={"perm": NHWC_TO_NCHW})
-            nhwc_node = self._g.make_node("Transpose", [nchw_node.output[0]], attr={"perm": NCHW_TO_NHWC})
-            self._g.replace_input(consumer, node.output[0], nhwc_node.output[0])
-
-    def _create_transpose_pairs_before_node(self, node):
-        def shape_after_expand(ori_shape):
-            # according to broadcasting rule to expand shape to 4D while not tile the tensor here
-            # still count on the broadcasting op to tile the tensor
-            if ori_shape.count(-1) >= 2:
-                self.logger.warning("%s shape can contain one -1 at most, otherwise reshape op can't work", node.name)
-                return None
-            ori_rank = len(ori_shape)
-            new_shape = [1]*(4-ori_rank) + ori_shape
-            return new_shape
-
-        non_nhwc_trans_inputs = []
-        for input_id, n in zip(node.input, node.inputs):
-            if not is_nhwc_transpose(n):
-                # check in case node has two inputs coming from a same node output.
-                if [input_id, n] not in non_nhwc_trans_inputs:
-                    non_nhwc_trans_inputs.append([input_id, n])
-
-        # add Transpose(0, 3, 1, 2) and Transpose(0, 2, 3, 1) before each non_nhwc_trans_consumers
-        shape_unknow = [input_id for input_id, _ in non_nhwc_trans_inputs if self._g.get_shape(input_id) is None]
-        if shape_unknow:
-            if self._g.opset <= 9:
-                msg = "%s 's shape is unknown, ConstantOfShape will be used which exists in version 9 or higher" \
-                      "while graph's opset version is %s" % (shape_unknow, self._g.opset)
-                self.logger.warning(msg)
-                return False
-
-        for input_id, n in non_nhwc_trans_inputs:
-            shape = self._g.get_shape(input_id)
-            # if rank of n is not 4, then we need to insert a reshape op before inserting a transpose
-            # for example shape of n is [x, y], then output shape of reshape will be [1, 1, x, y]
-            if shape is None:
-                const_4 = self._g.make_const(utils.make_name("const_4"), np.array([4], np.int64)).output[0]
-                tensor_1 = onnx.helper.make_tensor("value", onnx.TensorProto.INT64, [1], [1])
-                shape_node = self._g.make_node("Shape", [input_id]).output[0]
-                rank_node = self._g.make_node("Shape", [shape_node]).output[0]
-                expand_rank = self._g.make_node("Sub", [const_4, rank_node]).output[0]
-                array_fill_1 = self._g.make_node("ConstantOfShape", [expand_rank], attr={"value": tensor_1}).output[0]
-                new_shape = self._g.make_node("Concat", [array_fill_1, shape_node], attr={"axis": 0}).output[0]
-                reshape = self._g.make_node("Reshape", [input_id, new_shape]).output[0]
-                input_of_new_trans = reshape
-            elif len(shape) == 4:
-                input_of_new_trans = input_id
-            else:
-                shape_4d = shape_after_expand(shape)
-                if shape_4d is None:
-                    return False
-                const = self._g.make_const(utils.make_name("reshape_shape"), np.array(shape_4d, np.int64)).output[0]
-                reshape = self._g.make_node("Reshape", [input_id, const]).output[0]
-                input_of_new_trans = reshape
-
-            nchw_node = self._g.make_node("Transpose", [input_of_new_trans], attr={"perm": NHWC_TO_NCHW})
-            nhwc_node = self._g.make_node("Transpose", [nchw_node.output[0]], attr={"perm": NCHW_TO_NHWC})
-            self._g.replace_input(node, input_id, nhwc_node.output[0])
-        return True
+    def _set_const_input(self, node, index, value):
+        """Set the const input of node, the const might be shared."""
+        if self._nodes_has_single_consumer_node([node.inputs[index]]):
+            node.inputs[index].set_tensor_value(value)
+        else:
+            new_const = self._g.make_const(utils.make_name(node.inputs[index].name), value)
+            self._g.replace_input(node, node.input[index], new_const.output[0])
 
     def _add_handler(self, trans, node):
-        if node.inputs[1].is_const():
-            t_p = trans.inputs[0]
-            if t_p.type in ("Conv", "ConvTranspose") and len(t_p.input) == 2:
-                # if Conv or ConvTranspose's bias input is not set, then we set, otherwise, we don't set
-                # todo: maybe we can add already set bias with the input??? try later
-
-                if not self._nodes_has_single_consumer_node([t_p]):
-                    self.logger.debug("Conv does not have single consumer, can not merge Conv and Add")
-                    return self._handle_node_having_branches(node)
-
-                if not self._nodes_has_single_consumer_node([trans]):
-                    self.logger.debug("input transpose does not have single consumer, skipping...")
-                    return False
-
-                target_node = node.inputs[1]
-                numpy_val = target_node.get_tensor_value(as_list=False)
-                # Optional 1D bias to be added to the convolution, has size of M
-                if len(numpy_val.shape) - numpy_val.shape.count(1) > 1:
-                    self.logger.debug("Bias is not 1D, can not merge Conv and Add")
-                    return self._handle_node_having_branches(node)
-
-                bias_size = max(numpy_val.shape)
-                size_m = t_p.inputs[1].output_shapes[0][0]
-                if bias_size != size_m:
-                    self.logger.debug("Bias size is not M, can not merge Conv and Add")
-                    return self._handle_node_having_branches(node)
-
-                target_val = numpy_val.reshape(bias_size)
-                target_node.set_tensor_value(target_val)
+        perm = trans.get_attr_value("perm")
+        t_p = trans.inputs[0]
+        bias_index = 1 if node.input[0] == trans.output[0] else 0
+        bias_node = node.inputs[bias_index]
+        weights_shape = self._g.get_shape(t_p.input[1]) if t_p is not None and len(t_p.input) == 2 else None
+        if bias_node is not None and bias_node.is_const() and t_p.type in ("Conv", "ConvTranspose") and \
+                weights_shape is not None and is_channel_last_perm(perm):
+            # if Conv or ConvTranspose's bias input is not set, then we set, otherwise, we don't set
+            # todo: maybe we can add already set bias with the input??? try later
+
+            if not self._nodes_has_single_consumer_node([t_p]):
+                self.logger.debug("Conv does not have single consumer, can not merge Conv and Add")
+                return self._handle_node_having_branches(trans, node)
+
+            if not self._nodes_has_single_consumer_node([trans]):
+                self.logger.debug("input transpose does not have single consumer, skipping...")
+                return False
 
-                conv_inputs = [t_p.input[0], t_p.input[1], node.input[1]]
-                conv_node = self._g.make_node(t_p.type, conv_inputs, attr=t_p.attr_onnx)
-                ops = self._g.get_nodes()
-                trans.input[0] = utils.port_name(conv_node.name)
-                self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
-                self._g.remove_node(t_p.name)
-                self._g.remove_node(node.name)
-                return True
-        return self._handle_node_having_branches(node)
+            numpy_val = bias_node.get_tensor_value(as_list=False)
+            if t_p.type == "Conv":
+                size_m = weights_shape[0]
+            else:
+                size_m = weights_shape[1] * t_p.get_attr_value("group", 1)
+            # Optional 1D bias to be added to the convolution, has size of M, on the channel axis which is last
+            if numpy_val.ndim > len(perm) or any(d != 1 for d in numpy_val.shape[:-1]) or \
+                    (numpy_val.ndim and numpy_val.shape[-1] not in [1, size_m]):
+                self.logger.debug("Bias is not 1D of size M, can not merge Conv and Add")
+                return self._handle_node_having_branches(trans, node)
+
+            target_val = np.broadcast_to(numpy_val.reshape(-1), [size_m]).astype(numpy_val.dtype)
+            bias_const = self._g.make_const(utils.make_name(bias_node.name), target_val)
+
+            conv_inputs = [t_p.input[0], t_p.input[1], bias_const.output[0]]
+            conv_node = self._g.make_node(t_p.type, conv_inputs, attr=t_p.attr_onnx)
+            ops = self._g.get_nodes()
+            trans.input[0] = utils.port_name(conv_node.name)
+            self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
+            self._g.remove_node(t_p.name)
+            self._g.remove_node(node.name)
+            return True
+        return self._handle_node_having_branches(trans, node)
 
     def _transpose_handler(self, trans, node):
-        if is_nchw_transpose(node):
-            ops = self._g.get_nodes()
+        # two transposes in a row are one transpose with the combined perm
+        perm = trans.get_attr_value("perm")
+        node_perm = node.get_attr_value("perm")
+        if not node_perm or len(node_perm) != len(perm):
+            return False
+        new_perm = [perm[i] for i in node_perm]
+        ops = self._g.get_nodes()
+        if new_perm == list(range(len(new_perm))):
             self._g.replace_all_inputs(ops, node.output[0], trans.input[0])
 
             shape = self._g.get_shape(node.output[0])
@@ -417,46 +527,37 @@ class TransposeOptimizer(GraphOptimizerBase):
                 self._g.make_node("Identity", [trans.input[0]],
                                   outputs=node.output, shapes=[shape], dtypes=[dtype])
             return True
-        return False
 
-    def _maxmin_handler(self, trans, node):
-        return self._handle_node_having_branches(node)
+        node.input[0] = trans.input[0]
+        node.set_attr("perm", new_perm)
+        self._g.remove_node(trans.name)
+        return True
 
     def _mul_handler(self, trans, node):
-        multiplier_input_id = None
-        multiplier_input_node = None
-        for i, input_node in zip(node.input, node.inputs):
-            if i != trans.output[0]:
-                multiplier_input_id = i
-                multiplier_input_node = input_node
-
-        # node's inputs may come from one same node. if so the multiplier_input_node may be none
-        if multiplier_input_node is None or not multiplier_input_node.is_const():
-            return False
-        multiplier = multiplier_input_node.get_tensor_value(as_list=False)
-
-        # todo: apply this block if we have model case multiplier_input_id==0, and verify that.
-        if multiplier_input_id == node.input[1]:
-            t_p = trans.inputs[0]
-            # make sure conv don't have bias set
-            if t_p.type == "Conv" and t_p.inputs[1].is_const() and len(t_p.input) == 2:
-                conv = t_p
-                numpy_val = conv.inputs[1].get_tensor_value(as_list=False)
-                transposed_val = np.transpose(numpy_val, (2, 3, 1, 0))
-                mul_val = multiplier
-                result = np.multiply(transposed_val, mul_val)
-                conv.inputs[1].set_tensor_value(np.transpose(result, (3, 2, 0, 1)))
+        perm = trans.get_attr_value("perm")
+        multiplier_index = 1 if node.input[0] == trans.output[0] else 0
+        multiplier_input_node = node.inputs[multiplier_index]
+        t_p = trans.inputs[0]
+        # make sure conv don't have bias set
+        if multiplier_input_node is not None and multiplier_input_node.is_const() and t_p is not None and \
+                t_p.type == "Conv" and \
+                t_p.inputs[1].is_const() and len(t_p.input) == 2 and is_channel_last_perm(perm) and \
+                self._nodes_has_single_consumer_node([t_p, trans]):
+            conv = t_p
+            numpy_val = conv.inputs[1].get_tensor_value(as_list=False)
+            multiplier = multiplier_input_node.get_tensor_value(as_list=False)
+            # the multiplier must hold one value per output channel, which is the last axis
+            if multiplier.ndim <= len(perm) and all(d == 1 for d in multiplier.shape[:-1]) and \
+                    (not multiplier.ndim or multiplier.shape[-1] in [1, numpy_val.shape[0]]):
+                mul_val = multiplier.reshape([-1] + [1] * (numpy_val.ndim - 1))
+                self._set_const_input(conv, 1, np.multiply(numpy_val, mul_val).astype(numpy_val.dtype))
 
                 ops = self._g.get_nodes()
                 self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
                 self._g.remove_node(node.name)
                 return True
 
-        # if the shape is () or (1), we just move transpose after the mul
-        if not multiplier.shape or (len(multiplier.shape) == 1 and multiplier.shape[0] == 1):
-            return self._switch_transpose_and_node(node, trans)
-
-        return False
+        return self._handle_node_having_branches(trans, node)
 
     def _identity_handler(self, trans, node):
         if node.output[0] in self._g.outputs:
@@ -467,110 +568,225 @@ class TransposeOptimizer(GraphOptimizerBase):
         return True
 
     def _concat_handler(self, trans, node):
-        if self._handle_node_having_branches(node):
-            perm = trans.get_attr_value("perm")
-            axis = node.get_attr_value("axis", 0)
-            new_axis = perm[axis]
-            node.set_attr("axis", new_axis)
+        perm = trans.get_attr_value("perm")
+        axis = node.get_attr_value("axis", 0)
+        if axis < 0:
+            axis += len(perm)
+        if self._handle_node_having_branches(trans, node):
+            node.set_attr("axis", perm[axis])
             return True
         return False
 
     def _split_handler(self, trans, node):
-        # Todo: need handle cases where Slit node has more than 1 outputs.
-        if self._handle_node_having_branches(node):
-            node.set_attr("axis", 1)
-            return True
-        return False
+        if node.input[0] != trans.output[0] or not self._nodes_has_single_consumer_node([trans]):
+            return False
+        perm = trans.get_attr_value("perm")
+        axis = node.get_attr_value("axis", 0)
+        if axis < 0:
+            axis += len(perm)
+        node.set_attr("axis", perm[axis])
+        node.input[0] = trans.input[0]
+        self._g.remove_node(trans.name)
+        # every output has the layout of the input
+        self._create_transpose_after_node(node, perm)
+        return True
 
     def _squeeze_handler(self, trans, node):
-        def _calculate_new_attr(ori_perm, ori_squeeze_axes):
-            new_squeeze_axes = sorted([ori_perm[i] for i in ori_squeeze_axes])
-            # calculate output shape after trans and squeeze
-            input_shape = "abcd"
-            shape_after_trans = [input_shape[i] for i in ori_perm]
-            output_shape = [shape_after_trans[i] for i in range(4) if i not in ori_squeeze_axes]
-            # calculate new_perm
-            # after switch, the output shape should be same, using this condtion we can figure the new perm
-            shape_after_squeeze = [input_shape[i] for i in range(4) if i not in new_squeeze_axes]
-            new_perm = [shape_after_squeeze.index(i) for i in output_shape]
-
-            return new_perm, new_squeeze_axes
+        perm = trans.get_attr_value("perm")
+        axes = node.get_attr_value("axes")
+        if axes is None:
+            shape = self._g.get_shape(node.input[0])
+            if shape is None or -1 in shape:
+                return False
+            axes = [i for i, d in enumerate(shape) if d == 1]
+        axes = [a + len(perm) if a < 0 else a for a in axes]
 
-        if not self._nodes_has_single_consumer_node([trans]):
+        if not self._switch_transpose_and_node_removing_axes(node, trans, axes):
             return False
+        node.set_attr("axes", sorted([perm[a] for a in axes]))
+        return True
 
-        if node.get_attr("axes"):
-            # switch tran and squeeze
-            # 1 switch
-            ops = self._g.get_nodes()
-            self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
-            node.input[0] = trans.input[0]
-            trans.input[0] = node.output[0]
-            # 2 correct attr of nodes
-            squeeze_axes = sorted(list(node.get_attr("axes").ints))
-            trans_perm = list(trans.get_attr("perm").ints)
-            new_perm, new_squeeze_axes = _calculate_new_attr(ori_perm=trans_perm, ori_squeeze_axes=squeeze_axes)
-            trans.set_attr("perm", new_perm)
-            node.set_attr("axes", new_squeeze_axes)
-            # 3 set shape
-            squeeze_shape = self._g.get_shape(node.output[0])
-            self._g.set_shape(trans.output[0], squeeze_shape)
-            input_shape = self._g.get_shape(node.input[0])
-            if input_shape is not None:
-                new_squeeze_output_shape = [input_shape[i] for i in range(4) if i not in new_squeeze_axes]
-            else:
-                new_squeeze_output_shape = [-1]*4
-                self.logger.warning("%s's shape is unknown, which may interfere further optimization", node.input[0])
-            self._g.set_shape(node.output[0], new_squeeze_output_shape)
-            return True
-        return False
-
-    def _sub_handler(self, trans, node):
-        return self._handle_node_having_branches(node)
+    def _unsqueeze_handler(self, trans, node):
+        perm = trans.get_attr_value("perm")
+        axes = node.get_attr_value("axes")
+        if axes is None:
+            return False
+        out_rank = len(perm) + len(axes)
+        axes = [a + out_rank if a < 0 else a for a in axes]
+        # the new axes stay where they are, the others keep the order given by perm
+        kept = [i for i in range(out_rank) if i not in axes]
+        new_perm = list(range(out_rank))
+        for j, p in enumerate(perm):
+            new_perm[kept[j]] = kept[p]
+        return self._switch_transpose_and_node(node, trans, new_perm)
 
     def _pad_handler(self, trans, node):
-        # [N-start, H-start, W-start, C-start, N-end, H-end,  W-end, C-end]
-        pads = node.get_attr('pads').ints  # [x1_begin, x2_begin...x1_end, x2_end,...]
+        perm = trans.get_attr_value("perm")
+        rank = len(perm)
+        if node.input[0] != trans.output[0] or not self._nodes_has_single_consumer_node([trans]):
+            return False
+        if self._g.opset < 11:
+            # [N-start, H-start, W-start, C-start, N-end, H-end,  W-end, C-end]
+            pads = node.get_attr_value("pads")  # [x1_begin, x2_begin...x1_end, x2_end,...]
+        elif len(node.input) > 1 and node.inputs[1].is_const():
+            # in opset 11, pads is input instead of an attribute.
+            pads = node.inputs[1].get_tensor_value()
+        else:
+            return False
+        if len(pads) != 2 * rank:
+            return False
         # NHWC->NCHW
-        new_pads = [pads[0], pads[3], pads[1], pads[2], pads[4], pads[7], pads[5], pads[6]]
-        node.set_attr("pads", new_pads)
+        new_pads = permute_axes_values(perm, pads[:rank]) + permute_axes_values(perm, pads[rank:])
+        if self._g.opset < 11:
+            node.set_attr("pads", new_pads)
+        else:
+            self._set_const_input(node, 1, np.array(new_pads, dtype=np.int64))
         return self._switch_transpose_and_node(node, trans)
 
-    def _reducemean_handler(self, trans, node):
-        axes = node.get_attr("axes").ints
-        keepdims = node.get_attr("keepdims")
-        # make sure keepdims is 1, then we can do the swap, otherwise, please don't, because
-        # once keepdims is not set, original dims are lost, so transpose back won't work well.
+    def _reduce_handler(self, trans, node):
+        perm = trans.get_attr_value("perm")
+        axes = node.get_attr_value("axes")
+        keepdims = node.get_attr_value("keepdims", 1)
+        if axes is None:
+            axes = list(range(len(perm)))
+        axes = [a + len(perm) if a < 0 else a for a in axes]
+        new_axes = sorted([perm[a] for a in axes])
+        # once keepdims is not set, original dims are lost and the perm of the transpose changes
         # by default, if keepdims is not specified, it is 1
-        if axes == [1, 2] and ((keepdims and keepdims.i == 1) or (not keepdims)):
-            node.set_attr("axes", [2, 3])
+        if keepdims:
+            changed = self._switch_transpose_and_node(node, trans)
+        else:
+            changed = self._switch_transpose_and_node_removing_axes(node, trans, axes)
+        if changed and node.get_attr("axes"):
+            node.set_attr("axes", new_axes)
+        return changed
+
+    def _arg_handler(self, trans, node):
+        perm = trans.get_attr_value("perm")
+        axis = node.get_attr_value("axis", 0)
+        if axis < 0:
+            axis += len(perm)
+        if node.get_attr_value("keepdims", 1):
+            changed = self._switch_transpose_and_node(node, trans)
+        else:
+            changed = self._switch_transpose_and_node_removing_axes(node, trans, [axis])
+        if changed:
+            node.set_attr("axis", perm[axis])
+        return changed
+
+    def _softmax_handler(self, trans, node):
+        # before opset 13 the input is coerced into 2d at axis, which works if the transpose
+        # only reorders the dims before axis and the dims after it among themselves
+        perm = trans.get_attr_value("perm")
+        axis = node.get_attr_value("axis", 1)
+        if axis < 0:
+            axis += len(perm)
+        if sorted(perm[axis:]) != list(range(axis, len(perm))):
+            return False
+        return self._switch_transpose_and_node(node, trans)
+
+    def _gather_handler(self, trans, node):
+        if node.input[0] != trans.output[0]:
+            return False
+        perm = trans.get_attr_value("perm")
+        axis = node.get_attr_value("axis", 0)
+        if axis < 0:
+            axis += len(perm)
+        indices_shape = self._g.get_shape(node.input[1])
+        if indices_shape is None:
+            return False
+        if len(indices_shape) == 0:
+            changed = self._switch_transpose_and_node_removing_axes(node, trans, [axis])
+        elif len(indices_shape) == 1:
+            changed = self._switch_transpose_and_node(node, trans)
+        else:
+            return False
+        if changed:
+            node.set_attr("axis", perm[axis])
+        return changed
+
+    def _tile_handler(self, trans, node):
+        if node.input[0] != trans.output[0] or self._g.opset < 6 or not node.inputs[1].is_const():
+            return False
+        perm = trans.get_attr_value("perm")
+        repeats = node.inputs[1].get_tensor_value(as_list=False)
+        if not self._nodes_has_single_consumer_node([trans]):
+            return False
+        self._set_const_input(node, 1, np.array(permute_axes_values(perm, repeats.tolist()), dtype=repeats.dtype))
+        return self._switch_transpose_and_node(node, trans)
+
+    def _resize_handler(self, trans, node):
+        if node.input[0] != trans.output[0] or not self._nodes_has_single_consumer_node([trans]):
+            return False
+        perm = trans.get_attr_value("perm")
+        rank = len(perm)
+        if node.type == "Upsample" and self._g.opset < 9:
+            scales = node.get_attr_value("scales")
+            if len(scales) != rank:
+                return False
+            node.set_attr("scales", permute_axes_values(perm, scales))
             return self._switch_transpose_and_node(node, trans)
-        return False
+
+        # Upsample-9 and Resize-10 take scales as input 1, Resize-11 takes roi, scales and sizes
+        if node.type == "Upsample" or self._g.opset < 11:
+            per_axis_inputs = [1]
+        else:
+            per_axis_inputs = [1, 2, 3]
+        new_values = {}
+        for i in per_axis_inputs:
+            if i >= len(node.input) or not node.input[i]:
+                continue
+            if node.inputs[i] is None or not node.inputs[i].is_const():
+                return False
+            val = node.inputs[i].get_tensor_value(as_list=False)
+            if val.size == 0:
+                continue
+            if len(val) == rank:
+                new_values[i] = np.array(permute_axes_values(perm, val.tolist()), dtype=val.dtype)
+            elif len(val) == 2 * rank:
+                # roi is [x1_begin, x2_begin...x1_end, x2_end,...]
+                new_values[i] = np.array(permute_axes_values(perm, val[:rank].tolist()) +
+                                         permute_axes_values(perm, val[rank:].tolist()), dtype=val.dtype)
+            else:
+                return False
+        for i, val in new_values.items():
+            self._set_const_input(node, i, val)
+        return self._switch_transpose_and_node(node, trans)
 
     def _slice_handler(self, trans, node):
-        axes = None
+        perm = trans.get_attr_value("perm")
+        if node.input[0] != trans.output[0] or not self._nodes_has_single_consumer_node([trans]):
+            return False
         if self._g.opset < 10:
-            axes = node.get_attr("axes").ints
-            if axes == [0, 1, 2, 3]:
-                node.set_attr("axes", NCHW_TO_NHWC)
-                return self._switch_transpose_and_node(node, trans)
-        else:  # in opset 10, axes is input instead of an attribute.
-            if len(node.inputs) >= 4 and node.inputs[3].is_const():
-                axes = node.inputs[3].get_tensor_value(as_list=True)
-                if axes == [0, 1, 2, 3]:
-                    # axes node might be shared
-                    new_axes = np.array(NCHW_TO_NHWC, dtype=np.int64)
-                    if self._nodes_has_single_consumer_node([node]):
-                        node.inputs[3].set_tensor_value(new_axes)
-                    else:
-                        new_axes_const = self._g.make_const(
-                            utils.make_name(node.inputs[3].name), new_axes
-                        )
-                        self._g.replace_input(node, node.input[3], new_axes_const.output[0])
-                    return self._switch_transpose_and_node(node, trans)
-        return False
+            axes = node.get_attr_value("axes")
+            if axes is None:
+                axes = list(range(len(node.get_attr_value("starts"))))
+            axes = [a + len(perm) if a < 0 else a for a in axes]
+            node.set_attr("axes", [perm[a] for a in axes])
+            return self._switch_transpose_and_node(node, trans)
+
+        # in opset 10, axes is input instead of an attribute.
+        if len(node.input) >= 4:
+            if node.inputs[3] is None or not node.inputs[3].is_const():
+                return False
+            axes = node.inputs[3].get_tensor_value(as_list=True)
+        else:
+            if not node.inputs[1].is_const():
+                return False
+            axes = list(range(len(node.inputs[1].get_tensor_value(as_list=True))))
+        axes = [a + len(perm) if a < 0 else a for a in axes]
+        new_axes = np.array([perm[a] for a in axes], dtype=np.int64)
+        if len(node.input) >= 4:
+            # axes node might be shared
+            self._set_const_input(node, 3, new_axes)
+        else:
+            new_axes_const = self._g.make_const(utils.make_name(node.name + "_axes"), new_axes)
+            node.input.append(new_axes_const.output[0])
+        return self._switch_transpose_and_node(node, trans)
 
     def _simple_through_handler(self, trans, node):
+        if node.input[0] != trans.output[0]:
+            return False
         return self._switch_transpose_and_node(node, trans)
 
     def _shape_handler(self, trans, node):
@@ -588,3 +804,11 @@ class TransposeOptimizer(GraphOptimizerBase):
         self._g.set_shape(gather_node.output[0], output_shape)
         self._g.set_dtype(gather_node.output[0], output_dtype)
         return True
+
+    def _size_handler(self, trans, node):
+        # the number of elements doesn't depend on the layout
+        if not self._nodes_has_single_consumer_node([trans]):
+            return False
+        node.input[0] = trans.input[0]
+        self._g.remove_node(trans.name)
+        return True
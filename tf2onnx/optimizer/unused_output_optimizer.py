@@ -0,0 +1,113 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Unused Output Optimizer.
+   Drop the optional outputs nobody reads, e.g. the Y of an LSTM whose final states are the only ones used,
+   runtimes allocate and fill every output a node declares. Splits with most of their outputs unused are
+   replaced by Slices of the parts that are read.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from .. import schemas, utils
+from .optimizer_base import GraphOptimizerBase
+
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class UnusedOutputOptimizer(GraphOptimizerBase):
+    """Unused Output Optimizer."""
+
+    def __init__(self):  # pylint: disable=useless-super-delegation
+        super(UnusedOutputOptimizer, self).__init__()
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, g):
+        for node in list(g.get_nodes()):
+            if len(node.output) < 2 or not utils.is_onnx_domain(node.domain):
+                continue
+            used = [bool(o) and self._is_used(g, o) for o in node.output]
+            if node.type == "Split":
+                changed = self._split_to_slices(g, node, used)
+            else:
+                changed = self._trim_outputs(g, node, used)
+            if changed:
+                self.graph_been_opt = True
+        return g
+
+    @staticmethod
+    def _is_used(g, name):
+        return name in g.outputs or bool(g.find_output_consumers(name))
+
+    def _trim_outputs(self, g, node, used):
+        # ops unknown to onnx, e.g. ones tf2onnx makes up, have no schema to tell which outputs are optional
+        if not schemas.has_schema(node.type, node.domain):
+            return False
+        schema = schemas.get_schema(node.type, g.opset, node.domain)
+        if schema is None:
+            return False
+        outputs = node.output
+        new_outputs = [o if used[i] or not schema.is_optional_output(i) else utils.ONNX_EMPTY_INPUT
+                       for i, o in enumerate(outputs)]
+        # trailing optional outputs can be left out, the ones before a used output get an empty name
+        while new_outputs and not new_outputs[-1]:
+            new_outputs.pop()
+        if new_outputs == outputs:
+            return False
+        self.logger.debug("drop %d unused outputs of %s", used.count(False), node.name)
+        node.output = new_outputs
+        return True
+
+    def _split_to_slices(self, g, node, used):
+        """Replace a Split by one Slice per output read if at most half of its outputs are read."""
+        if not any(used) or used.count(True) * 2 > len(used) or len(node.input) > 1:
+            return False
+        sizes = self._split_sizes(g, node)
+        if sizes is None:
+            return False
+        axis = node.get_attr_value("axis", 0)
+        starts = np.cumsum([0] + sizes[:-1]).tolist()
+        self.logger.debug("replace %s by %d slices", node.name, used.count(True))
+        outputs = node.output
+        shapes = node.output_shapes
+        dtypes = node.output_dtypes
+        input_name = node.input[0]
+        g.remove_node(node.name)
+        for i, o in enumerate(outputs):
+            if not used[i]:
+                continue
+            if g.opset < 10:
+                g.make_node("Slice", [input_name], attr={"starts": [starts[i]], "ends": [starts[i] + sizes[i]],
+                                                         "axes": [axis]},
+                            outputs=[o], op_name_scope=node.name, shapes=[shapes[i]], dtypes=[dtypes[i]])
+            else:
+                inputs = [input_name]
+                for value in [starts[i], starts[i] + sizes[i], axis]:
+                    const = g.make_const(utils.make_name(node.name + "_slice"), np.array([value], dtype=np.int64))
+                    inputs.append(const.output[0])
+                g.make_node("Slice", inputs, outputs=[o], op_name_scope=node.name,
+                            shapes=[shapes[i]], dtypes=[dtypes[i]])
+        return True
+
+    @staticmethod
+    def _split_sizes(g, node):
+        split = node.get_attr_value("split")
+        if split:
+            return list(split)
+        # equal parts need the length of the split axis, it must agree with the shapes of the outputs
+        shape = g.get_shape(node.input[0])
+        axis = node.get_attr_value("axis", 0)
+        if shape is None or not -len(shape) <= axis < len(shape) or shape[axis] < 0 or \
+                shape[axis] % len(node.output) != 0:
+            return None
+        size = shape[axis] // len(node.output)
+        for o in node.output:
+            out_shape = g.get_shape(o)
+            if out_shape is not None and len(out_shape) == len(shape) and out_shape[axis] not in [-1, size]:
+                return None
+        return [size] * len(node.output)
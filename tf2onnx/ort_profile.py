@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.ort_profile - attribute onnxruntime per node profiling to the tensorflow nodes
+the onnx nodes were converted from.
+
+    g = process_tf_graph(...)
+    g = optimizer.optimize_graph(g)
+    utils.save_protobuf("model.onnx", g.make_model("..."))
+    profile = run_profiled("model.onnx", inputs)
+    print(format_report(attribute_node_times(load_node_times(profile), g)))
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import json
+
+from . import logging
+
+logger = logging.getLogger(__name__)
+
+_KERNEL_TIME_SUFFIX = "_kernel_time"
+
+
+def run_profiled(model_path, inputs, output_names=None, iterations=10, profile_prefix=None):
+    """Run model on onnxruntime with profiling enabled, return the path of the profile json."""
+    import onnxruntime as rt
+    opts = rt.SessionOptions()
+    opts.enable_profiling = True
+    if profile_prefix:
+        opts.profile_file_prefix = profile_prefix
+    session = rt.InferenceSession(model_path, opts)
+    for _ in range(iterations):
+        session.run(output_names, inputs)
+    return session.end_profiling()
+
+
+def load_node_times(profile_path):
+    """Sum the kernel time of every node in an onnxruntime profile, return {node: (op_type, microseconds)}."""
+    with open(profile_path, "r") as f:
+        events = json.load(f)
+    node_times = {}
+    for e in events:
+        name = e.get("name", "")
+        if e.get("cat") != "Node" or not name.endswith(_KERNEL_TIME_SUFFIX):
+            continue
+        name = name[:-len(_KERNEL_TIME_SUFFIX)]
+        op_type, total = node_times.get(name, (e.get("args", {}).get("op_name"), 0))
+        node_times[name] = (op_type, total + e.get("dur", 0))
+    return node_times
+
+
+def _collect_graphs(g):
+    graphs = [g]
+    for node in g.get_nodes():
+        body_graphs = node.get_body_graphs()
+        if body_graphs:
+            for body_graph in body_graphs.values():
+                graphs.extend(_collect_graphs(body_graph))
+    return graphs
+
+
+def attribute_node_times(node_times, g):
+    """
+    Group onnx node times by the tf node they come from.
+    Returns list of dict(tf_node, time_us, share, onnx_nodes) sorted by time, onnx_nodes holds
+    dict(name, op_type, producer, time_us) of every onnx node of the tf node.
+    """
+    graph_of_node = {}
+    for graph in _collect_graphs(g):
+        for node in graph.get_nodes():
+            graph_of_node[node.name] = graph
+
+    groups = collections.OrderedDict()
+    total = sum(t for _, t in node_times.values())
+    for name, (op_type, time_us) in node_times.items():
+        graph = graph_of_node.get(name)
+        if graph is not None:
+            tf_node, producer = graph.get_node_origin(name)
+        else:
+            # onnxruntime renames nodes it fuses, trace them by name in the main graph
+            tf_node, producer = g.get_node_origin(name)
+        tf_node = tf_node or "<unknown>"
+        group = groups.setdefault(tf_node, {"tf_node": tf_node, "time_us": 0, "onnx_nodes": []})
+        group["time_us"] += time_us
+        group["onnx_nodes"].append({"name": name, "op_type": op_type, "producer": producer, "time_us": time_us})
+
+    report = sorted(groups.values(), key=lambda x: -x["time_us"])
+    for group in report:
+        group["share"] = group["time_us"] / total if total else 0.
+        group["onnx_nodes"].sort(key=lambda x: -x["time_us"])
+    return report
+
+
+def format_report(report, top=20):
+    """Format the report as text, tf nodes with the largest share of the latency first."""
+    lines = []
+    for group in report[:top] if top else report:
+        lines.append("{:6.1%} {:>10.0f}us  {}".format(group["share"], group["time_us"], group["tf_node"]))
+        for n in group["onnx_nodes"]:
+            lines.append("        {:>10.0f}us    {} ({}) by {}".format(n["time_us"], n["name"], n["op_type"],
+                                                                      n["producer"] or "-"))
+    return "\n".join(lines)
@@ -0,0 +1,311 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.profiler - record where conversion time and memory go, as chrome trace events.
+
+    with profiler.Profiler(trace_memory=True) as prof:
+        ... convert ...
+    prof.save("profile.json")
+
+The trace opens in chrome://tracing or https://ui.perfetto.dev. Phases are marked in the
+converter with profiler.phase(), which does nothing if no profiler is active.
+
+HandlerStats aggregates the hot path per op handler, rewriter and optimizer handler:
+
+    with profiler.HandlerStats() as stats:
+        ... convert ...
+    print(stats.format_table())
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from . import logging
+
+logger = logging.getLogger(__name__)
+
+_active_profiler = None
+_active_stats = []
+
+
+class _NullSpan(object):
+    """Shared span used while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _count_nodes(graph):
+    """Count nodes of tf2onnx Graph (including subgraphs), GraphDef or tf.Graph."""
+    if graph is None:
+        return None
+    if hasattr(graph, "dump_node_statistics"):
+        return sum(graph.dump_node_statistics().values())
+    if hasattr(graph, "node"):
+        return len(graph.node)
+    if hasattr(graph, "get_operations"):
+        return len(graph.get_operations())
+    return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Span(object):
+    """A phase being recorded. Set graph before leaving to count nodes of a replaced graph."""
+
+    def __init__(self, profiler, name, graph):
+        self.profiler = profiler
+        self.name = name
+        self.graph = graph
+        self.args = {}
+        self.start = None
+        self.memory_peak = 0
+
+    def __enter__(self):
+        self.args["nodes_before"] = _count_nodes(self.graph)
+        self.profiler.push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        self.profiler.pop(self)
+        self.args["nodes_after"] = _count_nodes(self.graph)
+        self.graph = None
+        if exc_type is not None:
+            self.args["exception"] = exc_type.__name__
+        self.profiler.add_event(self, end)
+        return False
+
+
+class Profiler(object):
+    """Record nested conversion phases with wall-clock time, node counts and memory peaks."""
+
+    def __init__(self, trace_memory=False):
+        """Create profiler.
+        Args:
+            trace_memory: record the python allocation peak of each phase with tracemalloc,
+                this slows down conversion noticeably.
+        """
+        self.trace_memory = trace_memory
+        self._events = []
+        self._stack = []
+        self._origin = None
+        self._started_tracemalloc = False
+        self._previous = None
+
+    def __enter__(self):
+        global _active_profiler
+        self._previous = _active_profiler
+        _active_profiler = self
+        self._origin = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active_profiler
+        _active_profiler = self._previous
+        self._previous = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    @property
+    def events(self):
+        return self._events
+
+    def span(self, name, graph=None):
+        return _Span(self, name, graph)
+
+    def push(self, span):
+        if self.trace_memory:
+            # the peak so far belongs to the enclosing phases, then measure the new phase on its own
+            peak = tracemalloc.get_traced_memory()[1]
+            for parent in self._stack:
+                parent.memory_peak = max(parent.memory_peak, peak)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._stack.append(span)
+
+    def pop(self, span):
+        top = self._stack.pop()
+        assert top is span, "profiler phases must be nested"
+        if self.trace_memory:
+            span.memory_peak = max(span.memory_peak, tracemalloc.get_traced_memory()[1])
+            for parent in self._stack:
+                parent.memory_peak = max(parent.memory_peak, span.memory_peak)
+            span.args["tracemalloc_peak_mb"] = round(span.memory_peak / (1024 * 1024), 3)
+
+    def add_event(self, span, end):
+        span.args["peak_rss_mb"] = _peak_rss_mb()
+        self._events.append({
+            "name": span.name,
+            "cat": "tf2onnx",
+            "ph": "X",
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": (end - span.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {k: v for k, v in span.args.items() if v is not None},
+        })
+
+    def to_chrome_trace(self):
+        """Events in chrome trace event format."""
+        return {"traceEvents": sorted(self._events, key=lambda e: e["ts"]), "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f, indent=1)
+        logger.info("Conversion profile is saved at %s", path)
+
+    def summary(self):
+        """Return (name, total seconds, count) of every phase name, slowest first."""
+        totals = {}
+        for e in self._events:
+            total, cnt = totals.get(e["name"], (0, 0))
+            totals[e["name"]] = (total + e["dur"] / 1e6, cnt + 1)
+        return sorted([(k, v[0], v[1]) for k, v in totals.items()], key=lambda x: -x[1])
+
+
+def is_enabled():
+    return _active_profiler is not None
+
+
+def phase(name, graph=None):
+    """
+    Record a phase on the active profiler. Returns a context manager, the span it yields
+    accepts a new graph (span.graph = g) when the phase replaces the graph object.
+    """
+    if _active_profiler is None:
+        return _NULL_SPAN
+    return _active_profiler.span(name, graph)
+
+
+class _Counters(object):
+    """Running totals bumped by Graph, HandlerStats takes deltas of them."""
+
+    def __init__(self):
+        self.nodes_created = 0
+        self.nodes_removed = 0
+        self.shape_inferences = 0
+
+
+counters = _Counters()
+
+
+class _HandlerSpan(object):
+    """One call of a handler, adds its cost to every active HandlerStats."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.created = 0
+        self.removed = 0
+        self.inferences = 0
+
+    def __enter__(self):
+        self.created = counters.nodes_created
+        self.removed = counters.nodes_removed
+        self.inferences = counters.shape_inferences
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start
+        delta = (elapsed, counters.nodes_created - self.created, counters.nodes_removed - self.removed,
+                 counters.shape_inferences - self.inferences)
+        for stats in _active_stats:
+            stats.add(self.name, *delta)
+        return False
+
+
+class HandlerStats(object):
+    """
+    Aggregate call count, time, nodes created, nodes removed and onnx shape inferences
+    per handler. Numbers of a handler include the handlers it calls.
+    """
+
+    _COLUMNS = ["calls", "time", "nodes_created", "nodes_removed", "shape_inferences"]
+
+    def __init__(self):
+        self._stats = {}
+
+    def __enter__(self):
+        _active_stats.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _active_stats.remove(self)
+        return False
+
+    def add(self, name, elapsed, created, removed, inferences):
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = [0, 0., 0, 0, 0]
+            self._stats[name] = entry
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += created
+        entry[3] += removed
+        entry[4] += inferences
+
+    def as_dict(self):
+        """Return {handler: {calls, time, nodes_created, nodes_removed, shape_inferences}}, time in seconds."""
+        return {name: dict(zip(self._COLUMNS, entry)) for name, entry in self._stats.items()}
+
+    def format_table(self, top=None):
+        """Format stats as a table, slowest handler first."""
+        rows = sorted(self._stats.items(), key=lambda x: -x[1][1])
+        if top:
+            rows = rows[:top]
+        width = max([len("handler")] + [len(name) for name, _ in rows])
+        lines = ["{:<{w}} {:>8} {:>10} {:>8} {:>8} {:>8}".format(
+            "handler", "calls", "time(ms)", "created", "removed", "infer", w=width)]
+        for name, (calls, elapsed, created, removed, inferences) in rows:
+            lines.append("{:<{w}} {:>8} {:>10.2f} {:>8} {:>8} {:>8}".format(
+                name, calls, elapsed * 1000, created, removed, inferences, w=width))
+        return "\n".join(lines)
+
+
+def handler_stats_enabled():
+    return bool(_active_stats)
+
+
+def handler(name):
+    """Record one call of a handler on the active HandlerStats, does nothing if none is active."""
+    if not _active_stats:
+        return _NULL_SPAN
+    return _HandlerSpan(name)
@@ -11,7 +11,10 @@ from tf2onnx.rewriter.conv2d_with_pad_rewriter import rewrite_conv2d_with_pad
 from tf2onnx.rewriter.dropout_rewriter import rewrite_dropout
 from tf2onnx.rewriter.eye_rewriter import rewrite_eye
 from tf2onnx.rewriter.flatten_rewriter import rewrite_flatten
+from tf2onnx.rewriter.gelu_rewriter import rewrite_gelu
 from tf2onnx.rewriter.gemm_rewriter import rewrite_gemm
+from tf2onnx.rewriter.layer_norm_rewriter import rewrite_layer_norm
+from tf2onnx.rewriter.layout_rewriter import rewrite_layout
 from tf2onnx.rewriter.leakyrelu_rewriter import rewrite_leakyrelu
 from tf2onnx.rewriter.random_normal_rewriter import rewrite_random_normal
 from tf2onnx.rewriter.random_uniform import rewrite_random_uniform, rewrite_random_uniform_fold_const
@@ -27,7 +30,10 @@ __all__ = [
     "rewrite_dropout",
     "rewrite_eye",
     "rewrite_flatten",
+    "rewrite_gelu",
     "rewrite_gemm",
+    "rewrite_layer_norm",
+    "rewrite_layout",
     "rewrite_leakyrelu",
     "rewrite_random_normal",
     "rewrite_random_uniform",
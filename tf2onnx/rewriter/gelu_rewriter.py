@@ -0,0 +1,132 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.rewriter - rewrite tensorflow gelu subgraph to Gelu and FastGelu op of ms domain
+"""
+
+import numpy as np
+from onnx import onnx_pb
+
+from tf2onnx import constants, logging, utils
+from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
+
+logger = logging.getLogger(__name__)
+
+
+# pylint: disable=missing-docstring
+
+# dtypes supported by the Gelu and FastGelu kernels of onnxruntime
+_GELU_DTYPES = [onnx_pb.TensorProto.FLOAT, onnx_pb.TensorProto.FLOAT16]
+
+
+def rewrite_gelu(g, ops):
+    # Gelu and FastGelu are only known by the ms domain
+    if not any(opset.domain == constants.MICROSOFT_DOMAIN for opset in g.extra_opset or []):
+        return ops
+
+    # 1 + erf(x / sqrt(2)), the division might be a multiplication with 1 / sqrt(2)
+    erf_patterns = [
+        OpTypePattern('Add|AddV2', name='one_plus', inputs=[
+            OpTypePattern('Const', name='one'),
+            OpTypePattern('Erf', inputs=[
+                OpTypePattern(op_type, name='scale_x', inputs=[
+                    OpTypePattern('*', name='x_1'),
+                    OpTypePattern('Const', name='scale')
+                ])
+            ])
+        ]) for op_type in ['RealDiv', 'Mul']
+    ]
+    # 1 + tanh(sqrt(2 / pi) * (x + 0.044715 * x^3))
+    tanh_pattern = \
+        OpTypePattern('Add|AddV2', name='one_plus', inputs=[
+            OpTypePattern('Const', name='one'),
+            OpTypePattern('Tanh', inputs=[
+                OpTypePattern('Mul', inputs=[
+                    OpTypePattern('Const', name='scale'),
+                    OpTypePattern('Add|AddV2', inputs=[
+                        OpTypePattern('*', name='x_1'),
+                        OpTypePattern('Mul', inputs=[
+                            OpTypePattern('Const', name='coeff'),
+                            OpTypePattern('Pow', name='pow', inputs=[
+                                OpTypePattern('*', name='x_2'),
+                                OpTypePattern('Const', name='exponent')
+                            ])
+                        ])
+                    ])
+                ])
+            ])
+        ])
+
+    # x * 0.5 * (1 + f(x)) in the orders of bert, tf.nn.gelu and the like
+    def _gelu_patterns(one_plus):
+        return [
+            OpTypePattern('Mul', name='output', inputs=[
+                OpTypePattern('*', name='x'),
+                OpTypePattern('Mul', inputs=[OpTypePattern('Const', name='half'), one_plus])
+            ]),
+            OpTypePattern('Mul', name='output', inputs=[
+                OpTypePattern('Mul', inputs=[OpTypePattern('Const', name='half'), OpTypePattern('*', name='x')]),
+                one_plus
+            ]),
+            OpTypePattern('Mul', name='output', inputs=[
+                OpTypePattern('Const', name='half'),
+                OpTypePattern('Mul', inputs=[OpTypePattern('*', name='x'), one_plus])
+            ]),
+        ]
+
+    pattern_list = [(p, "Gelu") for erf_pattern in erf_patterns for p in _gelu_patterns(erf_pattern)]
+    pattern_list += [(p, "FastGelu") for p in _gelu_patterns(tanh_pattern)]
+    for pattern, op_type in pattern_list:
+        matcher = GraphMatcher(pattern, allow_reorder=True)
+        match_results = list(matcher.match_ops(ops))
+        for match in match_results:
+            output_node = match.get_op('output')
+            if output_node.graph is None:
+                continue
+            x = _get_gelu_input(match, op_type)
+            if x is None or g.get_dtype(x) not in _GELU_DTYPES:
+                continue
+            logger.debug("rewrite %s ending with %s", op_type, output_node.name)
+            output = output_node.output[0]
+            shape = g.get_shape(output)
+            dtype = g.get_dtype(output)
+            g.remove_node(output_node.name)
+            # the node is mapped to the ms domain by its handler
+            g.make_node(op_type, [x], outputs=[output], name=output_node.name, skip_conversion=False,
+                        shapes=[shape], dtypes=[dtype])
+            utils.remove_unused_nodes(g, match.get_nodes())
+    return g.get_nodes()
+
+
+def _is_const_value(node, value):
+    val = node.get_tensor_value(as_list=False)
+    return val.size == 1 and np.isclose(val.flatten()[0], value, rtol=1e-4)
+
+
+def _get_gelu_input(match, op_type):
+    """Check the constants and that every x of the match is the same tensor, return the input or None."""
+    x_names = set()
+    for name in ['x', 'x_1', 'x_2']:
+        x_node = match.get_op(name)
+        if x_node is not None:
+            x_names.update(utils.find_edge_name_between_nodes(x_node, n) for n in match.get_nodes()
+                           if set(x_node.output).intersection(n.input))
+    if len(x_names) != 1:
+        return None
+    x = x_names.pop()
+
+    if not _is_const_value(match.get_op('half'), 0.5) or not _is_const_value(match.get_op('one'), 1.0):
+        return None
+    scale = match.get_op('scale')
+    if op_type == "Gelu":
+        if match.get_op('scale_x').type == "RealDiv":
+            if match.get_op('scale_x').input[0] != x or not _is_const_value(scale, np.sqrt(2)):
+                return None
+        elif not _is_const_value(scale, np.sqrt(0.5)):
+            return None
+        return x
+    if not _is_const_value(scale, np.sqrt(2 / np.pi)) or not _is_const_value(match.get_op('coeff'), 0.044715) or \
+            not _is_const_value(match.get_op('exponent'), 3) or match.get_op('pow').input[0] != x:
+        return None
+    return x
@@ -0,0 +1,276 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.rewriter - rewrite tensorflow layer normalization subgraph to onnx LayerNormalization op or to the form
+onnxruntime fuses into it
+"""
+
+import numpy as np
+from onnx import onnx_pb
+
+from tf2onnx import logging, utils
+from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
+
+logger = logging.getLogger(__name__)
+
+
+# pylint: disable=missing-docstring
+
+# dtypes of LayerNormalization-17 onnxruntime has kernels for
+_FUSED_DTYPES = [onnx_pb.TensorProto.FLOAT, onnx_pb.TensorProto.FLOAT16, onnx_pb.TensorProto.DOUBLE]
+
+
+def rewrite_layer_norm(g, ops):
+    if g.opset < 7:
+        return ops
+
+    # pattern0: tf.nn.moments followed by tf.nn.batch_normalization, used by tf.contrib.layers.layer_norm
+    # and keras LayerNormalization: x * (rsqrt(variance + epsilon) * gamma) + (beta - mean * (...))
+    pattern0 = \
+        OpTypePattern('Add|AddV2', name='output', inputs=[
+            OpTypePattern('Mul', name='mul_x', inputs=[
+                OpTypePattern('*', name='x'),
+                OpTypePattern('Mul', name='scale', inputs=[
+                    OpTypePattern('Rsqrt', name='rsqrt', inputs=[
+                        OpTypePattern('Add|AddV2', name='add_epsilon', inputs=[
+                            OpTypePattern('Mean', name='variance'),
+                            OpTypePattern('Const', name='epsilon')
+                        ])
+                    ]),
+                    OpTypePattern('*', name='gamma')
+                ])
+            ]),
+            OpTypePattern('Sub', name='sub', inputs=[
+                OpTypePattern('*', name='beta'),
+                OpTypePattern('Mul', name='mul_mean', inputs=[
+                    OpTypePattern('Mean', name='mean'),
+                    OpTypePattern('Mul', name='scale_1')
+                ])
+            ])
+        ])
+
+    # pattern1: (x - mean) * rsqrt(variance + epsilon) * gamma + beta
+    # pattern2: (x - mean) / sqrt(variance + epsilon) * gamma + beta
+    def _normalized_pattern(op_type, root_op_type):
+        return \
+            OpTypePattern('Add|AddV2', name='output', inputs=[
+                OpTypePattern('Mul', name='mul_gamma', inputs=[
+                    OpTypePattern(op_type, name='normalized', inputs=[
+                        OpTypePattern('Sub', name='centered', inputs=[
+                            OpTypePattern('*', name='x'),
+                            OpTypePattern('Mean', name='mean')
+                        ]),
+                        OpTypePattern(root_op_type, name='rsqrt', inputs=[
+                            OpTypePattern('Add|AddV2', name='add_epsilon', inputs=[
+                                OpTypePattern('Mean', name='variance'),
+                                OpTypePattern('Const', name='epsilon')
+                            ])
+                        ])
+                    ]),
+                    OpTypePattern('*', name='gamma')
+                ]),
+                OpTypePattern('*', name='beta')
+            ])
+
+    pattern_list = [pattern0, _normalized_pattern('Mul', 'Rsqrt'), _normalized_pattern('RealDiv', 'Sqrt')]
+    for pattern in pattern_list:
+        matcher = GraphMatcher(pattern, allow_reorder=True)
+        match_results = list(matcher.match_ops(ops))
+        for match in match_results:
+            output_node = match.get_op('output')
+            if output_node.graph is None:
+                # consumed by a layer norm rewritten before
+                continue
+            layer_norm = _get_layer_norm_params(g, match)
+            if layer_norm is None:
+                continue
+            x, axes, epsilon, gamma, beta = layer_norm
+            if g.get_shape(x) is None and min(axes) < 0 and g.opset < 11:
+                # ReduceMean takes negative axes since opset 11
+                continue
+            logger.debug("rewrite layer norm ending with %s", output_node.name)
+            # the new nodes take over the output name, so the shape and dtype need to be saved first
+            scope = output_node.name
+            output = output_node.output[0]
+            shape = g.get_shape(output)
+            dtype = g.get_dtype(output)
+            g.remove_node(output_node.name)
+            if _can_fuse(g, x, axes, gamma, beta):
+                g.make_node("LayerNormalization", [x, gamma, beta], outputs=[output], op_name_scope=scope,
+                            attr={"axis": _normalized_axis(g, x, axes), "epsilon": epsilon},
+                            shapes=[shape], dtypes=[dtype])
+            else:
+                _make_layer_norm(g, x, axes, epsilon, gamma, beta, output, shape, scope)
+            utils.remove_unused_nodes(g, match.get_nodes())
+    return g.get_nodes()
+
+
+def _skip_stop_gradient(g, name):
+    node = g.get_node_by_output(name)
+    while node is not None and node.type in ["StopGradient", "Identity"]:
+        name = node.input[0]
+        node = g.get_node_by_output(name)
+    return name
+
+
+def _get_mean_axes(node, x):
+    """Return the axes if node is a Mean over const axes of x keeping dims, otherwise None."""
+    if node.type != "Mean" or node.input[0] != x or not node.get_attr_value("keep_dims") or \
+            not node.inputs[1].is_const():
+        return None
+    axes = node.inputs[1].get_tensor_value(as_list=False).flatten().tolist()
+    return sorted(axes) if axes else None
+
+
+def _get_layer_norm_params(g, match):
+    """Check the matched subgraph is a layer norm, return (x, axes, epsilon, gamma, beta) or None."""
+    mean = match.get_op('mean')
+    variance = match.get_op('variance')
+    x = mean.input[0]
+    axes = _get_mean_axes(mean, x)
+    if axes is None:
+        return None
+
+    # variance is mean((x - mean)^2), the mean can be wrapped by StopGradient
+    squared = variance.inputs[0]
+    if squared.type == "SquaredDifference":
+        diff_inputs = [_skip_stop_gradient(g, inp) for inp in squared.input]
+        if sorted(diff_inputs) != sorted([x, mean.output[0]]):
+            return None
+    elif squared.type in ["Square", "Mul"]:
+        # x - mean may be computed again for the variance
+        if any(inp.type != "Sub" or inp.input != [x, mean.output[0]] for inp in squared.inputs):
+            return None
+    else:
+        return None
+    if _get_mean_axes(variance, squared.output[0]) != axes:
+        return None
+
+    epsilon = match.get_op('epsilon').get_tensor_value(as_list=False)
+    if epsilon.size != 1:
+        return None
+    gamma = match.get_op('gamma').output[0]
+    beta = match.get_op('beta').output[0]
+    rsqrt = match.get_op('rsqrt')
+
+    if match.get_op('sub') is not None:
+        # pattern0, scale is used by both branches and beta is the minuend
+        scale = match.get_op('scale')
+        mul_x = match.get_op('mul_x')
+        if match.get_op('scale_1') != scale or x not in mul_x.input or \
+                match.get_op('sub').input != [beta, match.get_op('mul_mean').output[0]]:
+            return None
+        gamma = [inp for inp in scale.input if inp != rsqrt.output[0]][0]
+    else:
+        centered = match.get_op('centered')
+        normalized = match.get_op('normalized')
+        if centered.input != [x, mean.output[0]] or normalized.input[0] != centered.output[0]:
+            return None
+    return x, axes, float(epsilon.flatten()[0]), gamma, beta
+
+
+def _normalized_axis(g, x, axes):
+    """Return the first normalized axis if axes are the trailing dims of x, otherwise None."""
+    rank = len(g.get_shape(x)) if g.get_shape(x) is not None else None
+    if rank is not None:
+        axes = sorted(a + rank if a < 0 else a for a in axes)
+        if axes == list(range(rank - len(axes), rank)):
+            return axes[0]
+    elif axes == list(range(-len(axes), 0)):
+        return axes[0]
+    return None
+
+
+def _can_fuse(g, x, axes, gamma, beta):
+    # LayerNormalization is an onnx op since opset 17
+    if g.opset < 17:
+        return False
+    if g.get_dtype(x) not in _FUSED_DTYPES or _normalized_axis(g, x, axes) is None:
+        return False
+    # the kernel takes gamma and beta with the shape of the normalized dims, it doesn't broadcast them
+    x_shape = g.get_shape(x)
+    norm_shape = x_shape[len(x_shape) - len(axes):]
+    if any(d < 0 for d in norm_shape):
+        return False
+
+    def _strip(shape):
+        while shape and shape[0] == 1:
+            shape = shape[1:]
+        return shape
+
+    for name in [gamma, beta]:
+        shape = g.get_shape(name)
+        if shape is None or g.get_dtype(name) != g.get_dtype(x) or _strip(shape) != _strip(norm_shape):
+            return False
+    return True
+
+
+def _make_layer_norm(g, x, axes, epsilon, gamma, beta, output, output_shape, scope):
+    # onnxruntime's LayerNormFusion looks for exactly this form
+    dtype = g.get_dtype(x)
+    np_dtype = utils.map_onnx_to_numpy_type(dtype)
+    shape = g.get_shape(x)
+    mean_shape = None
+    if shape is not None:
+        # ReduceMean takes negative axes since opset 11
+        axes = [a + len(shape) if a < 0 else a for a in axes]
+        mean_shape = [1 if i in axes else d for i, d in enumerate(shape)]
+
+    def _make_node(op_type, inputs, attr=None, shape=shape, outputs=None):
+        return g.make_node(op_type, inputs, attr=attr, outputs=outputs, op_name_scope=scope,
+                           shapes=[shape], dtypes=[dtype]).output[0]
+
+    two = g.make_const(utils.make_name(scope + "_two"), np.array(2, dtype=np_dtype)).output[0]
+    eps = g.make_const(utils.make_name(scope + "_epsilon"), np.array(epsilon, dtype=np_dtype)).output[0]
+    mean = _make_node("ReduceMean", [x], attr={"axes": axes, "keepdims": 1}, shape=mean_shape)
+    centered = _make_node("Sub", [x, mean])
+    variance = _make_node("ReduceMean", [_make_node("Pow", [centered, two])], attr={"axes": axes, "keepdims": 1},
+                          shape=mean_shape)
+    std = _make_node("Sqrt", [_make_node("Add", [variance, eps], shape=mean_shape)], shape=mean_shape)
+    normalized = _make_node("Div", [centered, std])
+    scaled = _make_node("Mul", [normalized, gamma], shape=output_shape)
+    _make_node("Add", [scaled, beta], shape=output_shape, outputs=[output])
+
+
+def _split_inputs(node, op_type):
+    """Return the input node of op_type of a binary node and the name of the other input, or (None, None)."""
+    for i in range(2):
+        if node.inputs[i] is not None and node.inputs[i].type == op_type:
+            return node.inputs[i], node.input[1 - i]
+    return None, None
+
+
+def match_layer_norm(g, node):
+    """Check node ends the form _make_layer_norm emits, (x - mean) / sqrt(variance + epsilon) * gamma + beta.
+       Return (x, axes, epsilon, gamma, beta, nodes) with the nodes of the form from ReduceMean on, or None."""
+    if node.type != "Add":
+        return None
+    scaled, beta = _split_inputs(node, "Mul")
+    if scaled is None:
+        return None
+    normalized, gamma = _split_inputs(scaled, "Div")
+    if normalized is None:
+        return None
+    centered, std = normalized.inputs
+    if centered.type != "Sub" or std.type != "Sqrt" or std.inputs[0].type != "Add":
+        return None
+    add_epsilon = std.inputs[0]
+    variance, epsilon = add_epsilon.inputs
+    if variance.type != "ReduceMean" or not epsilon.is_const():
+        return None
+    epsilon = epsilon.get_tensor_value(as_list=False)
+    power = variance.inputs[0]
+    if epsilon.size != 1 or power.type != "Pow" or power.input[0] != centered.output[0] or \
+            not power.inputs[1].is_const() or power.inputs[1].get_tensor_value(as_list=False).tolist() != 2:
+        return None
+    x = centered.input[0]
+    mean = centered.inputs[1]
+    if mean.type != "ReduceMean" or mean.input[0] != x:
+        return None
+    axes = mean.get_attr_value("axes")
+    if variance.get_attr_value("axes") != axes or \
+            any(n.get_attr_value("keepdims", 1) != 1 for n in [mean, variance]):
+        return None
+    nodes = [mean, centered, power, variance, add_epsilon, std, normalized, scaled, node]
+    return x, axes, float(epsilon.flatten()[0]), gamma, beta, nodes
@@ -0,0 +1,370 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.rewriter - plan the data layout of NHWC regions before the op handlers run
+
+The conv, pool and batchnorm handlers wrap every NHWC op in its own pair of transposes.
+This rewriter groups the layout sensitive ops with the layout agnostic ops connecting them
+into regions and, if it is cheaper, switches a whole region to NCHW so the handlers emit no
+transposes inside of it. Transposes are only added at the region boundaries.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from tf2onnx import constants, logging, utils
+
+logger = logging.getLogger(__name__)
+
+
+# pylint: disable=missing-docstring
+
+# layout sensitive ops: data inputs and the attributes given in NHWC order
+_SENSITIVE_OPS = {
+    "Conv2D": ([0], ["strides", "dilations"]),
+    "Conv2DBackpropInput": ([2], ["strides", "dilations"]),
+    "DepthwiseConv2d": ([0], ["strides", "dilations"]),
+    "DepthwiseConv2dNative": ([0], ["strides", "dilations"]),
+    "MaxPool": ([0], ["ksize", "strides"]),
+    "AvgPool": ([0], ["ksize", "strides"]),
+    "FusedBatchNorm": ([0], []),
+    "FusedBatchNormV2": ([0], []),
+    "BiasAdd": ([0], []),
+    "SpaceToDepth": ([0], []),
+    "DepthToSpace": ([0], []),
+}
+
+_UNARY_OPS = ["Abs", "Cast", "Ceil", "Elu", "Erf", "Exp", "Floor", "Identity", "LeakyRelu", "Log", "Neg",
+              "Reciprocal", "Relu", "Relu6", "Round", "Rsqrt", "Selu", "Sigmoid", "Sign", "Softplus", "Softsign",
+              "Sqrt", "Square", "Tanh"]
+
+_BROADCAST_OPS = ["Add", "AddN", "AddV2", "Div", "Maximum", "Minimum", "Mul", "Pow", "RealDiv", "Sub",
+                  "SquaredDifference"]
+
+_REDUCE_OPS = ["Max", "Mean", "Min", "Prod", "Sum"]
+
+_PAD_OPS = ["MirrorPad", "Pad", "PadV2"]
+
+
+def _nchw_axis(axis):
+    """Position of the NHWC axis in the NCHW tensor."""
+    return constants.NCHW_TO_NHWC[axis % 4]
+
+
+def _to_nchw(shape):
+    return [shape[i] for i in constants.NHWC_TO_NCHW]
+
+
+def _is_rank4(g, name):
+    shape = g.get_shape(name)
+    return shape is not None and len(shape) == 4
+
+
+def _size(shape):
+    """Element count used as cost of a transpose, unknown dims count as 1."""
+    return int(np.prod([max(d, 1) for d in shape]))
+
+
+def _keeps_order(removed_axes):
+    """True if dropping the axes gives the same tensor for NHWC and NCHW input."""
+    kept = set(range(4)) - set(a % 4 for a in removed_axes)
+    return not (3 in kept and (1 in kept or 2 in kept))
+
+
+def _const_axes(node, idx):
+    if len(node.input) <= idx or not node.inputs[idx].is_const():
+        return None
+    return np.atleast_1d(node.inputs[idx].get_tensor_value(as_list=False)).tolist()
+
+
+def _squeeze_attr(node):
+    for name in ["squeeze_dims", "axis"]:
+        attr = node.get_attr(name)
+        if attr and attr.ints:
+            return name, list(attr.ints)
+    return None, None
+
+
+def _layout_io(g, node):
+    """Return (data input indices, data output indices) of a node that can run in NCHW, else None."""
+    if node.need_skip() or any(o in g.outputs for o in node.output):
+        return None
+    op = node.type
+    if op in _SENSITIVE_OPS:
+        inputs = _SENSITIVE_OPS[op][0]
+        if not node.is_nhwc():
+            return None
+        # MaxPoolV2 style ksize and strides inputs are not planned
+        if op in ["MaxPool", "AvgPool"] and len(node.input) != 1:
+            return None
+        # the NCHW BiasAdd handler reshapes a const bias only
+        if op == "BiasAdd" and (g.opset < 7 or not node.inputs[1].is_const()):
+            return None
+        if not (_is_rank4(g, node.input[inputs[0]]) and _is_rank4(g, node.output[0])):
+            return None
+        return inputs, [0]
+
+    if op in _UNARY_OPS:
+        if _is_rank4(g, node.input[0]) and _is_rank4(g, node.output[0]):
+            return [0], [0]
+        return None
+
+    if op in _BROADCAST_OPS:
+        if not _is_rank4(g, node.output[0]):
+            return None
+        inputs = []
+        for i, inp in enumerate(node.inputs):
+            shape = g.get_shape(node.input[i])
+            if inp and inp.is_const():
+                if inp.get_tensor_value(as_list=False).ndim > 4:
+                    return None
+            elif shape is not None and len(shape) == 4:
+                inputs.append(i)
+            elif shape is None or any(d != 1 for d in shape):
+                return None
+        return (inputs, [0]) if inputs else None
+
+    if op == "ConcatV2":
+        inputs = list(range(len(node.input) - 1))
+        if _const_axes(node, len(node.input) - 1) is None or not _is_rank4(g, node.output[0]) or \
+                not all(_is_rank4(g, node.input[i]) for i in inputs):
+            return None
+        return inputs, [0]
+
+    if op in _PAD_OPS:
+        if node.inputs[1].is_const() and _is_rank4(g, node.input[0]):
+            return [0], [0]
+        return None
+
+    if op in _REDUCE_OPS:
+        axes = _const_axes(node, 1)
+        if axes is None or not _is_rank4(g, node.input[0]):
+            return None
+        keep_dims = node.get_attr("keep_dims")
+        if keep_dims and keep_dims.i:
+            return [0], [0]
+        # the reduced tensor leaves the region
+        return ([0], []) if _keeps_order(axes) else None
+
+    if op == "Squeeze":
+        _, dims = _squeeze_attr(node)
+        if dims and _is_rank4(g, node.input[0]) and _keeps_order(dims):
+            return [0], []
+        return None
+
+    return None
+
+
+def _body_graph_inputs(ops):
+    """Names consumed by nodes of body graphs, these tensors keep their layout."""
+    names = set()
+    for node in ops:
+        for body_graph in (node.get_body_graphs() or {}).values():
+            body_ops = body_graph.get_nodes()
+            for n in body_ops:
+                names.update(n.input)
+            names.update(_body_graph_inputs(body_ops))
+    return names
+
+
+def _nchw_source(g, name):
+    """If name is the output of a NCHW to NHWC transpose, return the NCHW tensor."""
+    node = g.get_node_by_output(name, search_in_parent_graphs=False)
+    if node is None or node.type != "Transpose":
+        return None
+    if len(node.input) > 1:
+        perm = node.inputs[1].get_tensor_value() if node.inputs[1].is_const() else None
+    else:
+        perm = node.get_attr_value("perm")
+    if perm is None or list(perm) != constants.NCHW_TO_NHWC:
+        return None
+    return node.input[0]
+
+
+def _find_regions(g, ops):
+    """Group nodes that can run in NCHW and are connected through their data tensors."""
+    io = {}
+    for node in ops:
+        node_io = _layout_io(g, node)
+        if node_io:
+            io[node.name] = (node, node_io[0], node_io[1])
+
+    # tensors used inside of loops and conds keep the tf layout
+    body_inputs = _body_graph_inputs(ops)
+    for name in list(io):
+        if any(o in body_inputs for o in io[name][0].output):
+            del io[name]
+
+    parent = {name: name for name in io}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for name, (node, inputs, _) in io.items():
+        for i in inputs:
+            producer = g.get_node_by_output(node.input[i], search_in_parent_graphs=False)
+            if producer is None or producer.name not in io:
+                continue
+            _, _, producer_outputs = io[producer.name]
+            if node.input[i] in [producer.output[j] for j in producer_outputs]:
+                parent[find(name)] = find(producer.name)
+
+    regions = {}
+    for name, value in io.items():
+        regions.setdefault(find(name), []).append(value)
+    return [r for r in regions.values() if any(node.type in _SENSITIVE_OPS for node, _, _ in r)]
+
+
+def _region_boundary(region, consumers):
+    """Return the tensors entering and leaving the region."""
+    names = {node.name: inputs for node, inputs, _ in region}
+    outputs = set(node.output[j] for node, _, node_outputs in region for j in node_outputs)
+    entering = []
+    leaving = []
+    for node, inputs, node_outputs in region:
+        for i in inputs:
+            if node.input[i] not in outputs and node.input[i] not in entering:
+                entering.append(node.input[i])
+        for j in node_outputs:
+            name = node.output[j]
+            # consumers outside of the region, or using the tensor as a non data input
+            outside = [c for c in consumers.get(name, [])
+                       if c.name not in names or
+                       any(inp == name and k not in names[c.name] for k, inp in enumerate(c.input))]
+            if outside:
+                leaving.append((name, outside))
+    return entering, leaving
+
+
+def _region_costs(g, region, entering, leaving):
+    """Return the transposed elements of (the handlers' transposes, the region boundary transposes)."""
+    keep_cost = 0
+    for node, inputs, node_outputs in region:
+        if node.type not in _SENSITIVE_OPS:
+            continue
+        for i in inputs:
+            if not node.inputs[i].is_const():
+                keep_cost += _size(g.get_shape(node.input[i]))
+        for j in node_outputs:
+            keep_cost += _size(g.get_shape(node.output[j]))
+
+    plan_cost = 0
+    for name in entering:
+        producer = g.get_node_by_output(name, search_in_parent_graphs=False)
+        if (producer and producer.is_const()) or _nchw_source(g, name):
+            continue
+        plan_cost += _size(g.get_shape(name))
+    for name, _ in leaving:
+        plan_cost += _size(g.get_shape(name))
+    return keep_cost, plan_cost
+
+
+def _make_const_like(g, node, val):
+    return g.make_const(utils.make_name(node.name), val).output[0]
+
+
+def _rewrite_node(g, node):
+    """Switch the attributes and const inputs of a node from NHWC to NCHW."""
+    op = node.type
+    if op in _SENSITIVE_OPS:
+        for name in _SENSITIVE_OPS[op][1]:
+            attr = node.get_attr(name)
+            if attr and len(attr.ints) == 4:
+                node.set_attr(name, _to_nchw(list(attr.ints)))
+        node.data_format = "NCHW"
+    elif op in _BROADCAST_OPS:
+        for i, inp in enumerate(node.inputs):
+            if not (inp and inp.is_const()):
+                continue
+            val = inp.get_tensor_value(as_list=False)
+            if val.ndim == 0 or val.size == 1:
+                continue
+            val = val.reshape([1] * (4 - val.ndim) + list(val.shape)).transpose(constants.NHWC_TO_NCHW)
+            node.input[i] = _make_const_like(g, inp, val)
+    elif op == "ConcatV2":
+        axis = node.inputs[-1].get_tensor_value(as_list=False)
+        node.input[-1] = _make_const_like(g, node.inputs[-1], np.array(_nchw_axis(int(axis)), dtype=axis.dtype))
+    elif op in _PAD_OPS:
+        paddings = node.inputs[1].get_tensor_value(as_list=False)
+        node.input[1] = _make_const_like(g, node.inputs[1], paddings[constants.NHWC_TO_NCHW])
+    elif op in _REDUCE_OPS:
+        axes = node.inputs[1].get_tensor_value(as_list=False)
+        new_axes = np.array(sorted(_nchw_axis(a) for a in np.atleast_1d(axes).tolist()), dtype=axes.dtype)
+        node.input[1] = _make_const_like(g, node.inputs[1], new_axes.reshape(axes.shape))
+    elif op == "Squeeze":
+        name, dims = _squeeze_attr(node)
+        node.set_attr(name, sorted(_nchw_axis(a) for a in dims))
+
+
+def _convert_region(g, region, entering, leaving):
+    """Run the region in NCHW, transpose the tensors entering and leaving it."""
+    replaced = set()
+    new_inputs = {}
+    for name in entering:
+        producer = g.get_node_by_output(name, search_in_parent_graphs=False)
+        nchw = _nchw_source(g, name)
+        if nchw:
+            # e.g. an input of --inputs-as-nchw, use the NCHW tensor itself
+            new_inputs[name] = nchw
+            replaced.add(producer.name)
+        elif producer and producer.is_const():
+            val = producer.get_tensor_value(as_list=False)
+            new_inputs[name] = _make_const_like(g, producer, val.transpose(constants.NHWC_TO_NCHW))
+            replaced.add(producer.name)
+        else:
+            transpose = g.make_node("Transpose", [name], attr={"perm": constants.NHWC_TO_NCHW},
+                                    shapes=[_to_nchw(g.get_shape(name))], dtypes=[g.get_dtype(name)],
+                                    op_name_scope=utils.node_name(name))
+            new_inputs[name] = transpose.output[0]
+
+    for node, inputs, _ in region:
+        for i in inputs:
+            if node.input[i] in new_inputs:
+                node.input[i] = new_inputs[node.input[i]]
+
+    layouts = {node.name: inputs for node, inputs, _ in region}
+    for name, outside in leaving:
+        producer = g.get_node_by_output(name, search_in_parent_graphs=False)
+        transpose = g.make_node("Transpose", [name], attr={"perm": constants.NCHW_TO_NHWC},
+                                shapes=[g.get_shape(name)], dtypes=[g.get_dtype(name)],
+                                op_name_scope=producer.name)
+        for consumer in outside:
+            for k, inp in enumerate(consumer.input):
+                if inp == name and k not in layouts.get(consumer.name, []):
+                    consumer.input[k] = transpose.output[0]
+
+    for node, _, node_outputs in region:
+        for j in node_outputs:
+            g.set_shape(node.output[j], _to_nchw(g.get_shape(node.output[j])))
+        _rewrite_node(g, node)
+
+    # drop the transposes and consts that are not used anymore
+    for name in replaced:
+        node = g.get_node_by_name(name)
+        if node and not any(g.find_output_consumers(o) or o in g.outputs for o in node.output):
+            g.remove_node(name)
+
+
+def rewrite_layout(g, ops):
+    """Run regions of NHWC ops in NCHW where that needs fewer transposed elements than the handlers."""
+    consumers = {}
+    for node in ops:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node)
+
+    for region in _find_regions(g, ops):
+        entering, leaving = _region_boundary(region, consumers)
+        keep_cost, plan_cost = _region_costs(g, region, entering, leaving)
+        logger.debug("layout region of %d nodes: %d transposed elements in NHWC, %d in NCHW",
+                     len(region), keep_cost, plan_cost)
+        if plan_cost >= keep_cost:
+            continue
+        _convert_region(g, region, entering, leaving)
+    return g.get_nodes()
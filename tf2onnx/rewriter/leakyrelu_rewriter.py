@@ -5,6 +5,7 @@
 tf2onnx.rewriter - rewrite tensorflow subgraph to onnx leakyrelu op
 """
 
+from tf2onnx import utils
 from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
 
 
@@ -32,8 +33,8 @@ def rewrite_leakyrelu(g, ops):
         mul_node = match.get_op("mul")
         mul_input_node = match.get_op('mul_input')
 
-        max_input_edge_name = _find_edge_name_between_nodes(max_input_node, max_node)
-        mul_input_edge_name = _find_edge_name_between_nodes(mul_input_node, mul_node)
+        max_input_edge_name = utils.find_edge_name_between_nodes(max_input_node, max_node)
+        mul_input_edge_name = utils.find_edge_name_between_nodes(mul_input_node, mul_node)
         if max_input_edge_name == mul_input_edge_name:
             alpha = match.get_op("alpha").get_tensor_value()
             if alpha >= 1:
@@ -46,12 +47,3 @@ def rewrite_leakyrelu(g, ops):
             g.safe_remove_nodes(to_delete)
 
     return ops
-
-
-def _find_edge_name_between_nodes(src_node, consumer_node):
-    # find the first edge connection between two nodes.
-    for consumer_end in consumer_node.input:
-        for src_end in src_node.output:
-            if consumer_end == src_end:
-                return consumer_end
-    return None
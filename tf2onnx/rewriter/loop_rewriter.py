@@ -45,6 +45,9 @@ class LoopRewriter(LoopRewriterBase):
             cell_g_info = context.cell_graph
             cond_g_info = context.cond_graph
 
+            if self._is_scan_loop(context):
+                return self._rewrite_as_scan(context)
+
             # create a dummy loop to calculate the init condition
             init_cond_output = self._create_subgraph_initial_cond(cond_g_info)
 
@@ -52,33 +55,12 @@ class LoopRewriter(LoopRewriterBase):
 
             body_nodes = set(cell_g_info.nodes + cond_g_info.nodes)
             body_outputs = cond_g_info.outputs + cell_g_info.outputs
-            for out_tensor_value_info in body_outputs:
-                shape = out_tensor_value_info.shape
-                utils.make_sure(
-                    shape is not None,
-                    "Conversion of Loop requries output shape [{}] exists".format(out_tensor_value_info.id)
-                )
-                out_tensor_value_info.shape = utils.create_vague_shape_like(shape)
-
-            loop_body_g = LoopRewriterBase.construct_graph_from_nodes(self.g, body_nodes, body_outputs)
+            loop_body_g = self._construct_body_graph(body_nodes, body_outputs)
 
             # create loop body graph inputs
             loop_body_g.add_graph_input(utils.make_name("i"), TensorProto.INT64, ())
             loop_body_g.add_graph_input(utils.make_name("cond"), TensorProto.BOOL, ())
-            for i, tensor_value_info in enumerate(loop_props.state_inputs):
-                input_name = tensor_value_info.id
-                if input_name is None:
-                    # if the variable is not used in the body graph, then we created a fake one,
-                    # the same type and shape as its corresponding output.
-                    out_tensor_value_info = loop_props.state_outputs[i]
-                    dtype = out_tensor_value_info.dtype
-                    shape = out_tensor_value_info.shape
-                    input_name = utils.make_name("unused_state_input_")
-                else:
-                    dtype = tensor_value_info.dtype
-                    shape = tensor_value_info.shape
-
-                loop_body_g.add_graph_input(input_name, dtype, utils.create_vague_shape_like(shape))
+            self._add_state_inputs(loop_body_g, loop_props)
 
             for input_ta in loop_props.tensor_array_inputs:
                 # Loop does not have scan inputs, so we use Gather to get data for each iteration.
@@ -102,6 +84,113 @@ class LoopRewriter(LoopRewriterBase):
             logger.error("loop rewrite failed, due to exception: %s, details:%s", ex, tb)
             return REWRITER_RESULT.FAIL
 
+    def _construct_body_graph(self, body_nodes, body_outputs):
+        for out_tensor_value_info in body_outputs:
+            shape = out_tensor_value_info.shape
+            utils.make_sure(
+                shape is not None,
+                "Conversion of Loop requries output shape [{}] exists".format(out_tensor_value_info.id)
+            )
+            out_tensor_value_info.shape = utils.create_vague_shape_like(shape)
+
+        return LoopRewriterBase.construct_graph_from_nodes(self.g, body_nodes, body_outputs)
+
+    @staticmethod
+    def _add_state_inputs(body_g, loop_props):
+        for i, tensor_value_info in enumerate(loop_props.state_inputs):
+            input_name = tensor_value_info.id
+            if input_name is None:
+                # if the variable is not used in the body graph, then we created a fake one,
+                # the same type and shape as its corresponding output.
+                out_tensor_value_info = loop_props.state_outputs[i]
+                dtype = out_tensor_value_info.dtype
+                shape = out_tensor_value_info.shape
+                input_name = utils.make_name("unused_state_input_")
+            else:
+                dtype = tensor_value_info.dtype
+                shape = tensor_value_info.shape
+
+            body_g.add_graph_input(input_name, dtype, utils.create_vague_shape_like(shape))
+
+    def _get_counters(self, loop_props):
+        """Return the state variables counting the iterations, they start from 0 and are increased by 1."""
+        counters = []
+        for var in loop_props.state_variables.values():
+            init = self.g.get_node_by_output(var.enter_input_id)
+            step = self.g.get_node_by_output(var.next_iteration_input.id)
+            if not init or not init.is_const() or init.get_tensor_value() != 0 or \
+                    not step or step.type not in ["Add", "AddV2"] or not var.switch_true_identity_output.id:
+                continue
+            if var.switch_true_identity_output.id not in step.input:
+                continue
+            increment = step.inputs[1 - step.input.index(var.switch_true_identity_output.id)]
+            if increment and increment.is_const() and increment.get_tensor_value() == 1:
+                counters.append(var)
+        return counters
+
+    def _get_cond_bounds(self, cond_id, counters):
+        """Return the bounds of cond if it is a conjunction of counter < const, None otherwise."""
+        node = self.g.get_node_by_output(cond_id)
+        if node is None:
+            return None
+        if node.type == "LogicalAnd":
+            bounds = [self._get_cond_bounds(i, counters) for i in node.input]
+            return None if None in bounds else bounds[0] + bounds[1]
+        # the condition graph reads the counters after they were increased
+        if node.type == "Less" and node.input[0] in [v.next_iteration_input.id for v in counters] and \
+                node.inputs[1].is_const():
+            return [node.inputs[1].get_tensor_value()]
+        return None
+
+    def _is_scan_loop(self, context):
+        """A loop is a Scan if it reads its tensor array inputs and writes its tensor array outputs at the index
+           of the iteration and runs once for each element of its inputs.
+        """
+        loop_props = context.loop_properties
+        if self.g.opset < 9 or not loop_props.tensor_array_inputs:
+            # Scan of opset 8 has a batch axis
+            return False
+        counters = self._get_counters(loop_props)
+        counter_ids = [v.switch_true_identity_output.id for v in counters]
+        if any(ta.index_input_id not in counter_ids for ta in loop_props.tensor_array_inputs) or \
+                any(v.ta_index_id not in counter_ids for v in loop_props.scan_variables.values()):
+            return False
+        bounds = self._get_cond_bounds(context.cond_graph.outputs[0].id, counters)
+        if not bounds or any(not isinstance(b, int) for b in bounds):
+            return False
+        trip_count = min(bounds)
+        for ta in loop_props.tensor_array_inputs:
+            shape = self.g.get_shape(ta.data_input_id)
+            if not shape or shape[0] != trip_count:
+                return False
+        return True
+
+    def _rewrite_as_scan(self, context):
+        logger.debug("rewrite loop as scan")
+        loop_props = context.loop_properties
+        cell_g_info = context.cell_graph
+
+        scan_body_g = self._construct_body_graph(set(cell_g_info.nodes), cell_g_info.outputs)
+        self._add_state_inputs(scan_body_g, loop_props)
+        for input_ta in loop_props.tensor_array_inputs:
+            scan_body_g.add_graph_input(input_ta.consumer.id, input_ta.consumer.dtype,
+                                        utils.create_vague_shape_like(input_ta.consumer.shape))
+
+        loop_outputs, loop_output_shapes, loop_output_dtypes = self._get_loop_outputs(loop_props)
+        scan_node = self.g.make_node("Scan", loop_props.state_inputs_initial_values +
+                                     loop_props.scan_inputs_initial_values,
+                                     attr={"num_scan_inputs": len(loop_props.tensor_array_inputs)},
+                                     outputs=loop_outputs, op_name_scope="generic_loop",
+                                     shapes=loop_output_shapes, dtypes=loop_output_dtypes,
+                                     skip_conversion=False)
+        scan_node.set_body_graph_as_attr("body", scan_body_g)
+
+        # Scan runs once for each element of its inputs, the condition is not needed any more
+        for node in set(context.cond_graph.nodes) - set(cell_g_info.nodes):
+            self.g.remove_node(node.name)
+        logger.debug("rewrite successfully")
+        return REWRITER_RESULT.OK
+
     def _create_subgraph_initial_cond(self, cond_graph):
         """Create subgraph to calculate initial cond."""
         # copy condition subgraph to parent graph
@@ -144,6 +233,20 @@ class LoopRewriter(LoopRewriterBase):
         return init_cond_output
 
     def _create_loop_node(self, context, loop_props, init_cond_output):
+        loop_outputs, loop_output_shapes, loop_output_dtypes = self._get_loop_outputs(loop_props)
+
+        # trip count and cond are not used, giving them values just because bug
+        # (https://github.com/Microsoft/onnxruntime/issues/255) of onnxruntime.
+        trip_cnt = self.g.make_const(utils.make_name("trip_count"), np.array(sys.maxsize, dtype=np.int64))
+        loop_node = self.g.make_node("Loop", [trip_cnt.output[0]] + [init_cond_output] +
+                                     loop_props.state_inputs_initial_values,  # ONNX Loop support state inputs only
+                                     outputs=loop_outputs, op_name_scope="generic_loop",
+                                     shapes=loop_output_shapes, dtypes=loop_output_dtypes,
+                                     skip_conversion=False)
+
+        return loop_node
+
+    def _get_loop_outputs(self, loop_props):
         loop_outputs = []
         loop_output_shapes = []
         loop_output_dtypes = []
@@ -158,14 +261,4 @@ class LoopRewriter(LoopRewriterBase):
                 loop_outputs.append(utils.make_name("unused_loop_output_"))
                 loop_output_shapes.append([-1])
                 loop_output_dtypes.append(None)
-
-        # trip count and cond are not used, giving them values just because bug
-        # (https://github.com/Microsoft/onnxruntime/issues/255) of onnxruntime.
-        trip_cnt = self.g.make_const(utils.make_name("trip_count"), np.array(sys.maxsize, dtype=np.int64))
-        loop_node = self.g.make_node("Loop", [trip_cnt.output[0]] + [init_cond_output] +
-                                     loop_props.state_inputs_initial_values,  # ONNX Loop support state inputs only
-                                     outputs=loop_outputs, op_name_scope="generic_loop",
-                                     shapes=loop_output_shapes, dtypes=loop_output_dtypes,
-                                     skip_conversion=False)
-
-        return loop_node
+        return loop_outputs, loop_output_shapes, loop_output_dtypes
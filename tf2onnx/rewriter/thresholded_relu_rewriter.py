@@ -5,8 +5,8 @@
 tf2onnx.rewriter - rewrite tensorflow subgraph to onnx ThresholdedRelu op
 """
 
+from tf2onnx import utils
 from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
-from tf2onnx.rewriter.leakyrelu_rewriter import _find_edge_name_between_nodes
 
 
 # pylint: disable=missing-docstring
@@ -36,8 +36,8 @@ def rewrite_thresholded_relu(g, ops):
         mul_input_node = match.get_op('mul_input')
         cast_node = match.get_op('cast')
 
-        greater_input_edge_name = _find_edge_name_between_nodes(greater_input_node, greater_node)
-        mul_input_edge_name = _find_edge_name_between_nodes(mul_input_node, mul_node)
+        greater_input_edge_name = utils.find_edge_name_between_nodes(greater_input_node, greater_node)
+        mul_input_edge_name = utils.find_edge_name_between_nodes(mul_input_node, mul_node)
         if greater_input_edge_name == mul_input_edge_name:
             theta = match.get_op('theta').get_tensor_value()
             thresholded_relu = g.make_node("ThresholdedRelu", inputs=[mul_input_edge_name], attr={"alpha": theta},
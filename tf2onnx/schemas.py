@@ -23,18 +23,24 @@ logger = logging.getLogger(__name__)
 class OnnxOpSchema(object):
     """Wrapper for Onnx schema."""
 
-    def __init__(self, name, domain, since_version, attributes):
+    def __init__(self, name, domain, since_version, attributes, inputs=None, outputs=None, type_constraints=None):
         """Create a Onnx schema
         Args:
             name (str): op name
             attributes (List[str]): valid attributes
             domain (str): default value "" means it's Onnx domain
             since_version (int): opset version, default is 1
+            inputs (List[OpSchema.FormalParameter]): formal inputs
+            outputs (List[OpSchema.FormalParameter]): formal outputs
+            type_constraints (Dict[str, List[str]]): allowed types of each type parameter, e.g. T
         """
         self._name = name
         self._domain = domain
         self._attributes = attributes
         self._since_version = since_version
+        self._inputs = inputs or []
+        self._outputs = outputs or []
+        self._type_constraints = type_constraints or {}
 
     @property
     def attributes(self):
@@ -52,17 +58,44 @@ class OnnxOpSchema(object):
     def since_version(self):
         return self._since_version
 
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def outputs(self):
+        return self._outputs
+
     @staticmethod
     def from_onnx_schema(onnx_schema):
         name = onnx_schema.name
         domain = onnx_schema.domain
         since_version = int(onnx_schema.since_version)
         attributes = onnx_schema.attributes
-        return OnnxOpSchema(name, domain, since_version, attributes)
+        type_constraints = {c.type_param_str: list(c.allowed_type_strs) for c in onnx_schema.type_constraints}
+        return OnnxOpSchema(name, domain, since_version, attributes, onnx_schema.inputs, onnx_schema.outputs,
+                            type_constraints)
 
     def has_attribute(self, attr):
         return attr in self.attributes
 
+    def is_optional_output(self, index):
+        if index >= len(self.outputs):
+            return False
+        return self.outputs[index].option == defs.OpSchema.FormalParameterOption.Optional
+
+    def allowed_types(self, formal_params, index):
+        """Type strings, e.g. tensor(float), allowed for the index-th of the inputs or outputs in formal_params."""
+        if not formal_params:
+            return []
+        if index >= len(formal_params):
+            # only the last formal parameter can be variadic
+            if formal_params[-1].option != defs.OpSchema.FormalParameterOption.Variadic:
+                return []
+            index = len(formal_params) - 1
+        type_str = formal_params[index].type_str
+        return self._type_constraints.get(type_str, [type_str])
+
 
 def _register_all_schemas_with_history():
     """Register all schemas with history"""
@@ -102,11 +135,18 @@ _schemas = _register_all_schemas_with_history()
 _domain_opset_versions = _parse_domain_opset_versions(_schemas)
 
 
+def has_schema(name, domain=None):
+    """Check if the op is in the schema registry, without adding it to the defaultdict."""
+    domain = domain or constants.ONNX_DOMAIN
+    return name in _schemas and domain in _schemas[name]
+
+
 def get_schema(name, max_inclusive_opset_version, domain=None):
     """Get schema by name within specific version."""
     domain = domain or constants.ONNX_DOMAIN
-    domain_version_schema_map = _schemas[name]
-    version_schema_map = domain_version_schema_map[domain]
+    if not has_schema(name, domain):
+        return None
+    version_schema_map = _schemas[name][domain]
     for version, schema in version_schema_map.items():
         if version <= max_inclusive_opset_version:
             return schema
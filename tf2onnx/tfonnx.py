@@ -16,6 +16,7 @@ import traceback
 import numpy as np
 from onnx import helper, onnx_pb
 import tensorflow as tf
+from tensorflow.core.framework import graph_pb2
 from tensorflow.python.framework import graph_util
 from tensorflow.tools.graph_transforms import TransformGraph
 
@@ -26,7 +27,7 @@ from tf2onnx.graph import Graph
 from tf2onnx.rewriter import *  # pylint: disable=wildcard-import
 from tf2onnx.shape_inference import infer_shape
 from tf2onnx.utils import port_name
-from . import constants, logging, schemas, utils, handler
+from . import constants, logging, profiler, schemas, utils, handler
 
 logger = logging.getLogger(__name__)
 
@@ -36,17 +37,63 @@ logger = logging.getLogger(__name__)
 # pylint: disable=unused-variable
 
 
+# ignore the following attributes
+_IGNORED_TF_ATTRS = ["unknown_rank", "_class", "Tshape", "use_cudnn_on_gpu", "Index", "Tpaddings",
+                     "TI", "Tparams", "Tindices", "Tlen", "Tdim", "dynamic_size", "Tmultiples",
+                     "Tblock_shape", "Tcrops", "index_type", "Taxis", "U", "maxval",
+                     "Tout", "Tlabels", "Tindex", "element_shape", "Targmax", "_output_shapes"]
+
+
+def tf_node_to_onnx(node, input_names, output_names, dtypes, attr_cnt):
+    """
+    Minimal conversion of attributes of a tf node and make an onnx node of it.
+    node can be a tf.Operation or anything exposing name, type, node_def and get_attr the same way.
+    """
+    attr = {}
+    for a in node.node_def.attr:
+        attr_cnt[a] += 1
+        if a == "dtype":
+            attr[a] = utils.map_tf_dtype(utils.get_tf_node_attr(node, "dtype"))
+        elif a == "T":
+            dtype = utils.get_tf_node_attr(node, "T")
+            if dtype:
+                if not isinstance(dtype, list):
+                    dtypes[node.name] = utils.map_tf_dtype(dtype)
+        elif a in ["output_type", "output_dtype", "out_type", "Tidx", "out_idx"]:
+            # Tidx is used by Range
+            # out_idx is used by ListDiff
+            attr[a] = utils.map_tf_dtype(utils.get_tf_node_attr(node, a))
+        elif a == "shape":
+            shape = utils.get_tf_shape_attr(node)
+            if shape is not None:
+                attr[a] = shape
+        elif a == "Tperm":
+            pass
+        elif a == "value":
+            onnx_tensor = utils.tf_to_onnx_tensor(utils.get_tf_node_attr(node, a), name=port_name(node.name))
+            attr[a] = onnx_tensor
+        elif a == "DstT":
+            attr["to"] = utils.map_tf_dtype(utils.get_tf_node_attr(node, "DstT"))
+        elif a == "SrcT":
+            continue
+        elif a in _IGNORED_TF_ATTRS:
+            continue
+        else:
+            attr[a] = utils.get_tf_node_attr(node, a)
+
+    try:
+        return helper.make_node(node.type, input_names, output_names, name=node.name, **attr)
+    except Exception as ex:
+        logger.error("pass1 convert failed for %s, ex=%s", node, ex)
+        raise
+
+
 def tflist_to_onnx(node_list, shape_override):
     """
     Convert the tf-node list into an onnx graph with minimal rewrites so
     we can use the onnx graph as intermediate graph.
     """
 
-    # ignore the following attributes
-    ignored_attr = ["unknown_rank", "_class", "Tshape", "use_cudnn_on_gpu", "Index", "Tpaddings",
-                    "TI", "Tparams", "Tindices", "Tlen", "Tdim", "dynamic_size", "Tmultiples",
-                    "Tblock_shape", "Tcrops", "index_type", "Taxis", "U", "maxval",
-                    "Tout", "Tlabels", "Tindex", "element_shape", "Targmax"]
     # some stats
     op_cnt = collections.Counter()
     attr_cnt = collections.Counter()
@@ -66,51 +113,11 @@ def tflist_to_onnx(node_list, shape_override):
             dtypes[out.name] = utils.map_tf_dtype(out.dtype)
             output_shapes[out.name] = shape
 
-    # minimal conversion of attributes
     for node in ops:
-        attr = {}
-        takeit = True
         op_cnt[node.type] += 1
-        for a in node.node_def.attr:
-            attr_cnt[a] += 1
-            if a == "dtype":
-                attr[a] = utils.map_tf_dtype(utils.get_tf_node_attr(node, "dtype"))
-            elif a == "T":
-                dtype = utils.get_tf_node_attr(node, "T")
-                if dtype:
-                    if not isinstance(dtype, list):
-                        dtypes[node.name] = utils.map_tf_dtype(dtype)
-            elif a in ["output_type", "output_dtype", "out_type", "Tidx", "out_idx"]:
-                # Tidx is used by Range
-                # out_idx is used by ListDiff
-                attr[a] = utils.map_tf_dtype(utils.get_tf_node_attr(node, a))
-            elif a == "shape":
-                shape = utils.get_tf_shape_attr(node)
-                if shape is not None:
-                    attr[a] = shape
-            elif a == "Tperm":
-                pass
-            elif a == "value":
-                onnx_tensor = utils.tf_to_onnx_tensor(utils.get_tf_node_attr(node, a), name=port_name(node.name))
-                attr[a] = onnx_tensor
-            elif a == "DstT":
-                attr["to"] = utils.map_tf_dtype(utils.get_tf_node_attr(node, "DstT"))
-            elif a == "SrcT":
-                continue
-            elif a in ignored_attr:
-                continue
-            else:
-                attr[a] = utils.get_tf_node_attr(node, a)
-
-        if takeit:
-            try:
-                input_names = [i.name for i in node.inputs]
-                output_names = [i.name for i in node.outputs]
-                onnx_node = helper.make_node(node.type, input_names, output_names, name=node.name, **attr)
-                onnx_nodes.append(onnx_node)
-            except Exception as ex:
-                logger.error("pass1 convert failed for %s, ex=%s", node, ex)
-                raise
+        input_names = [i.name for i in node.inputs]
+        output_names = [i.name for i in node.outputs]
+        onnx_nodes.append(tf_node_to_onnx(node, input_names, output_names, dtypes, attr_cnt))
 
     return onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes
 
@@ -122,6 +129,108 @@ def tensorflow_to_onnx(graph, shape_override):
     return tflist_to_onnx(graph.get_operations(), shape_override)
 
 
+class TFNodeDef(object):
+    """Wrap a NodeDef so it can be converted like a tf.Operation, without a tf.Graph behind it."""
+
+    def __init__(self, node_def, op_def):
+        self.node_def = node_def
+        self.op_def = op_def
+
+    @property
+    def name(self):
+        return self.node_def.name
+
+    @property
+    def type(self):
+        return self.node_def.op
+
+    @property
+    def input_names(self):
+        # control inputs are not data inputs, a name without port refers to output 0
+        return [i if ":" in i else port_name(i) for i in self.node_def.input if not i.startswith("^")]
+
+    def get_attr(self, name):
+        return utils.get_tf_node_def_attr(self.node_def, name, self.op_def)
+
+    def get_output_dtypes(self):
+        """Output dtypes derived from the output args of the OpDef."""
+        dtypes = []
+        for arg in self.op_def.output_arg:
+            if arg.type_list_attr:
+                dtypes.extend(self.get_attr(arg.type_list_attr))
+                continue
+            dtype = tf.as_dtype(arg.type) if arg.type else self.get_attr(arg.type_attr)
+            count = self.get_attr(arg.number_attr) if arg.number_attr else 1
+            dtypes.extend([dtype] * count)
+        return dtypes
+
+    def get_output_shapes(self, output_count):
+        """
+        Output shapes recorded in the _output_shapes attribute, None for outputs whose rank is unknown.
+        Const and Placeholder nodes created after the shapes were recorded are covered by their own attributes.
+        """
+        if "_output_shapes" in self.node_def.attr:
+            shapes = [utils.get_tf_shape_proto_dims(s) for s in self.node_def.attr["_output_shapes"].list.shape]
+            if len(shapes) == output_count:
+                return shapes
+        if utils.is_tf_const_op(self):
+            return [utils.get_tf_shape_proto_dims(self.node_def.attr["value"].tensor.tensor_shape)]
+        if self.type == "Placeholder" and "shape" in self.node_def.attr:
+            return [utils.get_tf_shape_proto_dims(self.node_def.attr["shape"].shape)]
+        return [None] * output_count
+
+    def __str__(self):
+        return str(self.node_def)
+
+
+def graphdef_to_onnx(graph_def):
+    """
+    Convert the NodeDefs of a GraphDef into an onnx graph without importing it into tensorflow.
+    Shapes are taken from the _output_shapes attributes (as_graph_def(add_shapes=True)).
+    Return None if an op is not registered in tensorflow or an output shape is unknown,
+    the caller needs to fall back to tensorflow shape inference in that case, and to propagate
+    overridden shapes.
+    """
+    op_cnt = collections.Counter()
+    attr_cnt = collections.Counter()
+    onnx_nodes = []
+    output_shapes = {}
+    dtypes = {}
+
+    nodes = []
+    for node_def in graph_def.node:
+        op_def = utils.get_tf_op_def(node_def.op)
+        if op_def is None:
+            logger.debug("op %s of node %s is not registered in tensorflow", node_def.op, node_def.name)
+            return None
+        node = TFNodeDef(node_def, op_def)
+        output_dtypes = node.get_output_dtypes()
+        shapes = node.get_output_shapes(len(output_dtypes))
+        output_names = []
+        for i, (dtype, shape) in enumerate(zip(output_dtypes, shapes)):
+            name = port_name(node.name, i)
+            if shape is None:
+                logger.debug("shape of %s is unknown in GraphDef", name)
+                return None
+            dtypes[name] = utils.map_tf_dtype(dtype)
+            output_shapes[name] = shape
+            output_names.append(name)
+        nodes.append((node, output_names))
+
+    for node, output_names in nodes:
+        op_cnt[node.type] += 1
+        onnx_nodes.append(tf_node_to_onnx(node, node.input_names, output_names, dtypes, attr_cnt))
+
+    return onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes
+
+
+def import_graph_def(graph_def):
+    """Import GraphDef into a new tf.Graph."""
+    with tf.Graph().as_default() as tf_graph:
+        tf.import_graph_def(graph_def, name="")
+    return tf_graph
+
+
 def rewrite_constant_fold(g, ops):
     """
     We call tensorflow transform with constant folding but in some cases tensorflow does
@@ -349,7 +458,9 @@ def tensorflow_onnx_mapping(g, ops_mapping):
                 logger.debug("finish handling subgraph of %s's attribute %s", node.name, attr)
 
         try:
-            func(g, node, **kwargs)
+            with profiler.handler("handler/" + op), utils.node_origin(node.name, "handler/" + op):
+                func(g, node, **kwargs)
+            g.provenance[node.name] = (node.name, "handler/" + op)
             node.skip_conversion = True
         except Exception as ex:
             logger.error("Failed to convert node %s\n%s", node.name, node.summary, exc_info=1)
@@ -420,8 +531,10 @@ def run_rewriters(g, funcs, continue_on_error):
     # 2. the graph here may have circles, current topological_sort cannot handle it.
     for func in funcs:
         try:
-            ops = func(g, g.get_nodes())
-            g.reset_nodes(ops)
+            with profiler.phase("rewriter/" + func.__name__, g), profiler.handler("rewriter/" + func.__name__), \
+                    utils.node_origin(None, "rewriter/" + func.__name__):
+                ops = func(g, g.get_nodes())
+                g.reset_nodes(ops)
         except Exception as ex:
             type_, value_, traceback_ = sys.exc_info()
             logger.error("rewriter %s: exception %s", func, ex)
@@ -448,10 +561,11 @@ def run_rewriters(g, funcs, continue_on_error):
 def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=None,
                      opset=None, custom_op_handlers=None, custom_rewriter=None,
                      extra_opset=None, shape_override=None, inputs_as_nchw=None,
-                     input_names=None, output_names=None):
+                     input_names=None, output_names=None, handler_stats=None, plan_layout=False):
     """Convert tensorflow graph to onnx graph.
         Args:
-            tf_graph: tensorflow graph
+            tf_graph: tensorflow graph, or GraphDef which is converted without importing it into tensorflow
+                if its nodes carry _output_shapes
             continue_on_error: if an op can't be processed (aka there is no mapping), continue
             verbose: print summary stats (deprecated)
             target: list of workarounds applied to help certain platforms
@@ -463,6 +577,10 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
             inputs_as_nchw: transpose inputs in list from nchw to nchw
             input_names: list of input node names in graph, input name format as node_name:port_id
             output_names: list of output node names in graph, output name format as node_name:port_id
+            handler_stats: dict to be filled with call count, time, nodes created/removed and onnx shape
+                inferences of every op handler and rewriter, see profiler.HandlerStats
+            plan_layout: run regions of NHWC conv, pool and batchnorm ops in NCHW so the handlers only
+                add transposes at the region boundaries
         Return:
             onnx graph
     """
@@ -471,6 +589,25 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
         logger.warning("Argument verbose for process_tf_graph is deprecated. Please use --verbose option instead.")
     del verbose
 
+    args = (tf_graph, continue_on_error, target, opset, custom_op_handlers, custom_rewriter,
+            extra_opset, shape_override, inputs_as_nchw, input_names, output_names, plan_layout)
+    if handler_stats is None and not logger.isEnabledFor(logging.DEBUG):
+        return _process_tf_graph(*args)
+
+    # the caller prints the table if it collects stats of the whole conversion
+    nested = profiler.handler_stats_enabled()
+    with profiler.HandlerStats() as stats:
+        g = _process_tf_graph(*args)
+    if handler_stats is not None:
+        handler_stats.update(stats.as_dict())
+    if not nested:
+        logger.debug("Handler stats:\n%s", stats.format_table())
+    return g
+
+
+def _process_tf_graph(tf_graph, continue_on_error, target, opset, custom_op_handlers, custom_rewriter,
+                      extra_opset, shape_override, inputs_as_nchw, input_names, output_names, plan_layout):
+
     logger.info("Using tensorflow=%s, onnx=%s, tf2onnx=%s/%s",
                 tf.__version__, utils.get_onnx_version(), tf2onnx.__version__, tf2onnx.version.git_version[:6])
 
@@ -481,8 +618,6 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
                        "please upgrade onnx package to avoid potential conversion issue.",
                        utils.get_onnx_version(), opset)
 
-    tf_graph = infer_shape(tf_graph, shape_override)
-
     if shape_override is None:
         shape_override = {}
     if inputs_as_nchw is None:
@@ -490,7 +625,23 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
     if target is None:
         target = constants.DEFAULT_TARGET
 
-    onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes = tensorflow_to_onnx(tf_graph, shape_override)
+    converted = None
+    if isinstance(tf_graph, graph_pb2.GraphDef):
+        if not shape_override:
+            with profiler.phase("graphdef_to_onnx", tf_graph):
+                converted = graphdef_to_onnx(tf_graph)
+        if converted is None:
+            # the _output_shapes don't follow overridden shapes, tensorflow shape inference propagates them
+            logger.info("GraphDef has incomplete or overridden shapes, use tensorflow shape inference")
+            with profiler.phase("import_graph_def", tf_graph):
+                tf_graph = import_graph_def(tf_graph)
+    if converted is None:
+        with profiler.phase("infer_shape", tf_graph) as span:
+            tf_graph = infer_shape(tf_graph, shape_override)
+            span.graph = tf_graph
+        with profiler.phase("tflist_to_onnx", tf_graph):
+            converted = tensorflow_to_onnx(tf_graph, shape_override)
+    onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes = converted
 
     io_to_check = []
     if input_names:
@@ -507,7 +658,9 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
                          non_exists)
             raise ValueError("Inputs/Outputs Not Found")
 
-    g = Graph(onnx_nodes, output_shapes, dtypes, target, opset, extra_opset, output_names)
+    with profiler.phase("create_graph") as span:
+        g = Graph(onnx_nodes, output_shapes, dtypes, target, opset, extra_opset, output_names)
+        span.graph = g
 
     # create ops mapping for the desired opsets
     ops_mapping = handler.tf_op.create_mapping(g.opset, g.extra_opset)
@@ -553,7 +706,8 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
     rewriters = [rewrite_transpose, rewrite_flatten, rewrite_gemm,
                  rewrite_random_uniform, rewrite_random_uniform_fold_const,
                  rewrite_random_normal, rewrite_dropout, rewrite_eye,
-                 rewrite_leakyrelu, rewrite_thresholded_relu, rewrite_conv2d_with_pad,
+                 rewrite_leakyrelu, rewrite_thresholded_relu, rewrite_layer_norm, rewrite_gelu,
+                 rewrite_conv2d_with_pad,
                  rewrite_single_direction_lstm, rewrite_bi_direction_lstm,
                  rewrite_single_direction_gru, rewrite_bi_direction_gru,
                  rewrite_custom_rnn_cell, rewrite_generic_loop, rewrite_cond,
@@ -561,14 +715,21 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
 
     if custom_rewriter is not None:
         rewriters.extend(custom_rewriter)
+    if plan_layout:
+        # last, the rewriters above match the NHWC layout of tensorflow
+        rewriters.append(rewrite_layout)
 
-    run_rewriters(g, rewriters, continue_on_error)
+    with profiler.phase("run_rewriters", g):
+        run_rewriters(g, rewriters, continue_on_error)
 
     # some nodes may already copied into inner Graph, so remove them from main Graph.
-    g.delete_unused_nodes(output_names)
-    topological_sort(g, continue_on_error)
+    with profiler.phase("delete_unused_nodes", g):
+        g.delete_unused_nodes(output_names)
+    with profiler.phase("topological_sort", g):
+        topological_sort(g, continue_on_error)
 
-    mapped_op, unmapped_op, exceptions = tensorflow_onnx_mapping(g, ops_mapping)
+    with profiler.phase("tensorflow_onnx_mapping", g):
+        mapped_op, unmapped_op, exceptions = tensorflow_onnx_mapping(g, ops_mapping)
     if unmapped_op:
         logger.error("Unsupported ops: %s", unmapped_op)
     if exceptions and not continue_on_error:
@@ -581,12 +742,15 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
     if constants.TARGET_RS6 in target:
         late_rewriters.append(rewrite_incomplete_type_support_rs6)
     if late_rewriters:
-        run_rewriters(g, late_rewriters, continue_on_error)
+        with profiler.phase("run_late_rewriters", g):
+            run_rewriters(g, late_rewriters, continue_on_error)
 
     # onnx requires topological sorting
-    topological_sort(g, continue_on_error)
+    with profiler.phase("topological_sort", g):
+        topological_sort(g, continue_on_error)
 
-    g.update_proto()
+    with profiler.phase("update_proto", g):
+        g.update_proto()
 
     logger.verbose(
         "Summay Stats:\n"
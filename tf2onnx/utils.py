@@ -13,6 +13,7 @@ import os
 import re
 import shutil
 import tempfile
+from contextlib import contextmanager
 from distutils.version import LooseVersion
 
 import requests
@@ -22,7 +23,7 @@ import six
 import numpy as np
 import tensorflow as tf
 from tensorflow.core.framework import types_pb2, tensor_pb2
-from tensorflow.python.framework import tensor_util
+from tensorflow.python.framework import op_def_registry, tensor_util
 from google.protobuf import text_format
 import onnx
 from onnx import helper, onnx_pb, defs, numpy_helper
@@ -109,6 +110,28 @@ def make_name(name):
     return "{}__{}".format(name, INTERNAL_NAME)
 
 
+# (tf node name, producer) of the handler, rewriter or optimizer that is making nodes
+_node_origins = []
+
+
+@contextmanager
+def node_origin(tf_node, producer):
+    """
+    Nodes made in this context are recorded in Graph.provenance as made by producer (for example
+    "handler/Conv2D") for tf node tf_node. tf_node None lets Graph.get_node_origin derive it from the name.
+    """
+    _node_origins.append((tf_node, producer))
+    try:
+        yield
+    finally:
+        _node_origins.pop()
+
+
+def get_node_origin():
+    """Return (tf node name, producer) of the innermost node_origin context, None outside of one."""
+    return _node_origins[-1] if _node_origins else None
+
+
 def split_nodename_and_shape(name):
     """input name with shape into name and shape."""
     # pattern for a node name
@@ -177,6 +200,54 @@ def get_tf_shape_attr(node):
     return dims
 
 
+def get_tf_shape_proto_dims(shape_proto):
+    """Get dims from tensorflow TensorShapeProto, None if rank is unknown."""
+    if shape_proto.unknown_rank:
+        return None
+    return [int(d.size) if d.size >= 0 else None for d in shape_proto.dim]
+
+
+def get_tf_op_def(op_type):
+    """Get the registered OpDef of a tensorflow op type, None if the op is not registered."""
+    if hasattr(op_def_registry, "get"):
+        return op_def_registry.get(op_type)
+    # TF < 1.14
+    return op_def_registry.get_registered_ops().get(op_type)
+
+
+def get_tf_node_def_attr(node_def, name, op_def=None):
+    """
+    Parse attribute of NodeDef the way tf.Operation.get_attr does, so NodeDefs can be
+    converted without importing them into a tf.Graph. Missing attributes fall back to
+    the default value in op_def.
+    """
+    if name in node_def.attr:
+        attr_value = node_def.attr[name]
+    else:
+        attr_value = None
+        if op_def is not None:
+            for attr_def in op_def.attr:
+                if attr_def.name == name and attr_def.HasField("default_value"):
+                    attr_value = attr_def.default_value
+                    break
+        make_sure(attr_value is not None, "attribute %s not found in node %s", name, node_def.name)
+
+    fields = ["s", "i", "f", "b", "type", "shape", "tensor", "func"]
+    if attr_value.HasField("list"):
+        for f in fields:
+            if getattr(attr_value.list, f):
+                if f == "type":
+                    return [tf.as_dtype(t) for t in attr_value.list.type]
+                return list(getattr(attr_value.list, f))
+        return []
+    for f in fields:
+        if attr_value.HasField(f):
+            if f == "type":
+                return tf.as_dtype(attr_value.type)
+            return getattr(attr_value, f)
+    return None
+
+
 def get_tf_tensor_shape(tensor):
     shape = []
     try:
@@ -326,6 +397,28 @@ def construct_graph_from_nodes(parent_g, nodes, outputs, shapes, dtypes):
     return g
 
 
+def find_edge_name_between_nodes(src_node, consumer_node):
+    """Find the first edge connecting src_node to consumer_node, None if there is none."""
+    for consumer_end in consumer_node.input:
+        for src_end in src_node.output:
+            if consumer_end == src_end:
+                return consumer_end
+    return None
+
+
+def remove_unused_nodes(g, nodes):
+    """Remove the nodes of a rewritten match nothing consumes anymore, others are still used outside of it."""
+    has_update = True
+    while has_update:
+        has_update = False
+        for node in nodes:
+            if node.graph is None or set(node.output).intersection(g.outputs):
+                continue
+            if not any(g.find_output_consumers(out) for out in node.output):
+                g.remove_node(node.name)
+                has_update = True
+
+
 def tf_name_scope(name):
     return '/'.join(name.split('/')[:-1])
 